@@ -0,0 +1,100 @@
+import os
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.dataset as ds
+from luluka_store import parse_price
+
+# Directorio raíz del archivo histórico en Parquet
+ARCHIVE_DIR = "luluka_archive"
+
+# Columnas de texto con pocos valores distintos: se guardan con diccionario
+DICTIONARY_COLUMNS = ['Type', 'Variant', 'Availability']
+
+# Esquema de las fichas de producto archivadas (las particiones van aparte)
+DETAIL_SCHEMA = pa.schema([
+    ('Ref', pa.string()),
+    ('Product', pa.string()),
+    ('Type', pa.dictionary(pa.int32(), pa.string())),
+    ('Product Variant', pa.string()),
+    ('Variant', pa.dictionary(pa.int32(), pa.string())),
+    ('Price', pa.string()),
+    ('Price Value', pa.float64()),
+    ('Availability', pa.dictionary(pa.int32(), pa.string())),
+    ('Description', pa.string()),
+    ('Link', pa.string()),
+    ('Observed At', pa.timestamp('s', tz='UTC')),
+    ('run_date', pa.string()),
+    ('Category', pa.string()),
+])
+
+# Particionado por fecha de ejecución y categoría (estilo Hive: run_date=.../Category=...)
+PARTITIONING = ds.partitioning(
+    pa.schema([('run_date', pa.string()), ('Category', pa.string())]),
+    flavor='hive'
+)
+
+
+def write_snapshot(product_details, base_dir=ARCHIVE_DIR, observed_at=None):
+    """Archiva las filas de detalle de una ejecución como dataset Parquet particionado"""
+    if not product_details:
+        return None
+    observed_at = observed_at or datetime.now(timezone.utc).replace(microsecond=0)
+    run_date = observed_at.strftime('%Y-%m-%d')
+
+    columns = {name: [] for name in DETAIL_SCHEMA.names}
+    for row in product_details:
+        for name in DETAIL_SCHEMA.names:
+            if name == 'Price Value':
+                columns[name].append(parse_price(row.get('Price')))
+            elif name == 'Observed At':
+                columns[name].append(observed_at)
+            elif name == 'run_date':
+                columns[name].append(run_date)
+            else:
+                value = row.get(name)
+                columns[name].append(None if value is None else str(value))
+    table = pa.table(columns, schema=DETAIL_SCHEMA)
+
+    # Un fichero por partición y ejecución; las ejecuciones del mismo día no se pisan
+    ds.write_dataset(
+        table,
+        base_dir,
+        format='parquet',
+        partitioning=PARTITIONING,
+        basename_template=f"part-{observed_at.strftime('%H%M%S')}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=ds.ParquetFileFormat().make_write_options(
+            compression='zstd', use_dictionary=DICTIONARY_COLUMNS + ['Ref', 'Product']
+        ),
+    )
+    print(f"Instantánea archivada en {os.path.join(base_dir, f'run_date={run_date}')}")
+    return run_date
+
+
+def load_snapshots(base_dir=ARCHIVE_DIR, columns=None, categories=None, start=None, end=None, refs=None):
+    """Carga fichas archivadas leyendo solo las particiones y columnas necesarias.
+
+    `start` y `end` son fechas 'AAAA-MM-DD' (inclusive). Los filtros de fecha
+    y categoría se resuelven con las particiones, sin abrir el resto de
+    ficheros; el de referencias usa las estadísticas de cada fichero.
+    """
+    if not os.path.isdir(base_dir):
+        raise FileNotFoundError(f"No existe el archivo histórico {base_dir}")
+    dataset = ds.dataset(base_dir, format='parquet', partitioning=PARTITIONING)
+
+    conditions = []
+    if start:
+        conditions.append(ds.field('run_date') >= start)
+    if end:
+        conditions.append(ds.field('run_date') <= end)
+    if categories:
+        conditions.append(ds.field('Category').isin(list(categories)))
+    if refs:
+        conditions.append(ds.field('Ref').isin([str(ref) for ref in refs]))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
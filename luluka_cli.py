@@ -0,0 +1,175 @@
+import argparse
+import gzip
+import importlib
+import json
+import os
+import sys
+from luluka_logging import LOG_LEVEL, setup_logging
+
+# Directorio donde cada etapa deja su resultado para la siguiente
+ARTIFACTS_DIR = "luluka_artifacts"
+
+# Fichero de cada etapa (JSON Lines comprimido con gzip: una fila por línea)
+ARTIFACTS = {
+    'categories': "categories.jsonl.gz",
+    'list': "products.jsonl.gz",
+    'details': "details.jsonl.gz",
+    'sample': "sample.jsonl.gz",
+    'estimates': "estimates.jsonl.gz",
+}
+
+
+def artifact_path(artifacts_dir, stage):
+    return os.path.join(artifacts_dir, ARTIFACTS[stage])
+
+
+def write_artifact(artifacts_dir, stage, rows):
+    """Guarda las filas de una etapa; se escribe a un temporal para no dejar ficheros a medias"""
+    os.makedirs(artifacts_dir, exist_ok=True)
+    path = artifact_path(artifacts_dir, stage)
+    tmp_path = path + ".tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write('\n')
+    os.replace(tmp_path, path)
+    print(f"{len(rows)} filas guardadas en {path}")
+    return path
+
+
+def read_artifact(artifacts_dir, stage):
+    """Lee las filas de una etapa anterior (None si aún no se ha ejecutado)"""
+    path = artifact_path(artifacts_dir, stage)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def require_artifact(artifacts_dir, stage):
+    rows = read_artifact(artifacts_dir, stage)
+    if rows is None:
+        print(f"No existe {artifact_path(artifacts_dir, stage)}. Ejecuta antes: python luluka_cli.py {stage}")
+        sys.exit(1)
+    return rows
+
+
+def load_scraper(args):
+    """Importa el script de scraping elegido e inicia sesión si hace falta"""
+    scraper = importlib.import_module('luluka_scraper_login' if args.login else 'luluka_scraper')
+    scraper.LISTING_ONLY = args.listing_only
+    if args.deadline is not None:
+        from luluka_transport import Deadline
+        scraper.crawl_deadline = Deadline(args.deadline * 60)
+    if args.login and not scraper.login():
+        print("No se pudo iniciar sesión. Saliendo...")
+        sys.exit(1)
+    return scraper
+
+
+# Subcomandos
+
+def run_categories(args):
+    scraper = load_scraper(args)
+    categories = scraper.extract_categories()
+    print(f"Se encontraron {len(categories)} categorías")
+    write_artifact(args.artifacts, 'categories', categories)
+
+
+def run_list(args):
+    categories = require_artifact(args.artifacts, 'categories')
+    if args.category:
+        categories = [cat for cat in categories if cat['Category'] in args.category]
+    scraper = load_scraper(args)
+    product_list = scraper.extract_product_list(categories)
+    print(f"Se encontraron {len(product_list)} productos")
+    write_artifact(args.artifacts, 'list', product_list)
+
+
+def run_details(args):
+    from luluka_scheduler import extract_with_schedule
+
+    product_list = require_artifact(args.artifacts, 'list')
+    if args.category:
+        product_list = [product for product in product_list if product['Category'] in args.category]
+    scraper = load_scraper(args)
+    budget = args.budget if args.budget is not None else scraper.FETCH_BUDGET
+    # En modo solo listado solo se descargan las fichas de los productos sin precio en el listado
+    listing_details, to_fetch = [], product_list
+    if args.listing_only:
+        from luluka_extractor import split_listing_details
+        listing_details, to_fetch = split_listing_details(product_list)
+        print(f"Precios tomados del listado: {len(listing_details)}; fichas a descargar: {len(to_fetch)}")
+    product_details = listing_details + extract_with_schedule(scraper.extract_product_details, to_fetch, budget,
+                                                              deadline=scraper.crawl_deadline)
+    print(f"Se procesaron {len(product_details)} detalles de productos")
+    write_artifact(args.artifacts, 'details', product_details)
+
+
+def run_sample(args):
+    from luluka_sampling import sample_catalog
+
+    product_list = require_artifact(args.artifacts, 'list')
+    if args.category:
+        product_list = [product for product in product_list if product['Category'] in args.category]
+    scraper = load_scraper(args)
+    product_details, estimates = sample_catalog(
+        scraper.extract_product_details, product_list, args.margin, args.confidence, args.seed
+    )
+    write_artifact(args.artifacts, 'sample', product_details)
+    write_artifact(args.artifacts, 'estimates', estimates)
+
+
+def run_export(args):
+    # La exportación no descarga nada: no hace falta iniciar sesión
+    scraper = importlib.import_module('luluka_scraper_login' if args.login else 'luluka_scraper')
+    categories = read_artifact(args.artifacts, 'categories') or []
+    product_list = read_artifact(args.artifacts, 'list') or []
+    product_details = require_artifact(args.artifacts, 'details')
+    scraper.export_results(categories, product_list, product_details, args.output or scraper.OUTPUT_FILE)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scraping de Lulukabaraka.com por etapas: categories → list → details → export"
+    )
+    parser.add_argument('--artifacts', default=ARTIFACTS_DIR, help="Directorio de los resultados intermedios")
+    parser.add_argument('--login', action='store_true', help="Usar la versión con inicio de sesión")
+    parser.add_argument('--deadline', type=float,
+                        help="Minutos máximos de la etapa; al agotarse se guarda lo obtenido hasta entonces")
+    parser.add_argument('--listing-only', action='store_true',
+                        help="Tomar precio y disponibilidad de los listados y descargar solo las fichas sin precio")
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        help="Nivel de los eventos JSON (DEBUG muestra todos los eventos por página)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    categories = subparsers.add_parser('categories', help="Extrae las categorías del sitio")
+    categories.set_defaults(func=run_categories)
+
+    listing = subparsers.add_parser('list', help="Extrae la lista de productos de las categorías guardadas")
+    listing.add_argument('--category', action='append', help="Limitar a esta categoría (se puede repetir)")
+    listing.set_defaults(func=run_list)
+
+    details = subparsers.add_parser('details', help="Extrae los detalles de los productos guardados")
+    details.add_argument('--category', action='append', help="Limitar a esta categoría (se puede repetir)")
+    details.add_argument('--budget', type=int, help="Máximo de fichas a descargar (plan de revisitas)")
+    details.set_defaults(func=run_details)
+
+    sample = subparsers.add_parser('sample', help="Estima precios medios y productos 'Consultar' con una muestra")
+    sample.add_argument('--category', action='append', help="Limitar a esta categoría (se puede repetir)")
+    sample.add_argument('--margin', type=float, default=0.1, help="Margen de error de las proporciones (0.1 = ±10%%)")
+    sample.add_argument('--confidence', type=float, default=0.95, help="Nivel de confianza")
+    sample.add_argument('--seed', type=int, help="Semilla para repetir la misma muestra")
+    sample.set_defaults(func=run_sample)
+
+    export = subparsers.add_parser('export', help="Genera el Excel y actualiza el histórico")
+    export.add_argument('--output', help="Fichero Excel de salida")
+    export.set_defaults(func=run_export)
+
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
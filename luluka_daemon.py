@@ -0,0 +1,243 @@
+import argparse
+import json
+import queue
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote, urljoin
+from requests.adapters import HTTPAdapter
+
+import luluka_scraper_login as scraper
+from luluka_extractor import product_ref
+from luluka_logging import LOG_LEVEL, setup_logging
+
+# Base de datos de la caché de resultados del demonio
+CACHE_DB = "luluka_daemon.db"
+
+# Tiempo (segundos) tras el que una entrada de la caché se considera obsoleta
+DEFAULT_TTL = 3600
+
+# Tiempo (segundos) tras el que se renueva la sesión autenticada
+RELOGIN_INTERVAL = 6 * 3600
+
+
+class ResultCache:
+    """Caché de resultados en memoria respaldada por SQLite"""
+
+    def __init__(self, path=CACHE_DB):
+        self._lock = threading.Lock()
+        self._memory = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, fetched_at REAL)'
+        )
+        self.conn.commit()
+        # Cargar la caché persistida para responder en caliente tras un reinicio
+        for key, value, fetched_at in self.conn.execute('SELECT key, value, fetched_at FROM cache'):
+            self._memory[key] = (json.loads(value), fetched_at)
+
+    def get(self, key):
+        """Devuelve (valor, instante de obtención) o None"""
+        with self._lock:
+            return self._memory.get(key)
+
+    def values_with_prefix(self, prefix):
+        with self._lock:
+            return [value for key, (value, _) in self._memory.items() if key.startswith(prefix)]
+
+    def set(self, key, value):
+        fetched_at = time.time()
+        with self._lock:
+            self._memory[key] = (value, fetched_at)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, fetched_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), fetched_at)
+            )
+            self.conn.commit()
+
+
+class LulukaDaemon:
+    """Mantiene una sesión autenticada y sirve los datos desde la caché.
+
+    Las consultas se responden siempre con lo que hay en caché; si la entrada
+    ha caducado se encola su actualización en segundo plano. Solo cuando no
+    hay ningún dato previo se hace el scraping en la propia petición.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, cache_path=CACHE_DB, use_login=True, pool_size=10):
+        self.ttl = ttl
+        self.use_login = use_login
+        self.cache = ResultCache(cache_path)
+        self.last_login = 0
+        self._login_lock = threading.Lock()
+        # Los recorridos de categorías y listados se serializan (reentrante: un
+        # listado puede necesitar antes las categorías); las fichas sueltas
+        # usan la sesión a la vez, con el pool de conexiones del adaptador
+        self._scrape_lock = threading.RLock()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._queue = queue.Queue()
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        scraper.session.mount('http://', adapter)
+        scraper.session.mount('https://', adapter)
+
+    def ensure_login(self):
+        if not self.use_login:
+            return
+        with self._login_lock:
+            if time.time() - self.last_login >= RELOGIN_INTERVAL:
+                if scraper.login():
+                    self.last_login = time.time()
+                else:
+                    print("No se pudo iniciar sesión. Se continúa sin autenticación.")
+
+    # Operaciones de scraping por clave de caché
+
+    def _scrape(self, key):
+        kind, _, name = key.partition(':')
+        if kind == 'product':
+            # Una ficha es una sola petición: no espera a que termine un listado en curso
+            self.ensure_login()
+            return scraper.extract_product_details([self._find_product(name)])
+        with self._scrape_lock:
+            self.ensure_login()
+            if key == 'categories':
+                return scraper.extract_categories()
+            if kind == 'products':
+                categories = [cat for cat in self.categories() if cat['Category'] == name]
+                return scraper.extract_product_list(categories)
+            raise KeyError(key)
+
+    def _find_product(self, ref):
+        """Producto de una referencia, tomado de los listados cacheados si es posible"""
+        for products in self.cache.values_with_prefix('products:'):
+            for product in products:
+                if product_ref(product['Link']) == ref:
+                    return product
+        return {
+            'Category': '',
+            'Product': f"Producto {ref}",
+            'Link': urljoin(scraper.BASE_URL, f"fitxaProducte.aspx?idproducte={ref}")
+        }
+
+    def refresh(self, key):
+        value = self._scrape(key)
+        if value:
+            self.cache.set(key, value)
+        return value
+
+    # Actualización en segundo plano
+
+    def schedule_refresh(self, key):
+        with self._pending_lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put(key)
+
+    def _refresh_worker(self):
+        while True:
+            key = self._queue.get()
+            try:
+                self.refresh(key)
+            except Exception as e:
+                print(f"Error al actualizar {key}: {e}")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(key)
+
+    def start(self):
+        self.ensure_login()
+        threading.Thread(target=self._refresh_worker, daemon=True).start()
+
+    def lookup(self, key):
+        """Devuelve (valor, instante de obtención, obsoleto) para una clave"""
+        cached = self.cache.get(key)
+        if cached is None:
+            value = self.refresh(key)
+            return value, time.time(), False
+        value, fetched_at = cached
+        stale = time.time() - fetched_at > self.ttl
+        if stale:
+            self.schedule_refresh(key)
+        return value, fetched_at, stale
+
+    def categories(self):
+        return self.lookup('categories')[0] or []
+
+
+def make_handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            path = parts.path.rstrip('/')
+            params = parse_qs(parts.query)
+
+            if path == '/categories':
+                key = 'categories'
+            elif path == '/products':
+                category = params.get('category', [''])[0]
+                if not category:
+                    self._send(400, {'error': "Falta el parámetro 'category'"})
+                    return
+                key = f"products:{category}"
+            elif path.startswith('/product/') and len(path) > len('/product/'):
+                key = f"product:{unquote(path[len('/product/'):])}"
+            else:
+                self._send(404, {'error': 'Ruta no encontrada'})
+                return
+
+            try:
+                value, fetched_at, stale = daemon.lookup(key)
+            except Exception as e:
+                self._send(502, {'error': str(e)})
+                return
+            if not value:
+                self._send(404, {'error': 'Sin resultados'})
+                return
+            self._send(200, {'data': value, 'fetched_at': fetched_at, 'stale': stale})
+
+        def log_message(self, format, *args):
+            # Evitar una línea por petición en la salida estándar
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Demonio de consulta de datos de Lulukabaraka.com")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttl', type=int, default=DEFAULT_TTL, help="Segundos hasta que una entrada se considera obsoleta")
+    parser.add_argument('--cache', default=CACHE_DB, help="Fichero SQLite de la caché")
+    parser.add_argument('--no-login', action='store_true', help="No iniciar sesión en el sitio")
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        help="Nivel de los eventos JSON (DEBUG muestra todos los eventos por página)")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    daemon = LulukaDaemon(ttl=args.ttl, cache_path=args.cache, use_login=not args.no_login)
+    daemon.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(daemon))
+    print(f"Sirviendo en http://{args.host}:{args.port} (/categories, /products?category=, /product/<ref>)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Deteniendo el demonio...")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import os
+import pandas as pd
+from luluka_extractor import LISTING_VARIANT, product_ref
+
+# Clave que identifica una fila de detalle entre ejecuciones
+KEY_COLUMNS = ['Ref', 'Product Variant']
+
+# Columnas cuyo cambio se notifica
+COMPARED_COLUMNS = ['Price', 'Availability']
+
+# Columnas descriptivas que se conservan en el informe
+INFO_COLUMNS = ['Category', 'Product', 'Link']
+
+# Etiquetas de la columna 'Change' de la hoja de cambios
+CHANGE_LABELS = {'added': "Añadido", 'removed': "Eliminado", 'changed': "Modificado"}
+
+
+def price_values(prices):
+    """Convierte una serie de precios ('1.234,56€', 'Consultar'...) a números de forma vectorizada"""
+    text = prices.astype('string').str.extract(r'([\d.,]+)', expand=False).str.strip('.,')
+    # Formato español: punto para miles y coma decimal
+    has_comma = text.str.contains(',', regex=False, na=False)
+    text = text.where(~has_comma, text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    many_dots = text.str.count(r'\.').fillna(0) > 1
+    text = text.where(~many_dots, text.str.replace('.', '', regex=False))
+    return pd.to_numeric(text, errors='coerce')
+
+
+def _prepare(details):
+    df = details if isinstance(details, pd.DataFrame) else pd.DataFrame(list(details))
+    columns = KEY_COLUMNS + COMPARED_COLUMNS + INFO_COLUMNS
+    df = df.reindex(columns=columns)
+    df[KEY_COLUMNS + COMPARED_COLUMNS] = df[KEY_COLUMNS + COMPARED_COLUMNS].astype('string').fillna('')
+    # Una misma clave puede repetirse (p. ej. variantes sin nombre propio): se compara la primera
+    return df.drop_duplicates(subset=KEY_COLUMNS, keep='first')
+
+
+def _align_listing_rows(prev, cur):
+    """Empareja los productos que una ejecución tomó del listado y la otra de su ficha.
+
+    Las filas del modo solo listado llevan la variante LISTING_VARIANT. Si en
+    la otra ejecución el producto tiene una sola fila, se compara con ella;
+    si tiene varias variantes no son comparables y el producto se omite en
+    las dos, en lugar de darlo por añadido y eliminado.
+    """
+    listed_prev = set(prev.loc[prev['Product Variant'] == LISTING_VARIANT, 'Ref'])
+    listed_cur = set(cur.loc[cur['Product Variant'] == LISTING_VARIANT, 'Ref'])
+    switched = listed_prev ^ listed_cur
+    if not switched:
+        return prev, cur
+
+    rows_prev = prev['Ref'].value_counts()
+    rows_cur = cur['Ref'].value_counts()
+    single = {ref for ref in switched if rows_prev.get(ref, 0) <= 1 and rows_cur.get(ref, 0) <= 1}
+    skipped = switched - single
+
+    prev = prev.loc[~prev['Ref'].isin(skipped)].copy()
+    cur = cur.loc[~cur['Ref'].isin(skipped)].copy()
+    prev.loc[prev['Ref'].isin(single), 'Product Variant'] = LISTING_VARIANT
+    cur.loc[cur['Ref'].isin(single), 'Product Variant'] = LISTING_VARIANT
+    return prev, cur
+
+
+def compare_runs(previous, current):
+    """Compara dos conjuntos de detalles y devuelve las tablas 'added', 'removed' y 'changed'.
+
+    Las filas se emparejan por (Ref, Product Variant) con un único merge
+    externo; todas las comparaciones son operaciones vectorizadas. Los
+    productos tomados del listado en una ejecución y de su ficha en la otra
+    se emparejan aparte (ver _align_listing_rows).
+    """
+    prev, cur = _align_listing_rows(_prepare(previous), _prepare(current))
+
+    merged = prev.merge(cur, on=KEY_COLUMNS, how='outer', suffixes=(' (anterior)', ''), indicator=True)
+
+    added = merged.loc[merged['_merge'] == 'right_only', KEY_COLUMNS + COMPARED_COLUMNS + INFO_COLUMNS]
+
+    removed = merged.loc[merged['_merge'] == 'left_only']
+    removed = removed[KEY_COLUMNS + [f"{col} (anterior)" for col in COMPARED_COLUMNS + INFO_COLUMNS]]
+    removed.columns = KEY_COLUMNS + COMPARED_COLUMNS + INFO_COLUMNS
+
+    both = merged.loc[merged['_merge'] == 'both']
+    differs = pd.Series(False, index=both.index)
+    for col in COMPARED_COLUMNS:
+        differs |= both[f"{col} (anterior)"] != both[col]
+    changed = both.loc[differs, INFO_COLUMNS[:2] + KEY_COLUMNS
+                       + [name for col in COMPARED_COLUMNS for name in (f"{col} (anterior)", col)]
+                       + INFO_COLUMNS[2:]]
+    changed = changed.assign(**{
+        'Price Change': price_values(changed['Price']) - price_values(changed['Price (anterior)'])
+    })
+
+    return {
+        'added': added.reset_index(drop=True),
+        'removed': removed.reset_index(drop=True),
+        'changed': changed.reset_index(drop=True),
+    }
+
+
+def carry_forward(previous, current, product_list=(), listed_categories=None):
+    """Completa los detalles de una ejecución parcial con las filas de la anterior.
+
+    Con presupuesto de peticiones, plan de revisitas, tiempo límite, modo solo
+    listado o categorías seleccionadas no se descargan todas las fichas: sin
+    esto, cada producto no descargado aparecería como eliminado y, en la
+    ejecución siguiente, como añadido. Se conservan las filas anteriores de los
+    productos sin ficha descargada, salvo los que ya no aparecen en una
+    categoría listada entera en esta ejecución (esos sí se han eliminado). Las
+    categorías listadas son por defecto las de `product_list`; si los listados
+    se cortaron antes de tiempo, se pasa `listed_categories=()`.
+    """
+    prev = previous if isinstance(previous, pd.DataFrame) else pd.DataFrame(list(previous))
+    cur = current if isinstance(current, pd.DataFrame) else pd.DataFrame(list(current))
+    if prev.empty or 'Ref' not in prev.columns:
+        return cur
+    if listed_categories is None:
+        listed_categories = {product['Category'] for product in product_list}
+    listed_refs = {product_ref(product['Link']) for product in product_list}
+
+    refs = prev['Ref'].astype(str)
+    fetched = set(cur['Ref'].astype(str)) if 'Ref' in cur.columns else set()
+    gone = prev['Category'].isin(set(listed_categories)) & ~refs.isin(listed_refs)
+    keep = ~refs.isin(fetched) & ~gone
+    if not keep.any():
+        return cur
+    carried = prev.loc[keep].reindex(columns=cur.columns if len(cur.columns) else prev.columns)
+    return pd.concat([cur, carried], ignore_index=True)
+
+
+def summarize_changes(changes):
+    """Número de filas añadidas, eliminadas y modificadas"""
+    return {kind: len(table) for kind, table in changes.items()}
+
+
+def changes_sheet(changes):
+    """Une las tres tablas en una sola, con la columna 'Change' indicando el tipo"""
+    frames = [table.assign(Change=CHANGE_LABELS[kind]) for kind, table in changes.items() if len(table)]
+    if not frames:
+        return pd.DataFrame(columns=['Change'] + KEY_COLUMNS + COMPARED_COLUMNS)
+    sheet = pd.concat(frames, ignore_index=True)
+    return sheet[['Change'] + [col for col in sheet.columns if col != 'Change']]
+
+
+def load_previous_details(filename, sheet_name='Products'):
+    """Lee los detalles de la exportación anterior (None si no existe)"""
+    if not os.path.exists(filename):
+        return None
+    try:
+        return pd.read_excel(filename, sheet_name=sheet_name, dtype=str, keep_default_na=False)
+    except Exception as e:
+        print(f"No se pudo leer la exportación anterior {filename}: {e}")
+        return None
@@ -0,0 +1,499 @@
+import json
+import os
+import re
+from bs4 import Tag
+
+# Esquema declarativo de la extracción: selectores y expresiones regulares
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "luluka_schema.json")
+
+
+def load_schema(path=SCHEMA_FILE):
+    """Lee el esquema de extracción (JSON)"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Gramática mínima de selectores CSS: etiqueta, clases, atributos,
+# :first-child / :nth-child(n) y el combinador descendiente
+_COMPOUND_RE = re.compile(r'^(?P<tag>[a-zA-Z][\w-]*|\*)?(?P<rest>.*)$')
+_PART_RE = re.compile(
+    r'\.(?P<cls>[\w-]+)'
+    r'|\[(?P<attr>[\w-]+)(?:(?P<op>[*^$~]?=)"(?P<value>[^"]*)")?\]'
+    r'|:(?P<pseudo>first-child|nth-child\((?P<nth>\d+)\))'
+)
+
+
+class Compound:
+    """Selector simple (sin combinadores) que se comprueba contra una etiqueta"""
+
+    def __init__(self, text):
+        match = _COMPOUND_RE.match(text)
+        tag = match.group('tag')
+        self.tag = None if tag in (None, '*') else tag.lower()
+        self.classes = []
+        self.attrs = []
+        self.nth = None
+
+        rest = match.group('rest')
+        pos = 0
+        while pos < len(rest):
+            part = _PART_RE.match(rest, pos)
+            if not part:
+                raise ValueError(f"Selector no soportado: {text}")
+            if part.group('cls'):
+                self.classes.append(part.group('cls'))
+            elif part.group('attr'):
+                self.attrs.append((part.group('attr').lower(), part.group('op'), part.group('value')))
+            else:
+                self.nth = int(part.group('nth')) if part.group('nth') else 1
+            pos = part.end()
+
+        if not (self.tag or self.classes or self.attrs or self.nth):
+            raise ValueError(f"Selector vacío: {text}")
+
+    def key(self):
+        """Clave por la que se indexa el selector durante el recorrido"""
+        if self.tag:
+            return ('tag', self.tag)
+        if self.classes:
+            return ('class', self.classes[0])
+        if self.attrs:
+            return ('attr', self.attrs[0][0])
+        return ('any', None)
+
+    def matches(self, tag, classes, index):
+        if self.tag and tag.name != self.tag:
+            return False
+        for cls in self.classes:
+            if cls not in classes:
+                return False
+        if self.nth and index != self.nth:
+            return False
+        for name, op, value in self.attrs:
+            actual = tag.attrs.get(name)
+            if actual is None:
+                return False
+            if op is None:
+                continue
+            if isinstance(actual, list):
+                actual = ' '.join(actual)
+            # En HTML el valor de "type" no distingue mayúsculas
+            if name == 'type':
+                actual, value = actual.lower(), value.lower()
+            if op == '=':
+                if actual != value:
+                    return False
+            elif not value:
+                return False
+            elif op == '*=':
+                if value not in actual:
+                    return False
+            elif op == '^=':
+                if not actual.startswith(value):
+                    return False
+            elif op == '$=':
+                if not actual.endswith(value):
+                    return False
+            elif op == '~=':
+                if value not in actual.split():
+                    return False
+        return True
+
+
+class Selector:
+    """Grupo de selectores separados por comas, precompilado"""
+
+    def __init__(self, text):
+        self.text = text
+        self.chains = []
+        for chain in text.split(','):
+            compounds = [Compound(part) for part in chain.split()]
+            if not compounds:
+                raise ValueError(f"Selector vacío: {text}")
+            self.chains.append(compounds)
+
+
+def compile_selector(text):
+    """Compila un selector CSS de la gramática soportada"""
+    return Selector(text)
+
+
+def _tag_classes(tag):
+    classes = tag.attrs.get('class')
+    if not classes:
+        return ()
+    if isinstance(classes, str):
+        return classes.split()
+    return classes
+
+
+class SinglePassExtractor:
+    """Recorre el árbol una sola vez y recoge todos los candidatos de cada campo.
+
+    Los campos se declaran como listas de selectores en orden de prioridad.
+    Para cada selector se guardan sus coincidencias en orden de documento y las
+    prioridades se resuelven después en memoria. Los elementos que coinciden con
+    un selector de "grupos" (p. ej. variantes) registran además su primer
+    descendiente que cumple cada uno de los subselectores indicados, que es lo
+    que devolvería `select_one` sobre ese elemento.
+    """
+
+    def __init__(self, fields, group_fields=None, group_lookups=None):
+        self.fields = {name: [compile_selector(s) for s in sels] for name, sels in fields.items()}
+        self.group_fields = {name: [compile_selector(s) for s in sels] for name, sels in (group_fields or {}).items()}
+        self.group_lookups = {name: compile_selector(s) for name, s in (group_lookups or {}).items()}
+        self.lookup_names = list(self.group_lookups)
+
+        # Índice de la última parte de cada cadena: (campo, posición, es_grupo)
+        self._index = {}
+        # Cadenas con combinador descendiente: necesitan seguimiento de ancestros
+        self._combinators = []
+        for is_group, table in ((False, self.fields), (True, self.group_fields)):
+            for name, selectors in table.items():
+                for position, selector in enumerate(selectors):
+                    for chain in selector.chains:
+                        slot = None
+                        if len(chain) > 1:
+                            slot = len(self._combinators)
+                            self._combinators.append(chain)
+                        self._index.setdefault(chain[-1].key(), []).append(
+                            (name, position, is_group, chain, slot))
+
+        # Los subselectores de grupo son grupos de selectores simples
+        self._lookups = []
+        for name, selector in self.group_lookups.items():
+            for chain in selector.chains:
+                if len(chain) > 1:
+                    raise ValueError(f"Los subselectores de grupo no admiten combinadores: {selector.text}")
+                self._lookups.append((name, chain[0]))
+
+    def _candidates(self, tag, classes):
+        index = self._index
+        found = list(index.get(('tag', tag.name), ()))
+        for cls in classes:
+            found.extend(index.get(('class', cls), ()))
+        for attr in tag.attrs:
+            found.extend(index.get(('attr', attr), ()))
+        found.extend(index.get(('any', None), ()))
+        return found
+
+    def run(self, soup):
+        """Devuelve (coincidencias por campo, registros de grupo por campo)"""
+        matches = {name: [[] for _ in sels] for name, sels in self.fields.items()}
+        groups = {name: [[] for _ in sels] for name, sels in self.group_fields.items()}
+        combinators = self._combinators
+        lookups = self._lookups
+
+        # Registros de grupo abiertos (ancestros del nodo actual)
+        open_groups = []
+        # Cada marco: [iterador de hijos, progreso de combinadores, índice de elemento, grupos abiertos al entrar]
+        frames = [[iter(soup.contents), (0,) * len(combinators), 0, 0]]
+
+        while frames:
+            frame = frames[-1]
+            node = None
+            for child in frame[0]:
+                if isinstance(child, Tag):
+                    node = child
+                    break
+            if node is None:
+                frames.pop()
+                del open_groups[frame[3]:]
+                continue
+
+            frame[2] += 1
+            index = frame[2]
+            progress = frame[1]
+            classes = _tag_classes(node)
+
+            # Primer descendiente de cada grupo abierto que cumple cada subselector
+            if open_groups:
+                for name, compound in lookups:
+                    if compound.matches(node, classes, index):
+                        for record in open_groups:
+                            if record[name] is None:
+                                record[name] = node
+
+            record = None
+            for name, position, is_group, chain, slot in self._candidates(node, classes):
+                if slot is not None and progress[slot] < len(chain) - 1:
+                    continue
+                if not chain[-1].matches(node, classes, index):
+                    continue
+                if is_group:
+                    bucket = groups[name][position]
+                    if record is None:
+                        record = dict.fromkeys(self.lookup_names)
+                        record['element'] = node
+                    if not bucket or bucket[-1] is not record:
+                        bucket.append(record)
+                else:
+                    bucket = matches[name][position]
+                    if not bucket or bucket[-1] is not node:
+                        bucket.append(node)
+
+            open_before = len(open_groups)
+            if record is not None:
+                open_groups.append(record)
+
+            child_progress = progress
+            for slot, chain in enumerate(combinators):
+                step = progress[slot]
+                if step < len(chain) - 1 and chain[step].matches(node, classes, index):
+                    if child_progress is progress:
+                        child_progress = list(progress)
+                    child_progress[slot] = step + 1
+            if child_progress is not progress:
+                child_progress = tuple(child_progress)
+
+            frames.append([iter(node.contents), child_progress, 0, open_before])
+
+        return matches, groups
+
+
+class CompiledSchema:
+    """Esquema de extracción compilado una sola vez: expresiones y extractores listos para usar"""
+
+    def __init__(self, schema):
+        self.patterns = {name: re.compile(pattern) for name, pattern in schema['patterns'].items()}
+
+        categories = schema['categories']
+        self.category_href = categories['href_contains']
+        self.categories = SinglePassExtractor(fields={'links': [categories['links']]})
+
+        listing = schema['listing']
+        self.listing_selectors = listing['links']
+        self.product_href = listing['href_contains']
+        self.listing = SinglePassExtractor(fields={'links': listing['links']})
+        self.listing_name = SinglePassExtractor(fields={'name': [listing['name_fallback']]})
+        rows = listing['rows']
+        self.listing_rows = SinglePassExtractor(
+            fields={},
+            group_fields={'rows': rows['rows']},
+            group_lookups={name: rows[name] for name in ('link', 'price', 'availability')},
+        )
+
+        product = schema['product']
+        variants = product['variants']
+        self.product = SinglePassExtractor(
+            fields={name: product[name] for name in ('title', 'type', 'price', 'availability', 'description')},
+            group_fields={'variants': variants['rows']},
+            group_lookups={'name': variants['name'], 'price': variants['price']},
+        )
+
+
+# El esquema se compila al importar el módulo: ninguna página paga su coste
+SCHEMA = CompiledSchema(load_schema())
+
+# Expresiones regulares compartidas por la extracción
+REF_RE = SCHEMA.patterns['ref']
+DIGIT_RE = SCHEMA.patterns['digit']
+PRICE_CLEAN_RE = SCHEMA.patterns['price_clean']
+WHITESPACE_RE = SCHEMA.patterns['whitespace']
+SITEMAP_PRODUCT_RE = SCHEMA.patterns['sitemap_product']
+ROW_PRICE_RE = SCHEMA.patterns['row_price']
+
+# Variante de las filas tomadas del listado (modo solo listado), que no muestra variantes
+LISTING_VARIANT = "Único"
+
+# Categoría de los productos descubiertos sin pasar por los listados (sitemap)
+SITEMAP_CATEGORY = "Sin categoría"
+
+
+def product_ref(link):
+    """Referencia del producto a partir de la URL de su ficha (None si no la tiene)"""
+    match = REF_RE.search(link)
+    return match.group(1) if match else None
+
+
+def extract_category_links(soup):
+    """Enlaces de categoría del menú: lista de (nombre, href)"""
+    matches, _ = SCHEMA.categories.run(soup)
+    links = []
+    for link in matches['links'][0]:
+        href = link.get('href', '')
+        if SCHEMA.category_href in href:
+            links.append((link.text.strip(), href))
+    return links
+
+
+def extract_listing_links(soup):
+    """Enlaces a fichas de un listado de productos.
+
+    Se usa el primer selector del esquema que encuentra elementos. Devuelve
+    (selector usado o None, elementos encontrados, lista de (nombre, href)).
+    Si el enlace no tiene texto, el nombre se busca junto al enlace y, en
+    último caso, se forma con la referencia del producto.
+    """
+    matches, _ = SCHEMA.listing.run(soup)
+    for selector, items in zip(SCHEMA.listing_selectors, matches['links']):
+        if items:
+            break
+    else:
+        return None, 0, []
+
+    links = []
+    for item in items:
+        href = item.get('href', '')
+        if SCHEMA.product_href in href:
+            links.append((_listing_name(item, href), href))
+    return selector, len(items), links
+
+
+def _listing_name(item, href):
+    """Nombre del producto de un enlace del listado"""
+    product_name = item.text.strip()
+    if not product_name:
+        # Si el enlace no tiene texto, buscar en elementos cercanos
+        name_matches, _ = SCHEMA.listing_name.run(item.parent)
+        if name_matches['name'][0]:
+            product_name = name_matches['name'][0][0].text.strip()
+        else:
+            # Si no encontramos nombre, usar el ID del producto
+            ref = product_ref(href)
+            product_name = f"Producto {ref}" if ref else "Producto sin nombre"
+    return product_name
+
+
+def extract_listing_rows(soup):
+    """Filas de un listado con los datos que ya muestra cada una.
+
+    Devuelve una lista de diccionarios con 'name', 'href', 'price' y
+    'availability' (None si la fila no los muestra). El precio se toma de un
+    elemento de precio del esquema o, si no lo hay, del primer importe en
+    euros del texto de la fila. Se usa el primer selector de filas que
+    encuentra filas con enlace a una ficha.
+    """
+    _, groups = SCHEMA.listing_rows.run(soup)
+    for records in groups['rows']:
+        rows = []
+        for record in records:
+            link = record['link']
+            if link is None or SCHEMA.product_href not in link.get('href', ''):
+                continue
+            href = link['href']
+
+            price = None
+            if record['price'] is not None and DIGIT_RE.search(record['price'].text):
+                price = clean_price(record['price'].text)
+            else:
+                match = ROW_PRICE_RE.search(record['element'].get_text(' '))
+                if match:
+                    price = clean_price(match.group(1))
+
+            availability = None
+            if record['availability'] is not None:
+                availability = record['availability'].text.strip() or None
+
+            rows.append({
+                'name': _listing_name(link, href),
+                'href': href,
+                'price': price,
+                'availability': availability,
+            })
+        if rows:
+            return rows
+    return []
+
+
+def split_listing_details(product_list):
+    """Separa los productos cuya fila del listado ya mostraba el precio.
+
+    Devuelve (filas de detalle de esos productos, productos cuya ficha hay
+    que descargar). Las filas tomadas del listado no tienen descripción ni
+    variantes: su 'Product Variant' es siempre LISTING_VARIANT, de modo que la
+    clave (Ref, Product Variant) no depende del nombre mostrado en el listado.
+    """
+    product_details = []
+    to_fetch = []
+    for product in product_list:
+        if not product.get('Price'):
+            to_fetch.append(product)
+            continue
+        product_details.append({
+            'Category': product['Category'],
+            'Ref': product_ref(product['Link']) or "Sin referencia",
+            'Product': product['Product'],
+            'Type': "",
+            'Product Variant': LISTING_VARIANT,
+            'Variant': "",
+            'Price': product['Price'],
+            'Availability': product.get('Availability') or "",
+            'Description': "",
+            'Link': product['Link']
+        })
+    return product_details, to_fetch
+
+
+def clean_price(text):
+    """Limpia un texto de precio dejando solo dígitos y separadores"""
+    return PRICE_CLEAN_RE.sub('', text.strip()) + '€'
+
+
+def extract_product_fields(soup):
+    """Extrae todos los campos de una ficha de producto en un único recorrido.
+
+    Devuelve un diccionario con 'title' (None si no hay h1.title con texto),
+    'type', 'price', 'availability', 'description' y 'variants': una lista de
+    (nombre, precio) o None si no se encontraron variantes. El precio de una
+    variante es None cuando debe usarse el precio del producto.
+    """
+    matches, groups = SCHEMA.product.run(soup)
+
+    title = None
+    if matches['title'][0]:
+        title = matches['title'][0][0].text.strip() or None
+
+    # Tipo de producto: el primer selector con coincidencia gana
+    product_type = ""
+    for found in matches['type']:
+        if found:
+            product_type = found[0].text.strip()
+            break
+    if not product_type:
+        product_type = "Variantes"
+
+    # Precio: solo se mira la primera coincidencia de cada selector
+    price = "Consultar"
+    for found in matches['price']:
+        if found and DIGIT_RE.search(found[0].text):
+            price = clean_price(found[0].text)
+            break
+
+    availability = ""
+    for found in matches['availability']:
+        if found:
+            availability = found[0].text.strip()
+            break
+
+    description = ""
+    for found in matches['description']:
+        if found:
+            description = ' '.join([elem.text.strip() for elem in found])
+            description = WHITESPACE_RE.sub(' ', description).strip()
+            if description:
+                break
+
+    variants = None
+    for records in groups['variants']:
+        if len(records) > 1:  # Si hay más de un elemento, probablemente son variantes
+            variants = []
+            for record in records:
+                variant_name = "Variante estándar"
+                if record['name'] is not None:
+                    variant_name = record['name'].text.strip()
+                variant_price = None
+                price_elem = record['price']
+                if price_elem is not None and DIGIT_RE.search(price_elem.text):
+                    variant_price = clean_price(price_elem.text)
+                variants.append((variant_name, variant_price))
+            break
+
+    return {
+        'title': title,
+        'type': product_type,
+        'price': price,
+        'availability': availability,
+        'description': description,
+        'variants': variants,
+    }
@@ -0,0 +1,238 @@
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import sqlite3
+import tempfile
+import weakref
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Parámetros que identifican la página en el esquema .aspx del sitio.
+# El resto (seguimiento, sesión, orden de listados...) no cambia el contenido.
+IDENTITY_PARAMS = {
+    'fitxaproducte.aspx': ('idproducte',),
+    'llistatdeproductes.aspx': ('idcategoria', 'pagina', 'page'),
+}
+
+# Parámetros de seguimiento que se descartan siempre
+TRACKING_PREFIXES = ('utm_', 'fbclid', 'gclid', 'mc_', '_ga')
+
+# Límite por defecto del conjunto exacto antes de pasar al conjunto en disco
+EXACT_SEEN_LIMIT = 100000
+
+
+def canonicalize_url(url):
+    """Normaliza una URL para que la misma página tenga siempre la misma clave.
+
+    - esquema y host en minúsculas, sin puerto por defecto ni fragmento
+    - nombre de la página .aspx sin distinguir mayúsculas (IIS no las distingue)
+    - en fitxaProducte.aspx/LlistatDeProductes.aspx solo se conservan los
+      parámetros que identifican la página; en el resto se eliminan los de
+      seguimiento
+    - nombres de parámetros en minúsculas y ordenados
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+
+    path = parts.path or '/'
+    page = path.rsplit('/', 1)[-1].lower()
+    if page.endswith('.aspx'):
+        path = path.lower()
+
+    params = [(key.lower(), value) for key, value in parse_qsl(parts.query, keep_blank_values=True)]
+    if page in IDENTITY_PARAMS:
+        allowed = IDENTITY_PARAMS[page]
+        params = [(key, value) for key, value in params if key in allowed]
+    else:
+        params = [(key, value) for key, value in params if not key.startswith(TRACKING_PREFIXES)]
+    params.sort()
+
+    return urlunsplit((scheme, host, path, urlencode(params), ''))
+
+
+class BloomFilter:
+    """Filtro de Bloom de tamaño fijo (admite falsos positivos, nunca falsos negativos)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DiskSet:
+    """Conjunto de claves persistido en SQLite (memoria acotada, resultado exacto)"""
+
+    def __init__(self, path=None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix='luluka_seen_', suffix='.db')
+            os.close(fd)
+            self._temporary = path
+        else:
+            self._temporary = None
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY) WITHOUT ROWID')
+        # El fichero temporal se borra al cerrar o, si nadie llama a close(), al liberar el objeto
+        self._finalizer = weakref.finalize(self, DiskSet._cleanup, self.conn, self._temporary)
+
+    @staticmethod
+    def _cleanup(conn, temporary):
+        conn.close()
+        if temporary and os.path.exists(temporary):
+            os.remove(temporary)
+
+    def add(self, key):
+        self.conn.execute('INSERT OR IGNORE INTO seen (key) VALUES (?)', (key,))
+
+    def __contains__(self, key):
+        return self.conn.execute('SELECT 1 FROM seen WHERE key = ?', (key,)).fetchone() is not None
+
+    def close(self):
+        self._finalizer()
+
+
+class SeenSet:
+    """Conjunto de URLs vistas que limita la memoria en rastreos grandes.
+
+    Mientras el rastreo es pequeño se usa un set exacto. Al superar
+    `exact_limit` las claves pasan a un conjunto en disco (modo 'disk', por
+    defecto), que sigue siendo exacto, o a un filtro de Bloom (modo 'bloom').
+    El filtro de Bloom ocupa menos y es más rápido, pero pierde datos: una
+    URL nueva se da por vista con probabilidad `error_rate` y ese producto
+    no se descarga, sin ningún aviso. Solo conviene cuando saltarse alguna
+    página es aceptable.
+    """
+
+    def __init__(self, exact_limit=EXACT_SEEN_LIMIT, overflow='disk', capacity=10000000,
+                 error_rate=0.001, path=None):
+        if overflow not in ('bloom', 'disk'):
+            raise ValueError(f"Modo de desbordamiento no válido: {overflow}")
+        self.exact_limit = exact_limit
+        self.overflow = overflow
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.path = path
+        self._exact = set()
+        self._large = None
+        self.count = 0
+
+    def _spill(self):
+        if self.overflow == 'bloom':
+            self._large = BloomFilter(self.capacity, self.error_rate)
+        else:
+            self._large = DiskSet(self.path)
+        for key in self._exact:
+            self._large.add(key)
+        self._exact = None
+
+    def add(self, key):
+        """Añade una clave; devuelve False si ya estaba"""
+        if key in self:
+            return False
+        if self._large is None:
+            self._exact.add(key)
+            if len(self._exact) > self.exact_limit:
+                self._spill()
+        else:
+            self._large.add(key)
+        self.count += 1
+        return True
+
+    def __contains__(self, key):
+        if self._large is None:
+            return key in self._exact
+        return key in self._large
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if isinstance(self._large, DiskSet):
+            self._large.close()
+
+
+class Frontier:
+    """Frontera de rastreo: cola de prioridad con deduplicación por URL canónica.
+
+    Cada URL se encola como mucho una vez. Las prioridades más bajas salen
+    antes y, a igual prioridad, se respeta el orden de llegada. Como mucho
+    `max_pending` entradas se guardan en memoria; el resto se desborda a una
+    cola en SQLite (los elementos deben ser serializables en JSON).
+    """
+
+    def __init__(self, seen=None, max_pending=50000, path=None):
+        self.seen = seen if seen is not None else SeenSet()
+        self.max_pending = max_pending
+        self.path = path
+        self._heap = []
+        self._counter = itertools.count()
+        self._disk = None
+        self._disk_count = 0
+
+    def _disk_queue(self):
+        if self._disk is None:
+            self._disk = DiskSet(self.path)
+            self._disk.conn.execute(
+                'CREATE TABLE IF NOT EXISTS pending (priority REAL, seq INTEGER, url TEXT, item TEXT, '
+                'PRIMARY KEY (priority, seq))')
+        return self._disk.conn
+
+    def add(self, url, item=None, priority=0):
+        """Encola una URL si no se había visto; devuelve True si se añadió"""
+        if not self.seen.add(canonicalize_url(url)):
+            return False
+        entry = (priority, next(self._counter), url, item)
+        if len(self._heap) < self.max_pending:
+            heapq.heappush(self._heap, entry)
+        else:
+            self._disk_queue().execute('INSERT INTO pending VALUES (?, ?, ?, ?)',
+                                       (priority, entry[1], url, json.dumps(item)))
+            self._disk_count += 1
+        return True
+
+    def seen_url(self, url):
+        return canonicalize_url(url) in self.seen
+
+    def pop(self):
+        """Devuelve (url, item) con mayor prioridad"""
+        if self._disk_count:
+            conn = self._disk_queue()
+            row = conn.execute('SELECT priority, seq, url, item FROM pending ORDER BY priority, seq LIMIT 1').fetchone()
+            if not self._heap or (row[0], row[1]) < self._heap[0][:2]:
+                conn.execute('DELETE FROM pending WHERE priority = ? AND seq = ?', (row[0], row[1]))
+                self._disk_count -= 1
+                return row[2], json.loads(row[3])
+        _, _, url, item = heapq.heappop(self._heap)
+        return url, item
+
+    def __len__(self):
+        return len(self._heap) + self._disk_count
+
+    def __iter__(self):
+        while len(self):
+            yield self.pop()
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+        self.seen.close()
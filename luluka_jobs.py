@@ -0,0 +1,159 @@
+import threading
+import time
+import uuid
+
+# Tiempo (segundos) que se conserva un trabajo terminado para quien lo consulte
+# (para leer sus resultados con get(); submit() no reutiliza trabajos terminados)
+FINISHED_JOB_TTL = 600
+
+
+class StageProgress:
+    """Progreso de una etapa con la misma interfaz que los widgets de Streamlit.
+
+    Las funciones de extracción llaman a `.text()` y `.progress()` como con
+    `st.empty()` y `st.progress()`; aquí solo se guarda el último valor para
+    que la interfaz lo lea cuando quiera.
+    """
+
+    def __init__(self):
+        self.message = ""
+        self.value = 0
+
+    def text(self, message):
+        self.message = message
+
+    def progress(self, value):
+        self.value = value
+
+
+class CrawlJob:
+    """Un scraping en segundo plano compartido por todos los usuarios que lo piden"""
+
+    def __init__(self, key, stages):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'pending'  # 'running', 'done', 'cancelled' o 'error'
+        self.stages = {name: StageProgress() for name in stages}
+        self.results = {}
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.subscribers = set()
+        self._deadline = None
+        # Contadores del rastreo (CrawlMetrics) que el trabajo fije para el panel de operación
+        self.metrics = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        # Filas de detalle a medida que llegan y avance de la etapa de detalles
+        self.rows = []
+        self.done = 0
+        self.total = 0
+        self.rows_started_at = None
+
+    @property
+    def running(self):
+        return self.status in ('pending', 'running')
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+    @deadline.setter
+    def deadline(self, deadline):
+        """El trabajo puede fijar un objeto con cancel() (p. ej. su Deadline) para detener las descargas.
+
+        Si el trabajo ya se canceló antes de fijarlo, se cancela en el acto.
+        """
+        with self._lock:
+            self._deadline = deadline
+        if self.cancelled and deadline is not None:
+            deadline.cancel()
+
+    def cancel(self):
+        self._cancel.set()
+        with self._lock:
+            deadline = self._deadline
+        if deadline is not None:
+            deadline.cancel()
+
+    def add_rows(self, rows, done, total):
+        """Callback de extract_product_details: guarda las filas nuevas"""
+        with self._lock:
+            if self.rows_started_at is None:
+                self.rows_started_at = time.time()
+            self.rows.extend(rows)
+            self.done, self.total = done, total
+
+    def latest_rows(self, count):
+        """Últimas `count` filas y número total de filas"""
+        with self._lock:
+            return self.rows[-count:], len(self.rows)
+
+
+class JobManager:
+    """Ejecuta los scrapings en hilos y reparte cada uno entre quienes lo piden.
+
+    Dos peticiones con la misma clave (las mismas opciones) comparten un único
+    trabajo mientras se ejecuta; una petición posterior a su fin lanza un
+    scraping nuevo. Los trabajos terminados se conservan FINISHED_JOB_TTL
+    segundos para quien aún los consulte. Un trabajo solo se cancela cuando lo
+    abandonan todos sus suscriptores; lo extraído hasta entonces se conserva.
+    """
+
+    def __init__(self, finished_ttl=FINISHED_JOB_TTL):
+        self.finished_ttl = finished_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.finished_ttl:
+                del self._jobs[job_id]
+
+    def submit(self, key, target, stages, subscriber):
+        """Devuelve el trabajo de esa clave, creándolo y lanzándolo si no existe"""
+        with self._lock:
+            self._purge(time.time())
+            for job in self._jobs.values():
+                # Solo se comparten los trabajos en curso: pedirlo de nuevo tras terminar lo repite
+                if job.key == key and job.status in ('pending', 'running'):
+                    job.subscribers.add(subscriber)
+                    return job
+            job = CrawlJob(key, stages)
+            job.subscribers.add(subscriber)
+            self._jobs[job.id] = job
+        threading.Thread(target=self._run, args=(job, target), daemon=True).start()
+        return job
+
+    def _run(self, job, target):
+        job.status = 'running'
+        try:
+            target(job)
+            job.status = 'cancelled' if job.cancelled else 'done'
+        except Exception as e:
+            # Al cancelar, un fallo de la etapa en curso no es un error del trabajo
+            if job.cancelled:
+                job.status = 'cancelled'
+            else:
+                job.error = str(e)
+                job.status = 'error'
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def leave(self, job_id, subscriber):
+        """Un usuario abandona el trabajo; si era el último, se cancela"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.subscribers.discard(subscriber)
+            if not job.subscribers and job.running:
+                job.cancel()
@@ -0,0 +1,119 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# Logger raíz de los scripts de scraping
+LOGGER_NAME = "luluka"
+
+# Nivel por defecto: con DEBUG se muestran todos los eventos por página
+LOG_LEVEL = "INFO"
+
+# De los eventos por página (un producto, una descarga...) solo se escribe uno
+# de cada PAGE_SAMPLE_EVERY salvo en nivel DEBUG (0 = ninguno)
+PAGE_SAMPLE_EVERY = 50
+
+_listener = None
+_root_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por evento: hora, nivel, etapa, mensaje y campos del evento"""
+
+    def format(self, record):
+        event = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname,
+            'logger': record.name,
+            'stage': getattr(record, 'stage', None),
+            'message': record.getMessage(),
+        }
+        event.update(getattr(record, 'fields', {}))
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class PageSampler(logging.Filter):
+    """Deja pasar uno de cada `every` eventos por página; el resto no se escribe"""
+
+    def __init__(self, every=PAGE_SAMPLE_EVERY):
+        super().__init__()
+        self.every = every
+        self.seen = 0
+
+    def filter(self, record):
+        if not getattr(record, 'page', False):
+            return True
+        if not self.every:
+            return False
+        self.seen += 1
+        return (self.seen - 1) % self.every == 0
+
+
+def setup_logging(level=LOG_LEVEL, stream=None, page_sample_every=PAGE_SAMPLE_EVERY):
+    """Configura los eventos JSON con escritura en segundo plano.
+
+    Los scripts solo dejan cada evento en una cola (QueueHandler); un hilo
+    (QueueListener) los formatea y escribe en `stream` (stderr por defecto),
+    así una salida lenta no frena el rastreo. En nivel DEBUG se escriben todos
+    los eventos por página; si no, solo una muestra. Se puede llamar varias
+    veces: la configuración anterior se sustituye.
+
+    Los módulos auxiliares (sitemap, transporte, histórico...) registran en
+    `logging.getLogger(__name__)`; sus mensajes llegan por el logger raíz a la
+    misma salida.
+    """
+    global _listener, _root_handler
+    level = logging.getLevelName(level) if isinstance(level, str) else level
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+    events = queue.SimpleQueue()
+    handler = QueueHandler(events)
+    if level > logging.DEBUG:
+        handler.addFilter(PageSampler(page_sample_every))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    root = logging.getLogger()
+    if _root_handler is not None:
+        root.removeHandler(_root_handler)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _root_handler = handler
+
+    _listener = QueueListener(events, output)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Escribe los eventos pendientes y detiene el hilo de escritura"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def get_logger(name):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def log_event(logger, message, stage=None, level=logging.INFO, page=False, **fields):
+    """Registra un evento con su etapa y campos (url, latency, selector...).
+
+    `page=True` marca los eventos que se repiten en cada página, que se
+    muestrean salvo en nivel DEBUG.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'stage': stage, 'page': page, 'fields': fields})
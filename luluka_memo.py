@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import luluka_extractor
+from luluka_extractor import SCHEMA_FILE
+
+# Base de datos con los campos extraídos de cada contenido de página
+MEMO_DB = "luluka_memo.db"
+
+# Entradas que se conservan en disco y en memoria (se descartan las menos usadas)
+MEMO_MAX_ENTRIES = 50000
+MEMORY_ENTRIES = 1000
+
+# Cada cuántas entradas nuevas se aplica el límite de tamaño en disco
+PRUNE_EVERY = 100
+
+# Partes de la página que cambian en cada descarga sin que cambie el producto,
+# con su sustitución: campos ocultos de ASP.NET, tokens antifalsificación y
+# parámetros anticaché de las URLs. El texto visible (fechas, espacios...) no se
+# toca: lo lee el extractor, y un cambio en él debe volver a analizar la ficha
+VOLATILE_PATTERNS = [
+    (re.compile(r'<input[^>]*\bname="__(?:VIEWSTATE\w*|EVENTVALIDATION|EVENTTARGET|EVENTARGUMENT|'
+                r'PREVIOUSPAGE|LASTFOCUS|RequestVerificationToken)"[^>]*>', re.IGNORECASE), ''),
+    (re.compile(r'([?&](?:_|t|ts|v|ver|timestamp)=)\d+', re.IGNORECASE), r'\1'),
+]
+
+
+def _extractor_version():
+    """Huella del esquema y del código del extractor: si cambian, las entradas guardadas dejan de valer"""
+    digest = hashlib.sha256()
+    for path in (SCHEMA_FILE, luluka_extractor.__file__):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+EXTRACTOR_VERSION = _extractor_version()
+
+
+def normalize_html(html):
+    """Quita de la página lo que cambia en cada descarga (ver VOLATILE_PATTERNS)"""
+    for pattern, replacement in VOLATILE_PATTERNS:
+        html = pattern.sub(replacement, html)
+    return html.strip()
+
+
+def content_hash(html):
+    """Hash del contenido normalizado de una página, junto con la versión del extractor"""
+    digest = hashlib.sha256(EXTRACTOR_VERSION.encode())
+    digest.update(normalize_html(html).encode('utf-8', 'surrogatepass'))
+    return digest.hexdigest()
+
+
+class ExtractionMemo:
+    """Campos extraídos de cada contenido de página, por hash del contenido.
+
+    Si una página descargada tiene el mismo contenido normalizado que otra ya
+    analizada (en esta ejecución o en una anterior), se reutilizan sus campos
+    sin construir el árbol HTML. Las entradas recientes se guardan en memoria
+    y todas en SQLite; al superar `max_entries` se eliminan las usadas hace
+    más tiempo. La conexión se abre en el primer uso y se reabre en procesos
+    hijos.
+    """
+
+    def __init__(self, path=MEMO_DB, max_entries=MEMO_MAX_ENTRIES, memory_entries=MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._added = 0
+        self._recent = OrderedDict()
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS extractions (key TEXT PRIMARY KEY, fields TEXT, used_at REAL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS extractions_used ON extractions (used_at)')
+            self._conn.commit()
+            self._pid = os.getpid()
+            self._recent.clear()
+        return self._conn
+
+    def _remember(self, key, fields):
+        self._recent[key] = fields
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.memory_entries:
+            self._recent.popitem(last=False)
+
+    def get(self, key):
+        """Campos guardados para ese hash (None si no hay)"""
+        with self._lock:
+            conn = self._connection()
+            fields = self._recent.get(key)
+            if fields is None:
+                row = conn.execute('SELECT fields FROM extractions WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                fields = json.loads(row[0])
+                if fields.get('variants') is not None:
+                    fields['variants'] = [tuple(variant) for variant in fields['variants']]
+            conn.execute('UPDATE extractions SET used_at = ? WHERE key = ?', (time.time(), key))
+            conn.commit()
+            self._remember(key, fields)
+            self.hits += 1
+            return fields
+
+    def put(self, key, fields):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO extractions (key, fields, used_at) VALUES (?, ?, ?)',
+                (key, json.dumps(fields, ensure_ascii=False), time.time())
+            )
+            self._added += 1
+            if self._added % PRUNE_EVERY == 0:
+                # Límite de tamaño: fuera las entradas usadas hace más tiempo
+                conn.execute(
+                    'DELETE FROM extractions WHERE key IN '
+                    '(SELECT key FROM extractions ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,)
+                )
+            conn.commit()
+            self._remember(key, fields)
+
+    def extract(self, html, parse):
+        """Campos de la página: los guardados si su contenido ya se analizó o `parse(html)` si no"""
+        key = content_hash(html)
+        fields = self.get(key)
+        if fields is None:
+            fields = parse(html)
+            self.put(key, fields)
+        return fields
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
@@ -0,0 +1,106 @@
+import gc
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+
+def release_tree(soup):
+    """Libera un árbol de BeautifulSoup en cuanto se ha extraído lo necesario.
+
+    Los nodos se enlazan entre sí (padre, hermanos, hijos) y forman ciclos que
+    solo recoge el recolector de basura, tarde y de forma irregular.
+    decompose() rompe esos enlaces para que la memoria se libere al momento.
+    """
+    if soup is not None:
+        soup.decompose()
+
+
+def current_rss():
+    """Memoria residente actual del proceso en bytes (None si no se puede medir)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """Pico de memoria residente del proceso en bytes (None si no se puede medir)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo da en KiB y macOS en bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def _mb(value):
+    return "n/d" if value is None else f"{value / MB:.1f} MB"
+
+
+class MemoryMonitor:
+    """Mide la memoria usada en cada etapa del scraping.
+
+    De cada etapa se guarda la RSS actual y el pico del proceso al terminar y,
+    con `trace=True`, la memoria de Python que la etapa deja asignada y su pico
+    durante la etapa según tracemalloc (más precisa, pero ralentiza algo la
+    ejecución).
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        started_tracing = False
+        if self.trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.trace:
+                # Lo que siga vivo tras una recolección es lo que la etapa retiene
+                gc.collect()
+            rss = current_rss()
+            peak = peak_rss()
+            stats = {
+                'stage': name,
+                'seconds': time.time() - start,
+                'rss': rss,
+                # getrusage y /proc se muestrean por separado: el pico nunca es menor que la actual
+                'peak_rss': max(peak, rss) if peak is not None and rss is not None else peak,
+                'traced': None,
+                'traced_peak': None,
+            }
+            if self.trace:
+                stats['traced'], stats['traced_peak'] = tracemalloc.get_traced_memory()
+                if started_tracing:
+                    tracemalloc.stop()
+            self.stages.append(stats)
+            self.print_stage(stats)
+
+    @staticmethod
+    def print_stage(stats):
+        line = (f"[memoria] {stats['stage']}: RSS {_mb(stats['rss'])} "
+                f"(pico {_mb(stats['peak_rss'])}), {stats['seconds']:.1f} s")
+        if stats['traced'] is not None:
+            line += f", Python {_mb(stats['traced'])} (pico {_mb(stats['traced_peak'])})"
+        print(line)
+
+    def report(self):
+        """Imprime el resumen de todas las etapas"""
+        print("Resumen de memoria por etapa:")
+        for stats in self.stages:
+            self.print_stage(stats)
@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from statistics import quantiles
+
+# Ventana (segundos) sobre la que se calculan las tasas instantáneas
+RATE_WINDOW = 30
+
+# Latencias recientes que se conservan para los percentiles
+LATENCY_SAMPLES = 500
+
+# Tipos de tiempo que se acumulan: descarga, análisis del HTML y esperas
+# (pausas entre peticiones y del circuito)
+TIME_KINDS = ('network', 'parse', 'throttle')
+
+
+class CrawlMetrics:
+    """Contadores en memoria de un rastreo en curso.
+
+    Los actualizan la descarga (guarded_get), el análisis de las páginas y las
+    pausas; la interfaz lee `snapshot()` cuando quiere. Comparar el tiempo
+    acumulado de cada tipo indica si el rastreo está limitado por la red, por
+    el análisis del HTML o por las pausas.
+    """
+
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.started_at = time.time()
+        self.requests = 0
+        self.bytes = 0
+        self.errors = 0
+        self.server_errors = 0
+        self.negative_hits = 0
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.pauses = 0
+        self.times = dict.fromkeys(TIME_KINDS, 0.0)
+        self.categories = {}
+        self._recent = deque()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self._recent and now - self._recent[0][0] > self.window:
+            self._recent.popleft()
+
+    def record_request(self, latency, size=0, status=None, error=False):
+        """Una petición terminada (con respuesta o con excepción)"""
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            self.times['network'] += latency
+            if error:
+                self.errors += 1
+            elif status is not None and (status == 429 or status >= 500):
+                self.server_errors += 1
+            self._latencies.append(latency)
+            self._recent.append((now, size))
+            self._trim(now)
+
+    def record_negative_hit(self):
+        """Una URL omitida sin petición por estar en la caché negativa"""
+        with self._lock:
+            self.negative_hits += 1
+
+    def record_memo(self, hit):
+        """Una ficha cuyos campos se reutilizaron (hit) o hubo que analizar"""
+        with self._lock:
+            if hit:
+                self.memo_hits += 1
+            else:
+                self.memo_misses += 1
+
+    def record_pause(self, seconds):
+        """Una pausa del circuito por fallos seguidos del sitio"""
+        with self._lock:
+            self.pauses += 1
+            self.times['throttle'] += seconds
+
+    @contextmanager
+    def timed(self, kind):
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.times[kind] += time.time() - start
+
+    def set_category_totals(self, products):
+        """Productos a procesar de cada categoría"""
+        with self._lock:
+            for product in products:
+                done_total = self.categories.setdefault(product['Category'], [0, 0])
+                done_total[1] += 1
+
+    def category_done(self, category):
+        with self._lock:
+            if category in self.categories:
+                self.categories[category][0] += 1
+
+    def snapshot(self, breaker=None):
+        """Estado actual de los contadores, con tasas y percentiles ya calculados"""
+        now = time.time()
+        with self._lock:
+            self._trim(now)
+            elapsed = max(now - self.started_at, 1e-6)
+            window = min(self.window, elapsed)
+            latencies = list(self._latencies)
+            lookups = self.requests + self.negative_hits
+            parsed = self.memo_hits + self.memo_misses
+            stats = {
+                'elapsed': elapsed,
+                'requests': self.requests,
+                'bytes': self.bytes,
+                'requests_per_second': len(self._recent) / window,
+                'bytes_per_second': sum(size for _, size in self._recent) / window,
+                'errors': self.errors,
+                'server_errors': self.server_errors,
+                'negative_hits': self.negative_hits,
+                'negative_hit_ratio': self.negative_hits / lookups if lookups else 0.0,
+                'memo_hits': self.memo_hits,
+                'memo_hit_ratio': self.memo_hits / parsed if parsed else 0.0,
+                'pauses': self.pauses,
+                'times': dict(self.times),
+                'categories': {category: tuple(done_total) for category, done_total in self.categories.items()},
+            }
+        if len(latencies) > 1:
+            cuts = quantiles(latencies, n=100, method='inclusive')
+            stats['latency_p50'], stats['latency_p90'], stats['latency_p99'] = cuts[49], cuts[89], cuts[98]
+        else:
+            stats['latency_p50'] = stats['latency_p90'] = stats['latency_p99'] = latencies[0] if latencies else None
+        stats['bound_by'] = max(stats['times'], key=stats['times'].get) if any(stats['times'].values()) else None
+        if breaker is not None:
+            stats['breaker_open'] = breaker.is_open
+            stats['breaker_cooldown'] = breaker.cooldown
+        return stats
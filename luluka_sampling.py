@@ -0,0 +1,161 @@
+import logging
+import math
+import random
+from statistics import NormalDist, mean, stdev
+from luluka_store import parse_price
+
+logger = logging.getLogger(__name__)
+
+# Margen de error (en proporción, ±) y nivel de confianza por defecto
+DEFAULT_MARGIN = 0.1
+DEFAULT_CONFIDENCE = 0.95
+
+# Precio de los productos sin precio publicado
+NO_PRICE = "Consultar"
+
+
+def z_value(confidence):
+    """Valor crítico de la normal para un intervalo bilateral"""
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def sample_size(population, margin=DEFAULT_MARGIN, confidence=DEFAULT_CONFIDENCE, proportion=0.5):
+    """Tamaño de muestra para estimar una proporción con el margen pedido.
+
+    Fórmula de Cochran con corrección por población finita; con
+    `proportion=0.5` (el peor caso) el tamaño sirve para cualquier proporción.
+    """
+    if population <= 0:
+        return 0
+    n0 = z_value(confidence) ** 2 * proportion * (1 - proportion) / margin ** 2
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+
+def stratified_sample(product_list, margin=DEFAULT_MARGIN, confidence=DEFAULT_CONFIDENCE, seed=None):
+    """Muestra aleatoria estratificada por categoría.
+
+    Cada categoría se muestrea por separado con el tamaño necesario para su
+    margen de error. Devuelve (muestra, población por categoría).
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for product in product_list:
+        strata.setdefault(product['Category'], []).append(product)
+    sample = []
+    for products in strata.values():
+        sample.extend(rng.sample(products, sample_size(len(products), margin, confidence)))
+    return sample, {category: len(products) for category, products in strata.items()}
+
+
+def _product_prices(product_details):
+    """Precio medio de cada producto (None si es 'Consultar') agrupado por categoría"""
+    by_product = {}
+    for row in product_details:
+        by_product.setdefault((row['Category'], row['Ref']), []).append(parse_price(row['Price']))
+    by_category = {}
+    for (category, _), prices in by_product.items():
+        values = [price for price in prices if price is not None]
+        by_category.setdefault(category, []).append(mean(values) if values else None)
+    return by_category
+
+
+def _fpc(sampled, population):
+    """Corrección por población finita de la varianza"""
+    return max(0.0, 1 - sampled / population) if population else 0.0
+
+
+def estimate_catalog(product_details, populations, confidence=DEFAULT_CONFIDENCE):
+    """Estima por categoría el precio medio y la proporción de productos 'Consultar'.
+
+    Devuelve una fila por categoría y una fila 'Total' con los estimadores
+    estratificados (cada categoría pesa según su número de productos). Los
+    márgenes (±) son la mitad del intervalo de confianza pedido.
+    """
+    z = z_value(confidence)
+    prices_by_category = _product_prices(product_details)
+    rows = []
+    total = sum(populations.values())
+    overall_share = overall_share_var = 0.0
+    # Totales estimados de precio y de productos con precio (estimador de razón)
+    price_total = priced_total = 0.0
+
+    for category, population in populations.items():
+        prices = prices_by_category.get(category, [])
+        sampled = len(prices)
+        priced = [price for price in prices if price is not None]
+        fpc = _fpc(sampled, population)
+        row = {
+            'Category': category,
+            'Products': population,
+            'Sampled': sampled,
+            'Avg Price': None,
+            'Avg Price ±': None,
+            'Consultar %': None,
+            'Consultar ±': None,
+        }
+        if sampled:
+            share = 1 - len(priced) / sampled
+            share_var = share * (1 - share) / max(sampled - 1, 1) * fpc
+            row['Consultar %'] = 100 * share
+            row['Consultar ±'] = 100 * z * math.sqrt(share_var)
+            weight = population / total
+            overall_share += weight * share
+            overall_share_var += weight ** 2 * share_var
+        if priced:
+            price_var = (stdev(priced) ** 2 if len(priced) > 1 else 0.0) / len(priced) * fpc
+            row['Avg Price'] = mean(priced)
+            row['Avg Price ±'] = z * math.sqrt(price_var)
+            price_total += population * sum(priced) / sampled
+            priced_total += population * len(priced) / sampled
+        rows.append(row)
+
+    totals = {
+        'Category': 'Total',
+        'Products': total,
+        'Sampled': sum(row['Sampled'] for row in rows),
+        'Avg Price': None,
+        'Avg Price ±': None,
+        'Consultar %': 100 * overall_share if total else None,
+        'Consultar ±': 100 * z * math.sqrt(overall_share_var) if total else None,
+    }
+    if priced_total:
+        # Precio medio global = total de precios / productos con precio. Su varianza
+        # se aproxima con los residuos precio - razón (0 en los productos 'Consultar')
+        ratio = price_total / priced_total
+        ratio_var = 0.0
+        for category, population in populations.items():
+            prices = prices_by_category.get(category, [])
+            if len(prices) < 2:
+                continue
+            residuals = [price - ratio if price is not None else 0.0 for price in prices]
+            ratio_var += population ** 2 * _fpc(len(prices), population) * stdev(residuals) ** 2 / len(prices)
+        totals['Avg Price'] = ratio
+        totals['Avg Price ±'] = z * math.sqrt(ratio_var) / priced_total
+    rows.append(totals)
+    return rows
+
+
+def print_estimates(rows, confidence=DEFAULT_CONFIDENCE):
+    """Imprime la tabla de estimaciones"""
+    def fmt(value, suffix=''):
+        return "n/d" if value is None else f"{value:.2f}{suffix}"
+
+    print(f"Estimaciones (confianza {confidence:.0%}):")
+    for row in rows:
+        print(f"  {row['Category']}: {row['Sampled']} de {row['Products']} productos | "
+              f"precio medio {fmt(row['Avg Price'], '€')} ± {fmt(row['Avg Price ±'], '€')} | "
+              f"'{NO_PRICE}' {fmt(row['Consultar %'], '%')} ± {fmt(row['Consultar ±'], '%')}")
+
+
+def sample_catalog(extract_details, product_list, margin=DEFAULT_MARGIN, confidence=DEFAULT_CONFIDENCE, seed=None):
+    """Extrae una muestra estratificada de fichas y estima las cifras del catálogo.
+
+    Devuelve (filas de detalle de la muestra, estimaciones).
+    """
+    sample, populations = stratified_sample(product_list, margin, confidence, seed)
+    logger.info("Muestra: %d de %d productos (margen ±%.0f%%, confianza %.0f%%)",
+                len(sample), len(product_list), margin * 100, confidence * 100)
+    product_details = extract_details(sample)
+    estimates = estimate_catalog(product_details, populations, confidence)
+    print_estimates(estimates, confidence)
+    return product_details, estimates
@@ -0,0 +1,189 @@
+import hashlib
+import math
+import sqlite3
+import time
+from luluka_frontier import Frontier, canonicalize_url
+
+# Base de datos con el historial de cambios de cada producto
+HISTORY_DB = "luluka_history.db"
+
+# Pasado este tiempo sin descargar una ficha se vuelve a pedir siempre
+MAX_REVISIT_AGE = 30 * 24 * 3600
+
+
+def details_fingerprint(rows):
+    """Huella de las filas de un producto: variantes, precios y disponibilidad"""
+    values = sorted(
+        (str(row.get('Product Variant', '')), str(row.get('Price', '')), str(row.get('Availability', '')))
+        for row in rows
+    )
+    digest = hashlib.sha1()
+    for value in values:
+        digest.update('\x1f'.join(value).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+
+def estimate_change_rate(intervals, changes, observed):
+    """Estima la frecuencia de cambio (cambios por segundo) de un producto.
+
+    Se supone que los cambios siguen un proceso de Poisson y que solo se sabe
+    si la página cambió entre dos descargas, no cuántas veces. Se usa el
+    estimador sesgo-corregido λ = -log((n - X + 0.5) / (n + 0.5)) / I, con n
+    revisitas, X revisitas con cambio e I el intervalo medio entre descargas.
+    """
+    if intervals <= 0 or observed <= 0:
+        return None
+    mean_interval = observed / intervals
+    return -math.log((intervals - changes + 0.5) / (intervals + 0.5)) / mean_interval
+
+
+class RevisitScheduler:
+    """Decide qué fichas descargar en cada ejecución según su historial de cambios.
+
+    Para cada producto se guarda la huella de su última extracción y cuántas
+    veces ha cambiado entre descargas. Con ello se estima la probabilidad de
+    que haya cambiado desde la última visita y se eligen primero los
+    productos más volátiles, hasta agotar el presupuesto de peticiones.
+    """
+
+    def __init__(self, path=HISTORY_DB, max_age=MAX_REVISIT_AGE):
+        self.max_age = max_age
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS product_history (
+                key TEXT PRIMARY KEY,
+                ref TEXT,
+                category TEXT,
+                fingerprint TEXT,
+                first_fetched REAL,
+                last_fetched REAL,
+                last_changed REAL,
+                intervals INTEGER DEFAULT 0,
+                changes INTEGER DEFAULT 0,
+                observed REAL DEFAULT 0
+            )
+        ''')
+        self.conn.commit()
+
+    def change_probability(self, key, now=None):
+        """Probabilidad de que la ficha haya cambiado desde la última descarga"""
+        now = now or time.time()
+        row = self.conn.execute(
+            'SELECT last_fetched, intervals, changes, observed FROM product_history WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return 1.0  # Nunca descargado
+        last_fetched, intervals, changes, observed = row
+        elapsed = max(0.0, now - last_fetched)
+        if elapsed >= self.max_age:
+            return 1.0
+        rate = estimate_change_rate(intervals, changes, observed)
+        if rate is None:
+            return 1.0  # Sin historial suficiente para estimar
+        return 1.0 - math.exp(-rate * elapsed)
+
+    def age(self, key, now=None):
+        """Segundos desde la última descarga de la ficha (None si nunca se descargó)"""
+        now = now or time.time()
+        row = self.conn.execute('SELECT last_fetched FROM product_history WHERE key = ?', (key,)).fetchone()
+        return None if row is None else max(0.0, now - row[0])
+
+    def plan(self, product_list, budget=None, now=None):
+        """Devuelve los productos a descargar, del más al menos probable de haber cambiado.
+
+        Los productos que nunca han cambiado (probabilidad 0) no se descartan:
+        ocupan el presupuesto sobrante, primero los descargados hace más tiempo.
+        """
+        now = now or time.time()
+        frontier = Frontier()
+        for product in product_list:
+            key = canonicalize_url(product['Link'])
+            probability = self.change_probability(key, now)
+            if probability > 0:
+                priority = -probability
+            else:
+                # Prioridad entre 1 y 2: detrás de todos los productos con cambios esperados
+                priority = 2.0 - min(self.age(key, now), self.max_age) / self.max_age
+            frontier.add(product['Link'], product, priority=priority)
+
+        plan = []
+        for _, product in frontier:
+            if budget is not None and len(plan) >= budget:
+                break
+            plan.append(product)
+        frontier.close()
+        return plan
+
+    def record(self, product_details, now=None):
+        """Actualiza el historial con las filas extraídas en esta ejecución"""
+        now = now or time.time()
+        by_product = {}
+        for row in product_details:
+            by_product.setdefault(canonicalize_url(row['Link']), []).append(row)
+
+        for key, rows in by_product.items():
+            fingerprint = details_fingerprint(rows)
+            previous = self.conn.execute(
+                'SELECT fingerprint, last_fetched FROM product_history WHERE key = ?', (key,)
+            ).fetchone()
+            if previous is None:
+                self.conn.execute(
+                    'INSERT INTO product_history (key, ref, category, fingerprint, first_fetched, last_fetched, last_changed) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, rows[0].get('Ref'), rows[0].get('Category'), fingerprint, now, now, now)
+                )
+                continue
+            changed = previous[0] != fingerprint
+            self.conn.execute(
+                'UPDATE product_history SET ref = ?, category = ?, fingerprint = ?, last_fetched = ?, '
+                'last_changed = CASE WHEN ? THEN ? ELSE last_changed END, '
+                'intervals = intervals + 1, changes = changes + ?, observed = observed + ? '
+                'WHERE key = ?',
+                (rows[0].get('Ref'), rows[0].get('Category'), fingerprint, now,
+                 changed, now, int(changed), max(0.0, now - previous[1]), key)
+            )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def interleave_by_category(product_list):
+    """Reordena los productos alternando categorías (uno de cada una por turno).
+
+    Si el tiempo se acaba a mitad del rastreo, todas las categorías quedan
+    cubiertas en parte en lugar de unas completas y otras sin empezar. Dentro
+    de cada categoría se conserva el orden recibido.
+    """
+    by_category = {}
+    for product in product_list:
+        by_category.setdefault(product['Category'], []).append(product)
+    queues = list(by_category.values())
+    interleaved = []
+    for turn in range(max((len(queue) for queue in queues), default=0)):
+        interleaved.extend(queue[turn] for queue in queues if turn < len(queue))
+    return interleaved
+
+
+def extract_with_schedule(extract_details, product_list, budget=None, path=HISTORY_DB, deadline=None):
+    """Ejecuta `extract_details` sobre el plan de revisitas y registra los resultados.
+
+    Sin presupuesto se descargan todas las fichas; el historial se actualiza
+    igualmente para poder planificar las ejecuciones siguientes. Con tiempo
+    límite (`deadline`) los productos se alternan por categoría.
+    """
+    scheduler = RevisitScheduler(path)
+    try:
+        if budget is not None:
+            product_list = list(product_list)
+            planned = scheduler.plan(product_list, budget)
+            print(f"Plan de revisitas: {len(planned)} de {len(product_list)} productos (presupuesto: {budget})")
+            product_list = planned
+        if deadline is not None and deadline.expires_at is not None:
+            product_list = interleave_by_category(product_list)
+        product_details = extract_details(product_list)
+        scheduler.record(product_details)
+    finally:
+        scheduler.close()
+    return product_details
@@ -1,10 +1,20 @@
+import logging
 import os
-import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 import time
-import re
+from itertools import chain
 from urllib.parse import urljoin
+from luluka_extractor import (SITEMAP_CATEGORY, extract_category_links, extract_listing_links,
+                              extract_listing_rows, extract_product_fields, product_ref, split_listing_details)
+from luluka_frontier import SeenSet, canonicalize_url
+from luluka_logging import get_logger, log_event, setup_logging
+from luluka_memo import ExtractionMemo
+from luluka_memory import MemoryMonitor, release_tree
+from luluka_scheduler import extract_with_schedule
+from luluka_sitemap import iter_sitemap_products, collect
+from luluka_store import store_results
+from luluka_transport import CircuitBreaker, Deadline, NegativeCache, guarded_get
 
 # Configuración de headers para simular un navegador
 headers = {
@@ -15,44 +25,111 @@ headers = {
 # URL base del sitio
 BASE_URL = "https://www.lulukabaraka.com/"
 
-def get_soup(url):
-    """Obtiene el contenido HTML de una URL y lo convierte en un objeto BeautifulSoup"""
+# Máximo de fichas de producto a descargar por ejecución (None = todas).
+# Con un límite se descargan primero los productos que más cambian.
+FETCH_BUDGET = None
+
+# Modo de bajo consumo de memoria: cada árbol HTML se libera en cuanto se han
+# extraído sus datos y se mide la memoria de Python de cada etapa
+LOW_MEMORY = False
+
+# Tiempo máximo (segundos) de una ejecución completa (None = sin límite).
+# Se reservan EXPORT_RESERVE segundos para guardar los resultados parciales.
+CRAWL_DEADLINE = None
+EXPORT_RESERVE = 60
+
+# Modo solo listado: el precio y la disponibilidad se toman de las filas de los
+# listados de categoría y solo se descargan las fichas de los productos sin precio
+LISTING_ONLY = False
+
+# Descubrir los productos desde robots.txt/sitemap.xml en lugar de recorrer el
+# menú y los listados. Es más rápido, pero el sitemap no indica la categoría de
+# cada producto: todos quedan en "Sin categoría" y la hoja 'Categories' vacía
+USE_SITEMAP = False
+
+# Pausa (segundos) tras cada página para no sobrecargar el servidor. El rastreo con
+# varios procesos la desactiva: allí las peticiones las espacia su límite común
+REQUEST_PAUSE = 1
+
+# Nivel de los eventos del rastreo ("DEBUG" muestra todos los eventos por página)
+LOG_LEVEL = "INFO"
+
+# Fichero Excel de resultados
+OUTPUT_FILE = "Luluka_Scraping_Result.xlsx"
+
+# Circuito que pausa el rastreo si el sitio falla de forma continuada y caché
+# de las páginas que ya no existen (404/410), que no se vuelven a pedir
+circuit_breaker = CircuitBreaker()
+dead_urls = NegativeCache()
+
+# Campos ya extraídos de cada contenido de ficha, para no volver a analizar las que no cambian
+extraction_memo = ExtractionMemo()
+
+# Tiempo límite del rastreo en curso (lo fija main())
+crawl_deadline = Deadline()
+
+# Eventos del rastreo (JSON en stderr; ver luluka_logging)
+log = get_logger("scraper")
+
+def fetch_html(url):
+    """Descarga una URL y devuelve su HTML (None si la página no existe o falla la descarga)"""
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return BeautifulSoup(response.text, 'html.parser')
+        start = time.time()
+        response = guarded_get(requests, url, headers, circuit_breaker, dead_urls, deadline=crawl_deadline)
+        if response is None:
+            log_event(log, "Página inexistente, se omite", stage='fetch', url=url)
+            return None
+        log_event(log, "Página descargada", stage='fetch', page=True, url=url, status=response.status_code,
+                  latency=round(time.time() - start, 3), bytes=len(response.content))
+        return response.text
     except Exception as e:
-        print(f"Error al obtener {url}: {e}")
+        log_event(log, "Error al obtener la página", stage='fetch', level=logging.WARNING, url=url, error=str(e))
+        return None
+
+def get_soup(url):
+    """Obtiene el contenido HTML de una URL y lo convierte en un objeto BeautifulSoup"""
+    html = fetch_html(url)
+    if html is None:
         return None
+    return BeautifulSoup(html, 'html.parser')
+
+def parse_product_page(html):
+    """Extrae todos los campos de una ficha en un único recorrido del árbol"""
+    soup = BeautifulSoup(html, 'html.parser')
+    fields = extract_product_fields(soup)
+    if LOW_MEMORY:
+        # Solo se conservan los campos extraídos, no el árbol
+        release_tree(soup)
+    return fields
 
 def extract_categories():
     """Extrae las categorías del sitio"""
-    print("Extrayendo categorías...")
+    log_event(log, "Extrayendo categorías", stage='categories')
     categories = []
+    seen_categories = SeenSet()
     
     # Obtener la página principal
     soup = get_soup(BASE_URL)
     if not soup:
         return categories
     
-    # Buscar enlaces de categorías - probamos varios selectores comunes
-    category_links = soup.select('ul.nav li a, .menu a, .categories a, .navbar a')
+    # Buscar enlaces de categorías con los selectores del esquema
+    for category_name, href in extract_category_links(soup):
+        full_url = urljoin(BASE_URL, href)
+        # Evitar duplicados (por URL canónica)
+        if seen_categories.add(canonicalize_url(full_url)):
+            categories.append({
+                'Category': category_name,
+                'Link': full_url
+            })
     
-    for link in category_links:
-        href = link.get('href', '')
-        if 'LlistatDeProductes.aspx?idcategoria=' in href:
-            category_name = link.text.strip()
-            full_url = urljoin(BASE_URL, href)
-            # Evitar duplicados
-            if not any(cat['Link'] == full_url for cat in categories):
-                categories.append({
-                    'Category': category_name,
-                    'Link': full_url
-                })
+    if LOW_MEMORY:
+        release_tree(soup)
     
     # Si no encontramos categorías, usamos algunas predefinidas
     if not categories:
-        print("No se encontraron categorías automáticamente. Usando categorías predefinidas.")
+        log_event(log, "No se encontraron categorías automáticamente. Usando categorías predefinidas.",
+                  stage='categories', level=logging.WARNING)
         categories = [
             {"Category": "Instalaciones", "Link": "https://www.lulukabaraka.com/LlistatDeProductes.aspx?idcategoria=109"},
             {"Category": "Aislamiento térmico", "Link": "https://www.lulukabaraka.com/LlistatDeProductes.aspx?idcategoria=206"},
@@ -64,210 +141,137 @@ def extract_categories():
 
 def extract_product_list(categories):
     """Extrae la lista de productos de cada categoría"""
-    print("Extrayendo lista de productos...")
+    log_event(log, "Extrayendo lista de productos", stage='listing')
     products = []
+    seen_products = SeenSet()
     
     for category in categories:
-        print(f"Procesando categoría: {category['Category']}")
+        if crawl_deadline.expired:
+            log_event(log, "Se agotó el tiempo del rastreo: se dejan categorías sin listar", stage='listing',
+                      level=logging.WARNING)
+            break
+        log_event(log, "Procesando categoría", stage='listing', category=category['Category'], url=category['Link'])
         soup = get_soup(category['Link'])
         if not soup:
             continue
         
-        # Intentar diferentes selectores para encontrar productos
-        product_items = []
-        selectors = [
-            'table tr td a[href*="fitxaProducte.aspx"]',  # Enlaces directos a productos
-            '.product-item a', 
-            '.item a', 
-            '.product a',
-            'a[href*="fitxaProducte.aspx"]'  # Cualquier enlace a ficha de producto
-        ]
+        # Enlaces a fichas con los selectores del esquema (gana el primero que encuentra elementos)
+        selector, found_items, product_links = extract_listing_links(soup)
+        # En modo solo listado se guardan también el precio y la disponibilidad de cada fila
+        listing_rows = {row['href']: row for row in extract_listing_rows(soup)} if LISTING_ONLY else {}
         
-        for selector in selectors:
-            items = soup.select(selector)
-            if items:
-                product_items = items
-                print(f"  Selector exitoso: {selector} - Encontrados: {len(items)} productos")
-                break
+        for product_name, href in product_links:
+            product_link = urljoin(BASE_URL, href)
+            
+            # Evitar duplicados (por URL canónica)
+            if seen_products.add(canonicalize_url(product_link)):
+                product = {
+                    'Category': category['Category'],
+                    'Product': product_name,
+                    'Link': product_link
+                }
+                if LISTING_ONLY:
+                    row = listing_rows.get(href, {})
+                    product['Price'] = row.get('price')
+                    product['Availability'] = row.get('availability')
+                products.append(product)
         
-        for item in product_items:
-            href = item.get('href', '')
-            if 'fitxaProducte.aspx?idproducte=' in href:
-                # Intentar obtener el nombre del producto
-                product_name = item.text.strip()
-                if not product_name:
-                    # Si el enlace no tiene texto, buscar en elementos cercanos
-                    parent = item.parent
-                    name_elem = parent.select_one('h3, h4, .title, .name, strong')
-                    if name_elem:
-                        product_name = name_elem.text.strip()
-                    else:
-                        # Si no encontramos nombre, usar el ID del producto
-                        id_match = re.search(r'idproducte=([^&]+)', href)
-                        product_name = f"Producto {id_match.group(1)}" if id_match else "Producto sin nombre"
-                
-                product_link = urljoin(BASE_URL, href)
-                
-                # Evitar duplicados
-                if not any(p['Link'] == product_link for p in products):
-                    products.append({
-                        'Category': category['Category'],
-                        'Product': product_name,
-                        'Link': product_link
-                    })
+        if LOW_MEMORY:
+            release_tree(soup)
         
-        print(f"  Total productos encontrados en {category['Category']}: {len([p for p in products if p['Category'] == category['Category']])}")
+        log_event(log, "Categoría listada", stage='listing', category=category['Category'], selector=selector,
+                  found_items=found_items,
+                  products=len([p for p in products if p['Category'] == category['Category']]))
         # Pausa para no sobrecargar el servidor
-        time.sleep(1)
+        time.sleep(REQUEST_PAUSE)
     
     return products
 
 def extract_product_details(product_list):
     """Extrae los detalles de cada producto"""
-    print("Extrayendo detalles de productos...")
+    log_event(log, "Extrayendo detalles de productos", stage='details')
     product_details = []
+    fetched = SeenSet()
     
     for product in product_list:
-        print(f"Procesando producto: {product['Product']}")
-        soup = get_soup(product['Link'])
-        if not soup:
+        if crawl_deadline.expired:
+            log_event(log, "Se agotó el tiempo del rastreo: se guardan los productos procesados hasta ahora",
+                      stage='details', level=logging.WARNING)
+            break
+        log_event(log, "Procesando producto", stage='details', page=True, product=product['Product'],
+                  url=product['Link'])
+        # No descargar dos veces la misma ficha
+        if not fetched.add(canonicalize_url(product['Link'])):
+            continue
+        # Pausa entre fichas para no sobrecargar el servidor (no antes de la
+        # primera: una consulta de un solo producto no espera)
+        if len(fetched) > 1:
+            time.sleep(REQUEST_PAUSE)
+        html = fetch_html(product['Link'])
+        if html is None:
             continue
         
         # Extraer referencia del producto (desde la URL)
-        ref_match = re.search(r'idproducte=([^&]+)', product['Link'])
-        ref = ref_match.group(1) if ref_match else "Sin referencia"
-        
-        # Intentar encontrar el tipo de producto
-        product_type = ""
-        type_selectors = ['.product-type', '.type', '.category']
-        for selector in type_selectors:
-            type_elem = soup.select_one(selector)
-            if type_elem:
-                product_type = type_elem.text.strip()
-                break
-        
-        # Si no encontramos tipo, asumimos "Variantes" si hay variantes
-        if not product_type:
-            product_type = "Variantes"
-        
-        # Buscar precio y disponibilidad
-        price = "Consultar"
-        availability = ""
+        ref = product_ref(product['Link']) or "Sin referencia"
         
-        # Intentar diferentes selectores para el precio
-        price_selectors = ['.price', '.product-price', '.precio', 'span[itemprop="price"]', 'strong']
-        for selector in price_selectors:
-            price_elem = soup.select_one(selector)
-            if price_elem and re.search(r'\d', price_elem.text):
-                price = price_elem.text.strip()
-                # Limpiar el precio
-                price = re.sub(r'[^\d,.]', '', price) + '€'
-                break
+        # Campos de la ficha; si su contenido no ha cambiado desde que se analizó
+        # (sin contar los campos ocultos de ASP.NET ni los parámetros anticaché), se reutilizan
+        fields = extraction_memo.extract(html, parse_product_page)
         
-        # Intentar diferentes selectores para disponibilidad
-        avail_selectors = ['.availability', '.stock', '.disponibilidad']
-        for selector in avail_selectors:
-            avail_elem = soup.select_one(selector)
-            if avail_elem:
-                availability = avail_elem.text.strip()
-                break
+        # Los productos del sitemap solo traen un nombre provisional ("Producto <id>"):
+        # se usa el título de la ficha
+        product_name = product['Product']
+        if product['Category'] == SITEMAP_CATEGORY and fields['title']:
+            product_name = fields['title']
         
-        # Obtener descripción
-        description = get_product_description(soup)
+        price = fields['price']
+        availability = fields['availability']
+        description = fields['description']
         
-        # Buscar variantes del producto
-        variants_found = False
-        variant_selectors = [
-            '.product-variants .variant-item', 
-            '.variants .item', 
-            'select option', 
-            'input[type="radio"][name="variant"]',
-            'table tr'  # Muchas veces las variantes están en tablas
-        ]
-        
-        for selector in variant_selectors:
-            variants = soup.select(selector)
-            if variants and len(variants) > 1:  # Si hay más de un elemento, probablemente son variantes
-                variants_found = True
-                for variant in variants:
-                    variant_name = "Variante estándar"
-                    variant_price = price
-                    
-                    # Intentar extraer nombre de variante
-                    name_elem = variant.select_one('.name, .title, td:first-child')
-                    if name_elem:
-                        variant_name = name_elem.text.strip()
-                    
-                    # Intentar extraer precio de variante
-                    price_elem = variant.select_one('.price, td:nth-child(2)')
-                    if price_elem and re.search(r'\d', price_elem.text):
-                        variant_price = price_elem.text.strip()
-                        # Limpiar el precio
-                        variant_price = re.sub(r'[^\d,.]', '', variant_price) + '€'
-                    
-                    product_details.append({
-                        'Category': product['Category'],
-                        'Ref': ref,
-                        'Product': product['Product'],
-                        'Type': product_type,
-                        'Product Variant': variant_name,
-                        'Variant': "Variantes",
-                        'Price': variant_price,
-                        'Availability': availability,
-                        'Description': description,
-                        'Link': product['Link']
-                    })
-                break  # Si encontramos variantes con este selector, no seguimos buscando
+        # Si encontramos variantes, añadimos una fila por cada una
+        variants_found = fields['variants'] is not None
+        if variants_found:
+            for variant_name, variant_price in fields['variants']:
+                product_details.append({
+                    'Category': product['Category'],
+                    'Ref': ref,
+                    'Product': product_name,
+                    'Type': fields['type'],
+                    'Product Variant': variant_name,
+                    'Variant': "Variantes",
+                    'Price': variant_price or price,
+                    'Availability': availability,
+                    'Description': description,
+                    'Link': product['Link']
+                })
         
         # Si no encontramos variantes, agregamos el producto como único
         if not variants_found:
             product_details.append({
                 'Category': product['Category'],
                 'Ref': ref,
-                'Product': product['Product'],
+                'Product': product_name,
                 'Type': "",
-                'Product Variant': product['Product'],
+                'Product Variant': product_name,
                 'Variant': "",
                 'Price': price,
                 'Availability': availability,
                 'Description': description,
                 'Link': product['Link']
             })
-        
-        # Pausa para no sobrecargar el servidor
-        time.sleep(1)
     
     return product_details
 
 def get_product_description(soup):
     """Extrae la descripción del producto"""
-    description = ""
-    
-    # Intentar diferentes selectores para la descripción
-    desc_selectors = [
-        '.product-description', 
-        '.description', 
-        '.details', 
-        '.product-details',
-        '[itemprop="description"]',
-        '.info',
-        'p'  # A veces la descripción está en párrafos simples
-    ]
-    
-    for selector in desc_selectors:
-        desc_elements = soup.select(selector)
-        if desc_elements:
-            # Concatenar todos los elementos de descripción
-            description = ' '.join([elem.text.strip() for elem in desc_elements])
-            # Limpiar espacios en blanco múltiples
-            description = re.sub(r'\s+', ' ', description).strip()
-            if description:  # Si encontramos algo, terminamos
-                break
-    
-    return description
+    return extract_product_fields(soup)['description']
 
-def save_to_excel(categories, product_list, product_details, filename="Luluka_Scraping_Result.xlsx"):
+def save_to_excel(categories, product_list, product_details, filename=OUTPUT_FILE, changes=None):
     """Guarda los datos extraídos en un archivo Excel"""
+    # pandas y openpyxl tardan en importarse: solo se cargan al exportar
+    import pandas as pd
+    from luluka_diff import changes_sheet
+    
     print(f"Guardando resultados en {filename}...")
     
     # Crear un escritor de Excel
@@ -283,27 +287,90 @@ def save_to_excel(categories, product_list, product_details, filename="Luluka_Sc
         # Guardar detalles de productos
         df_product_details = pd.DataFrame(product_details)
         df_product_details.to_excel(writer, sheet_name='Products', index=False)
+        
+        # Guardar los cambios respecto a la ejecución anterior
+        if changes is not None:
+            changes_sheet(changes).to_excel(writer, sheet_name='Changes', index=False)
     
     print(f"Datos guardados exitosamente en {filename}")
 
+def export_results(categories, product_list, product_details, filename=OUTPUT_FILE):
+    """Compara con la exportación anterior y guarda el Excel, el histórico y el archivo Parquet"""
+    from luluka_archive import write_snapshot
+    from luluka_diff import carry_forward, compare_runs, summarize_changes, load_previous_details
+    
+    # Comparar con la exportación anterior antes de sobrescribirla. Los productos
+    # cuya ficha no se ha descargado en esta ejecución conservan sus filas anteriores
+    changes = None
+    exported_details = product_details
+    previous_details = load_previous_details(filename)
+    if previous_details is not None:
+        exported_details = carry_forward(previous_details, product_details, product_list).to_dict('records')
+        changes = compare_runs(previous_details, exported_details)
+        summary = summarize_changes(changes)
+        print(f"Cambios respecto a la ejecución anterior: {summary['added']} añadidos, "
+              f"{summary['removed']} eliminados, {summary['changed']} modificados")
+    
+    save_to_excel(categories, product_list, exported_details, filename, changes=changes)
+    store_results(categories, product_list, product_details, source="luluka_scraper")
+    write_snapshot(product_details)
+
 def main():
+    global crawl_deadline
+    setup_logging(LOG_LEVEL)
     print("Iniciando web scraping de Lulukabaraka.com...")
     
-    # Extraer categorías
-    categories = extract_categories()
-    print(f"Se encontraron {len(categories)} categorías")
+    monitor = MemoryMonitor(trace=LOW_MEMORY)
+    crawl_deadline = Deadline(CRAWL_DEADLINE, EXPORT_RESERVE)
     
-    # Extraer lista de productos
-    product_list = extract_product_list(categories)
-    print(f"Se encontraron {len(product_list)} productos")
+    # Con USE_SITEMAP se intenta descubrir los productos directamente desde
+    # robots.txt/sitemap.xml. El modo solo listado necesita los listados de categoría
+    first_product = None
+    if USE_SITEMAP and not LISTING_ONLY:
+        sitemap_products = iter_sitemap_products(BASE_URL, requests, headers, circuit_breaker, crawl_deadline)
+        first_product = next(sitemap_products, None)
     
-    # Extraer detalles de productos
-    product_details = extract_product_details(product_list)
+    if first_product:
+        # Con sitemap no hace falta recorrer el menú ni los listados de categorías:
+        # los productos pasan directamente a la extracción de detalles
+        print("Sitemap encontrado. Se omiten los listados de categorías.")
+        categories = []
+        product_list = []
+        with monitor.stage("sitemap y detalles"):
+            product_details = extract_with_schedule(
+                extract_product_details,
+                collect(chain([first_product], sitemap_products), product_list),
+                FETCH_BUDGET, deadline=crawl_deadline
+            )
+        print(f"Se encontraron {len(product_list)} productos")
+    else:
+        # Extraer categorías
+        with monitor.stage("categorías"):
+            categories = extract_categories()
+        print(f"Se encontraron {len(categories)} categorías")
+        
+        # Extraer lista de productos
+        with monitor.stage("lista de productos"):
+            product_list = extract_product_list(categories)
+        print(f"Se encontraron {len(product_list)} productos")
+        
+        # Extraer detalles de productos (según el plan de revisitas). En modo solo
+        # listado solo se descargan las fichas de los productos sin precio en el listado
+        listing_details, to_fetch = [], product_list
+        if LISTING_ONLY:
+            listing_details, to_fetch = split_listing_details(product_list)
+            print(f"Precios tomados del listado: {len(listing_details)}; fichas a descargar: {len(to_fetch)}")
+        with monitor.stage("detalles"):
+            product_details = listing_details + extract_with_schedule(
+                extract_product_details, to_fetch, FETCH_BUDGET, deadline=crawl_deadline
+            )
     print(f"Se procesaron {len(product_details)} detalles de productos")
     
     # Guardar resultados
-    save_to_excel(categories, product_list, product_details)
+    with monitor.stage("guardado"):
+        export_results(categories, product_list, product_details)
     
+    monitor.report()
     print("Proceso de web scraping completado")
 
 if __name__ == "__main__":
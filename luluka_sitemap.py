@@ -0,0 +1,122 @@
+import gzip
+import io
+import logging
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
+from luluka_extractor import SITEMAP_CATEGORY, SITEMAP_PRODUCT_RE
+from luluka_frontier import SeenSet, canonicalize_url
+from luluka_transport import guarded_get
+
+logger = logging.getLogger(__name__)
+
+# Profundidad máxima de índices de sitemaps anidados
+MAX_SITEMAP_DEPTH = 3
+
+# Timeouts (segundos) de conexión y lectura: un sitemap puede ser mucho mayor que una página
+SITEMAP_TIMEOUT = (5, 30)
+
+
+def find_sitemaps(base_url, http, headers=None, breaker=None, deadline=None):
+    """Obtiene las URLs de sitemap declaradas en robots.txt (o /sitemap.xml por defecto).
+
+    Las descargas pasan por el mismo circuito (`breaker`) y tiempo límite
+    (`deadline`) que el resto del rastreo.
+    """
+    sitemaps = []
+    try:
+        response = guarded_get(http, urljoin(base_url, '/robots.txt'), headers, breaker,
+                               deadline=deadline, timeout=SITEMAP_TIMEOUT)
+        for line in response.text.splitlines():
+            key, _, value = line.partition(':')
+            if key.strip().lower() == 'sitemap' and value.strip():
+                url = urljoin(base_url, value.strip())
+                if url not in sitemaps:
+                    sitemaps.append(url)
+    except Exception as e:
+        logger.warning("Error al obtener robots.txt: %s", e)
+
+    if not sitemaps:
+        sitemaps.append(urljoin(base_url, '/sitemap.xml'))
+    return sitemaps
+
+
+def _open_sitemap(content):
+    """Devuelve un flujo legible del sitemap, descomprimiendo si es gzip"""
+    stream = io.BytesIO(content)
+    if content[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_sitemap_urls(sitemap_url, http, headers=None, breaker=None, deadline=None, _depth=0, _visited=None):
+    """Recorre un sitemap (o índice de sitemaps) y genera cada <loc> de página.
+
+    El XML se analiza de forma incremental, liberando cada entrada procesada,
+    para no construir el árbol completo de sitemaps grandes.
+    """
+    visited = _visited if _visited is not None else set()
+    if sitemap_url in visited or _depth > MAX_SITEMAP_DEPTH:
+        return
+    visited.add(sitemap_url)
+
+    try:
+        response = guarded_get(http, sitemap_url, headers, breaker, deadline=deadline, timeout=SITEMAP_TIMEOUT)
+    except Exception as e:
+        logger.warning("Error al obtener %s: %s", sitemap_url, e)
+        return
+
+    child_sitemaps = []
+    try:
+        stream = _open_sitemap(response.content)
+        del response
+        is_index = False
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            name = _local_name(elem.tag)
+            if event == 'start':
+                if name == 'sitemapindex':
+                    is_index = True
+                continue
+            if name == 'loc' and elem.text:
+                loc = urljoin(sitemap_url, elem.text.strip())
+                if is_index:
+                    child_sitemaps.append(loc)
+                else:
+                    yield loc
+            elif name in ('url', 'sitemap'):
+                # Liberar los nodos ya procesados
+                elem.clear()
+    except (ET.ParseError, OSError, EOFError) as e:
+        logger.warning("Error al analizar %s: %s", sitemap_url, e)
+
+    for child in child_sitemaps:
+        yield from iter_sitemap_urls(child, http, headers, breaker, deadline, _depth + 1, visited)
+
+
+def iter_sitemap_products(base_url, http, headers=None, breaker=None, deadline=None):
+    """Genera productos {'Category', 'Product', 'Link'} a partir de los sitemaps del sitio"""
+    seen = SeenSet()
+    for sitemap_url in find_sitemaps(base_url, http, headers, breaker, deadline):
+        for loc in iter_sitemap_urls(sitemap_url, http, headers, breaker, deadline):
+            match = SITEMAP_PRODUCT_RE.search(loc)
+            if not match:
+                continue
+            product_id = match.group(1)
+            # Evitar duplicados (por URL canónica)
+            if not seen.add(canonicalize_url(loc)):
+                continue
+            yield {
+                'Category': SITEMAP_CATEGORY,
+                'Product': f"Producto {product_id}",
+                'Link': loc
+            }
+
+
+def collect(products, sink):
+    """Reenvía los productos de un generador guardando una copia en `sink`"""
+    for product in products:
+        sink.append(product)
+        yield product
@@ -0,0 +1,316 @@
+import argparse
+import logging
+import re
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from luluka_extractor import SITEMAP_CATEGORY
+
+logger = logging.getLogger(__name__)
+
+# Base de datos con el histórico de todas las ejecuciones
+STORE_DB = "luluka_store.db"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS categories (
+    name TEXT PRIMARY KEY,
+    link TEXT,
+    last_seen TEXT
+);
+CREATE TABLE IF NOT EXISTS products (
+    ref TEXT PRIMARY KEY,
+    name TEXT,
+    category TEXT,
+    link TEXT,
+    description TEXT,
+    first_seen TEXT,
+    last_seen TEXT
+);
+CREATE TABLE IF NOT EXISTS variants (
+    ref TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    first_seen TEXT,
+    last_seen TEXT,
+    PRIMARY KEY (ref, variant)
+);
+CREATE TABLE IF NOT EXISTS observations (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    ref TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    category TEXT,
+    price TEXT,
+    price_value REAL,
+    availability TEXT,
+    observed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_category ON products (category);
+CREATE INDEX IF NOT EXISTS idx_observations_ref_time ON observations (ref, observed_at);
+CREATE INDEX IF NOT EXISTS idx_observations_ref_run ON observations (ref, run_id);
+CREATE INDEX IF NOT EXISTS idx_observations_category_time ON observations (category, observed_at);
+CREATE INDEX IF NOT EXISTS idx_observations_time ON observations (observed_at);
+'''
+
+# Índice de texto completo de nombres, variantes y descripciones. El rowid de
+# cada entrada es el de su variante, así cada ejecución la reemplaza en su sitio.
+SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+    product, variant, description, category UNINDEXED, ref UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+'''
+
+# Filas que se indexan a partir de las variantes y sus productos
+SEARCH_ROWS = '''
+    SELECT v.rowid, p.name, v.variant, p.description, p.category, p.ref
+    FROM variants v JOIN products p ON p.ref = v.ref
+'''
+
+# Resultados que devuelve una búsqueda
+SEARCH_LIMIT = 50
+
+PRICE_VALUE_RE = re.compile(r'[\d.,]+')
+SEARCH_TOKEN_RE = re.compile(r'\w+')
+
+
+def parse_price(price):
+    """Convierte un precio como '1.234,56€' en número (None si es 'Consultar')"""
+    match = PRICE_VALUE_RE.search(str(price or ''))
+    if not match:
+        return None
+    text = match.group(0).strip('.,')
+    if not text:
+        return None
+    # Formato español: punto para miles y coma decimal
+    if ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    elif text.count('.') > 1:
+        text = text.replace('.', '')
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def search_terms(text):
+    """Palabras de una búsqueda (se ignoran los signos de la sintaxis de FTS5)"""
+    return SEARCH_TOKEN_RE.findall(text or '')
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class ResultStore:
+    """Almacén persistente de resultados con índices por referencia, categoría y fecha"""
+
+    def __init__(self, path=STORE_DB):
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        # Sin FTS5 en la versión de SQLite se busca con LIKE (más lento y sin ignorar acentos)
+        try:
+            self.conn.executescript(SEARCH_SCHEMA)
+            self.has_search_index = True
+        except sqlite3.OperationalError:
+            self.has_search_index = False
+        if self.has_search_index and self.conn.execute('SELECT 1 FROM product_search LIMIT 1').fetchone() is None:
+            # Histórico anterior al índice: se indexa entero una sola vez
+            with self.conn:
+                self.conn.execute(
+                    'INSERT INTO product_search (rowid, product, variant, description, category, ref) ' + SEARCH_ROWS
+                )
+
+    def close(self):
+        self.conn.close()
+
+    def save_run(self, categories, product_list, product_details, source=None, observed_at=None):
+        """Guarda una ejecución completa; devuelve el id de la ejecución"""
+        observed_at = observed_at or _now()
+        with self.conn:
+            run_id = self.conn.execute(
+                'INSERT INTO runs (started_at, source) VALUES (?, ?)', (observed_at, source)
+            ).lastrowid
+
+            self.conn.executemany(
+                'INSERT INTO categories (name, link, last_seen) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET link = excluded.link, last_seen = excluded.last_seen',
+                [(cat['Category'], cat['Link'], observed_at) for cat in categories]
+            )
+
+            products = {}
+            for row in product_details:
+                products.setdefault(row['Ref'], row)
+            self.conn.executemany(
+                'INSERT INTO products (ref, name, category, link, description, first_seen, last_seen) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(ref) DO UPDATE SET name = excluded.name, '
+                # Los productos descubiertos por el sitemap no traen categoría: se conserva la anterior
+                'category = CASE WHEN excluded.category != ? THEN excluded.category ELSE products.category END, '
+                'link = excluded.link, last_seen = excluded.last_seen, '
+                # Las filas del modo solo listado no traen descripción: se conserva la anterior
+                "description = CASE WHEN excluded.description != '' THEN excluded.description "
+                'ELSE products.description END',
+                [(ref, row['Product'], row['Category'], row['Link'], row.get('Description', ''),
+                  observed_at, observed_at, SITEMAP_CATEGORY) for ref, row in products.items()]
+            )
+
+            self.conn.executemany(
+                'INSERT INTO variants (ref, variant, first_seen, last_seen) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(ref, variant) DO UPDATE SET last_seen = excluded.last_seen',
+                {(row['Ref'], row['Product Variant'], observed_at, observed_at) for row in product_details}
+            )
+
+            # Solo se reindexan las variantes vistas en esta ejecución
+            if self.has_search_index:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO product_search (rowid, product, variant, description, category, ref) '
+                    + SEARCH_ROWS + ' WHERE v.ref = ? AND v.variant = ?',
+                    {(row['Ref'], row['Product Variant']) for row in product_details}
+                )
+
+            self.conn.executemany(
+                'INSERT INTO observations (run_id, ref, variant, category, price, price_value, availability, observed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, row['Ref'], row['Product Variant'], row['Category'], row['Price'],
+                  parse_price(row['Price']), row['Availability'], observed_at) for row in product_details]
+            )
+        return run_id
+
+    def price_history(self, ref, days=90, variant=None):
+        """Observaciones de precio de una referencia en los últimos `days` días"""
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%S')
+        query = ('SELECT observed_at, variant, price, price_value, availability FROM observations '
+                 'WHERE ref = ? AND observed_at >= ?')
+        params = [ref, since]
+        if variant is not None:
+            query += ' AND variant = ?'
+            params.append(variant)
+        query += ' ORDER BY observed_at, run_id, variant'
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+    def latest_prices(self, category=None):
+        """Último precio observado de cada variante (opcionalmente de una categoría)"""
+        query = '''
+            SELECT o.ref, o.variant, o.category, o.price, o.price_value, o.availability, o.observed_at
+            FROM observations o
+            JOIN (SELECT ref, MAX(run_id) AS run_id FROM observations GROUP BY ref) last
+              ON last.ref = o.ref AND last.run_id = o.run_id
+        '''
+        params = []
+        if category is not None:
+            query += ' WHERE o.category = ?'
+            params.append(category)
+        query += ' ORDER BY o.category, o.ref, o.variant'
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+    def search_products(self, category=None):
+        """Productos conocidos, opcionalmente filtrados por categoría"""
+        if category is None:
+            rows = self.conn.execute('SELECT * FROM products ORDER BY category, ref')
+        else:
+            rows = self.conn.execute('SELECT * FROM products WHERE category = ? ORDER BY ref', (category,))
+        return [dict(row) for row in rows]
+
+    def search(self, text, category=None, limit=SEARCH_LIMIT):
+        """Variantes cuyo nombre, variante o descripción contienen todas las palabras buscadas.
+
+        Cada palabra se busca también como prefijo y sin tener en cuenta
+        acentos. Los resultados se ordenan por relevancia (BM25, con más peso
+        para el nombre que para la descripción).
+        """
+        terms = search_terms(text)
+        if not terms:
+            return []
+        if self.has_search_index:
+            query = '''
+                SELECT s.ref, s.category, s.product, s.variant,
+                       snippet(product_search, 2, '[', ']', '…', 12) AS snippet, p.link
+                FROM product_search s JOIN products p ON p.ref = s.ref
+                WHERE product_search MATCH ?
+            '''
+            params = [' '.join(f'"{term}"*' for term in terms)]
+            if category is not None:
+                query += ' AND s.category = ?'
+                params.append(category)
+            query += ' ORDER BY bm25(product_search, 10.0, 5.0, 1.0) LIMIT ?'
+        else:
+            query = '''
+                SELECT p.ref, p.category, p.name AS product, v.variant, p.description AS snippet, p.link
+                FROM variants v JOIN products p ON p.ref = v.ref
+                WHERE 1 = 1
+            '''
+            params = []
+            for term in terms:
+                query += " AND (p.name || ' ' || v.variant || ' ' || COALESCE(p.description, '')) LIKE ?"
+                params.append(f'%{term}%')
+            if category is not None:
+                query += ' AND p.category = ?'
+                params.append(category)
+            query += ' ORDER BY p.category, p.ref, v.variant LIMIT ?'
+        params.append(limit)
+        return [dict(row) for row in self.conn.execute(query, params)]
+
+
+def store_results(categories, product_list, product_details, source=None, path=STORE_DB):
+    """Añade los resultados de una ejecución al almacén histórico"""
+    store = ResultStore(path)
+    try:
+        run_id = store.save_run(categories, product_list, product_details, source)
+    finally:
+        store.close()
+    logger.info("Resultados añadidos al histórico %s (ejecución %s)", path, run_id)
+    return run_id
+
+
+def _print_rows(rows):
+    if not rows:
+        print("Sin resultados")
+        return
+    columns = list(rows[0].keys())
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if row[col] is None else str(row[col]) for col in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consultas sobre el histórico de resultados")
+    parser.add_argument('--db', default=STORE_DB, help="Fichero SQLite del histórico")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    history = subparsers.add_parser('history', help="Evolución del precio de una referencia")
+    history.add_argument('ref')
+    history.add_argument('--days', type=int, default=90)
+    history.add_argument('--variant')
+
+    latest = subparsers.add_parser('latest', help="Últimos precios observados")
+    latest.add_argument('--category')
+
+    products = subparsers.add_parser('products', help="Productos conocidos")
+    products.add_argument('--category')
+
+    search = subparsers.add_parser('search', help="Búsqueda de texto en nombres, variantes y descripciones")
+    search.add_argument('text')
+    search.add_argument('--category')
+    search.add_argument('--limit', type=int, default=SEARCH_LIMIT)
+
+    args = parser.parse_args()
+    store = ResultStore(args.db)
+    try:
+        if args.command == 'history':
+            _print_rows(store.price_history(args.ref, args.days, args.variant))
+        elif args.command == 'latest':
+            _print_rows(store.latest_prices(args.category))
+        elif args.command == 'search':
+            _print_rows(store.search(args.text, args.category, args.limit))
+        else:
+            _print_rows(store.search_products(args.category))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
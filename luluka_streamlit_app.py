@@ -2,11 +2,26 @@ import streamlit as st
 import pandas as pd
 import time
 import os
+import hashlib
+import json
+import uuid
 import sys
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-import re
 from urllib.parse import urljoin
+from luluka_archive import write_snapshot
+from luluka_diff import carry_forward, compare_runs, summarize_changes, changes_sheet, price_values
+from luluka_extractor import (extract_category_links, extract_listing_links, extract_listing_rows,
+                              extract_product_fields, product_ref, split_listing_details)
+from luluka_frontier import SeenSet, canonicalize_url
+from luluka_jobs import JobManager
+from luluka_memo import ExtractionMemo, content_hash
+from luluka_memory import MemoryMonitor, release_tree
+from luluka_metrics import CrawlMetrics
+from luluka_store import ResultStore, store_results
+from luluka_scheduler import interleave_by_category
+from luluka_transport import CircuitBreaker, Deadline, NegativeCache, REQUEST_TIMEOUT, guarded_get
 import base64
 from io import BytesIO
 
@@ -62,16 +77,68 @@ BASE_URL = "https://www.lulukabaraka.com"
 # URL de login
 LOGIN_URL = urljoin(BASE_URL, "login.aspx")
 
-# Crear una sesión para mantener las cookies
-session = requests.Session()
+# Conexiones abiertas como máximo por servidor entre todos los usuarios de la app
+POOL_MAXSIZE = 20
+
+@st.cache_resource
+def get_http_adapter():
+    """Pool de conexiones común a toda la app, acotado a POOL_MAXSIZE conexiones por servidor.
+
+    Con `pool_block` las peticiones esperan a que quede una conexión libre en
+    lugar de abrir conexiones extra.
+    """
+    return HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE, pool_block=True)
+
+def get_user_session():
+    """Sesión HTTP propia de cada usuario (sus cookies y su login), sobre el pool común"""
+    if 'http_session' not in st.session_state:
+        user_session = requests.Session()
+        adapter = get_http_adapter()
+        user_session.mount('http://', adapter)
+        user_session.mount('https://', adapter)
+        st.session_state['http_session'] = user_session
+    return st.session_state['http_session']
+
+# Circuito que pausa el rastreo si el sitio falla de forma continuada y caché
+# de las páginas que ya no existen (404/410), que no se vuelven a pedir.
+# El estado del sitio es el mismo para todos los usuarios: se comparten.
+@st.cache_resource
+def get_circuit_breaker():
+    return CircuitBreaker()
+
+@st.cache_resource
+def get_negative_cache():
+    return NegativeCache()
+
+# Campos ya extraídos de cada contenido de ficha, común a todos los usuarios
+@st.cache_resource
+def get_extraction_memo():
+    return ExtractionMemo()
+
+# Cada usuario usa su propia sesión para mantener las cookies
+session = get_user_session()
+circuit_breaker = get_circuit_breaker()
+dead_urls = get_negative_cache()
+extraction_memo = get_extraction_memo()
+
+# Tiempo límite del rastreo en curso (se fija al pulsar "Iniciar Scraping")
+crawl_deadline = Deadline()
+
+# Contadores de descargas, análisis y pausas del rastreo en curso
+crawl_metrics = CrawlMetrics()
+
+# Segundos del tiempo máximo que se reservan para guardar los resultados
+EXPORT_RESERVE = 30
 
 # Función para descargar el archivo Excel
-def get_excel_download_link(df_categories, df_products, df_details, filename="Luluka_Scraping_Result.xlsx"):
+def get_excel_download_link(df_categories, df_products, df_details, filename="Luluka_Scraping_Result.xlsx", changes=None):
     output = BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df_categories.to_excel(writer, sheet_name='Categories', index=False)
         df_products.to_excel(writer, sheet_name='Product List', index=False)
         df_details.to_excel(writer, sheet_name='Products', index=False)
+        if changes is not None:
+            changes_sheet(changes).to_excel(writer, sheet_name='Changes', index=False)
     
     excel_data = output.getvalue()
     b64 = base64.b64encode(excel_data).decode('utf-8')
@@ -86,8 +153,11 @@ def login(username, password, progress_bar=None, status_text=None):
         status_text.text("Iniciando sesión...")
     
     try:
+        # Empezar sin las cookies de un inicio de sesión anterior
+        session.cookies.clear()
+        
         # Obtener la página de login para capturar tokens CSRF o ViewState
-        login_page = session.get(LOGIN_URL, headers=headers)
+        login_page = session.get(LOGIN_URL, headers=headers, timeout=REQUEST_TIMEOUT)
         login_page.raise_for_status()
         
         if progress_bar:
@@ -140,7 +210,8 @@ def login(username, password, progress_bar=None, status_text=None):
             post_url,
             data=form_data,
             headers=headers,
-            allow_redirects=True
+            allow_redirects=True,
+            timeout=REQUEST_TIMEOUT
         )
         login_response.raise_for_status()
         
@@ -168,20 +239,43 @@ def login(username, password, progress_bar=None, status_text=None):
             progress_bar.progress(100)
         return False
 
-# Función para obtener el contenido HTML de una URL
-def get_soup(url, status_text=None):
+# Función para descargar el HTML de una URL (None si no existe o falla la descarga)
+def fetch_html(url, status_text=None):
     try:
         # Usar la sesión para mantener las cookies
         if status_text:
             status_text.text(f"Obteniendo datos de {url}...")
-        response = session.get(url, headers=headers)
-        response.raise_for_status()
-        return BeautifulSoup(response.text, 'html.parser')
+        response = guarded_get(session, url, headers, circuit_breaker, dead_urls,
+                               status_text.text if status_text else print, deadline=crawl_deadline,
+                               metrics=crawl_metrics)
+        if response is None:
+            if status_text:
+                status_text.text(f"Página inexistente, se omite: {url}")
+            return None
+        return response.text
     except Exception as e:
         if status_text:
             status_text.text(f"Error al obtener {url}: {e}")
         return None
 
+# Función para obtener el contenido HTML de una URL
+def get_soup(url, status_text=None):
+    html = fetch_html(url, status_text)
+    if html is None:
+        return None
+    with crawl_metrics.timed('parse'):
+        return BeautifulSoup(html, 'html.parser')
+
+# Extrae todos los campos de una ficha en un único recorrido del árbol
+def parse_product_page(html):
+    with crawl_metrics.timed('parse'):
+        soup = BeautifulSoup(html, 'html.parser')
+        fields = extract_product_fields(soup)
+    if low_memory:
+        # Solo se conservan los campos extraídos, no el árbol
+        release_tree(soup)
+    return fields
+
 # Función para extraer categorías
 def extract_categories(status_text=None, progress_bar=None):
     if status_text:
@@ -190,6 +284,7 @@ def extract_categories(status_text=None, progress_bar=None):
         progress_bar.progress(10)
     
     categories = []
+    seen_categories = SeenSet()
     
     # Obtener la página principal
     soup = get_soup(BASE_URL, status_text)
@@ -199,20 +294,18 @@ def extract_categories(status_text=None, progress_bar=None):
     if progress_bar:
         progress_bar.progress(30)
     
-    # Buscar enlaces de categorías - probamos varios selectores comunes
-    category_links = soup.select('ul.nav li a, .menu a, .categories a, .navbar a')
-    
-    for link in category_links:
-        href = link.get('href', '')
-        if 'LlistatDeProductes.aspx?idcategoria=' in href:
-            category_name = link.text.strip()
-            full_url = urljoin(BASE_URL, href)
-            # Evitar duplicados
-            if not any(cat['Link'] == full_url for cat in categories):
-                categories.append({
-                    'Category': category_name,
-                    'Link': full_url
-                })
+    # Buscar enlaces de categorías con los selectores del esquema
+    for category_name, href in extract_category_links(soup):
+        full_url = urljoin(BASE_URL, href)
+        # Evitar duplicados (por URL canónica)
+        if seen_categories.add(canonicalize_url(full_url)):
+            categories.append({
+                'Category': category_name,
+                'Link': full_url
+            })
+    
+    if low_memory:
+        release_tree(soup)
     
     if progress_bar:
         progress_bar.progress(50)
@@ -235,21 +328,35 @@ def extract_categories(status_text=None, progress_bar=None):
     
     return categories
 
-# Función para extraer lista de productos
-def extract_product_list(categories, selected_categories=None, status_text=None, progress_bar=None):
+# Función que genera la lista de productos de forma perezosa.
+# Con `limit` deja de visitar categorías en cuanto hay enlaces suficientes; con
+# `sample_evenly` reparte el límite por igual entre las categorías seleccionadas.
+def iter_product_list(categories, selected_categories=None, status_text=None, progress_bar=None,
+                      limit=None, sample_evenly=False, listing_only=False):
     if status_text:
         status_text.text("Extrayendo lista de productos...")
     if progress_bar:
         progress_bar.progress(0)
     
-    products = []
+    found = 0
+    seen_products = SeenSet()
     
     # Filtrar categorías si se han seleccionado específicas
     if selected_categories:
         categories = [cat for cat in categories if cat['Category'] in selected_categories]
     
     total_categories = len(categories)
+    # Cupo por categoría al muestrear; lo que sobra se guarda para completar al final
+    quota = -(-limit // total_categories) if limit and sample_evenly and total_categories else None
+    reserve = []
+    
     for i, category in enumerate(categories):
+        if limit and found >= limit:
+            break
+        if crawl_deadline.expired:
+            if status_text:
+                status_text.text("Se agotó el tiempo: se dejan categorías sin listar")
+            break
         if status_text:
             status_text.text(f"Procesando categoría: {category['Category']} ({i+1}/{total_categories})")
         
@@ -257,73 +364,79 @@ def extract_product_list(categories, selected_categories=None, status_text=None,
         if not soup:
             continue
         
-        # Intentar diferentes selectores para encontrar productos
-        product_items = []
-        selectors = [
-            'table tr td a[href*="fitxaProducte.aspx"]',  # Enlaces directos a productos
-            '.product-item a', 
-            '.item a', 
-            '.product a',
-            'a[href*="fitxaProducte.aspx"]'  # Cualquier enlace a ficha de producto
-        ]
+        # Enlaces a fichas con los selectores del esquema (gana el primero que encuentra elementos)
+        with crawl_metrics.timed('parse'):
+            selector, found_items, product_links = extract_listing_links(soup)
+            # En modo solo listado se guardan también el precio y la disponibilidad de cada fila
+            listing_rows = {row['href']: row for row in extract_listing_rows(soup)} if listing_only else {}
+        if selector and status_text:
+            status_text.text(f"Selector exitoso: {selector} - Encontrados: {found_items} productos")
         
-        for selector in selectors:
-            items = soup.select(selector)
-            if items:
-                product_items = items
-                if status_text:
-                    status_text.text(f"Selector exitoso: {selector} - Encontrados: {len(items)} productos")
-                break
-        
-        for item in product_items:
-            href = item.get('href', '')
-            if 'fitxaProducte.aspx?idproducte=' in href:
-                # Intentar obtener el nombre del producto
-                product_name = item.text.strip()
-                if not product_name:
-                    # Si el enlace no tiene texto, buscar en elementos cercanos
-                    parent = item.parent
-                    name_elem = parent.select_one('h3, h4, .title, .name, strong')
-                    if name_elem:
-                        product_name = name_elem.text.strip()
-                    else:
-                        # Si no encontramos nombre, usar el ID del producto
-                        id_match = re.search(r'idproducte=([^&]+)', href)
-                        product_name = f"Producto {id_match.group(1)}" if id_match else "Producto sin nombre"
-                
-                product_link = urljoin(BASE_URL, href)
-                
-                # Evitar duplicados
-                if not any(p['Link'] == product_link for p in products):
-                    products.append({
-                        'Category': category['Category'],
-                        'Product': product_name,
-                        'Link': product_link
-                    })
+        category_found = 0
+        for product_name, href in product_links:
+            product_link = urljoin(BASE_URL, href)
+            
+            # Evitar duplicados (por URL canónica)
+            if seen_products.add(canonicalize_url(product_link)):
+                product = {
+                    'Category': category['Category'],
+                    'Product': product_name,
+                    'Link': product_link
+                }
+                if listing_only:
+                    row = listing_rows.get(href, {})
+                    product['Price'] = row.get('price')
+                    product['Availability'] = row.get('availability')
+                if (quota and category_found >= quota) or (limit and found >= limit):
+                    if quota:
+                        reserve.append(product)
+                    continue
+                category_found += 1
+                found += 1
+                yield product
+        
+        if low_memory:
+            release_tree(soup)
         
         if status_text:
-            status_text.text(f"Total productos encontrados en {category['Category']}: {len([p for p in products if p['Category'] == category['Category']])}")
+            status_text.text(f"Total productos encontrados en {category['Category']}: {category_found}")
         
         # Actualizar barra de progreso
         if progress_bar:
             progress_bar.progress(int(((i + 1) / total_categories) * 100))
         
-        # Pausa para no sobrecargar el servidor
-        time.sleep(0.5)
+        # Pausa para no sobrecargar el servidor (no hace falta tras la última categoría)
+        if i + 1 < total_categories and not (limit and found >= limit):
+            with crawl_metrics.timed('throttle'):
+                time.sleep(0.5)
     
-    if status_text:
-        status_text.text(f"Se encontraron {len(products)} productos en total")
+    # Completar el límite con productos sobrantes de categorías con más enlaces
+    for product in reserve:
+        if found >= limit:
+            break
+        found += 1
+        yield product
     
-    return products
+    if progress_bar:
+        progress_bar.progress(100)
+    if status_text:
+        status_text.text(f"Se encontraron {found} productos en total")
+
+# Función para extraer lista de productos
+def extract_product_list(categories, selected_categories=None, status_text=None, progress_bar=None,
+                         limit=None, sample_evenly=False, listing_only=False):
+    return list(iter_product_list(categories, selected_categories, status_text, progress_bar, limit, sample_evenly,
+                                  listing_only))
 
 # Función para extraer detalles de productos
-def extract_product_details(product_list, max_products=None, status_text=None, progress_bar=None):
+def extract_product_details(product_list, max_products=None, status_text=None, progress_bar=None, on_rows=None):
     if status_text:
         status_text.text("Extrayendo detalles de productos...")
     if progress_bar:
         progress_bar.progress(0)
     
     product_details = []
+    fetched = SeenSet()
     
     # Limitar el número de productos si se especifica
     if max_products and max_products < len(product_list):
@@ -331,109 +444,66 @@ def extract_product_details(product_list, max_products=None, status_text=None, p
         if status_text:
             status_text.text(f"Limitando a {max_products} productos para el análisis detallado")
     
+    # Con tiempo límite se alternan las categorías para cubrirlas todas en parte
+    if crawl_deadline.expires_at is not None:
+        product_list = interleave_by_category(product_list)
+    
     total_products = len(product_list)
+    crawl_metrics.set_category_totals(product_list)
     for i, product in enumerate(product_list):
+        if crawl_deadline.expired:
+            if status_text:
+                status_text.text(f"Se agotó el tiempo: se guardan {i} de {total_products} productos")
+            break
         if status_text:
             status_text.text(f"Procesando producto {i+1}/{total_products}: {product['Product']}")
         
-        soup = get_soup(product['Link'], status_text)
-        if not soup:
+        # No descargar dos veces la misma ficha
+        if not fetched.add(canonicalize_url(product['Link'])):
+            continue
+        
+        html = fetch_html(product['Link'], status_text)
+        crawl_metrics.category_done(product['Category'])
+        if html is None:
             continue
         
         # Extraer referencia del producto (desde la URL)
-        ref_match = re.search(r'idproducte=([^&]+)', product['Link'])
-        ref = ref_match.group(1) if ref_match else "Sin referencia"
-        
-        # NUEVO: Extraer el nombre real del producto desde el título de la página
-        product_title_elem = soup.select_one('h1.title')
-        if product_title_elem and product_title_elem.text.strip():
-            # Actualizar el nombre del producto con el título real
-            product_name = product_title_elem.text.strip()
-        else:
-            # Mantener el nombre original si no se encuentra el título
-            product_name = product['Product']
-        
-        # Intentar encontrar el tipo de producto
-        product_type = ""
-        type_selectors = ['.product-type', '.type', '.category']
-        for selector in type_selectors:
-            type_elem = soup.select_one(selector)
-            if type_elem:
-                product_type = type_elem.text.strip()
-                break
-        
-        # Si no encontramos tipo, asumimos "Variantes" si hay variantes
-        if not product_type:
-            product_type = "Variantes"
-        
-        # Buscar precio y disponibilidad
-        price = "Consultar"
-        availability = ""
-        
-        # Intentar diferentes selectores para el precio
-        price_selectors = ['.price', '.product-price', '.precio', 'span[itemprop="price"]', 'strong']
-        for selector in price_selectors:
-            price_elem = soup.select_one(selector)
-            if price_elem and re.search(r'\d', price_elem.text):
-                price = price_elem.text.strip()
-                # Limpiar el precio
-                price = re.sub(r'[^\d,.]', '', price) + '€'
-                break
-        
-        # Intentar diferentes selectores para disponibilidad
-        avail_selectors = ['.availability', '.stock', '.disponibilidad']
-        for selector in avail_selectors:
-            avail_elem = soup.select_one(selector)
-            if avail_elem:
-                availability = avail_elem.text.strip()
-                break
-        
-        # Obtener descripción
-        description = get_product_description(soup)
-        
-        # Buscar variantes del producto
-        variants_found = False
-        variant_selectors = [
-            '.product-variants .variant-item', 
-            '.variants .item', 
-            'select option', 
-            'input[type="radio"][name="variant"]',
-            'table tr'  # Muchas veces las variantes están en tablas
-        ]
+        ref = product_ref(product['Link']) or "Sin referencia"
+        
+        # Campos de la ficha; si su contenido no ha cambiado desde que se analizó
+        # (sin contar los campos ocultos de ASP.NET ni los parámetros anticaché), se reutilizan
+        memo_key = content_hash(html)
+        fields = extraction_memo.get(memo_key)
+        crawl_metrics.record_memo(fields is not None)
+        if fields is None:
+            fields = parse_product_page(html)
+            extraction_memo.put(memo_key, fields)
+        rows_before = len(product_details)
         
-        for selector in variant_selectors:
-            variants = soup.select(selector)
-            if variants and len(variants) > 1:  # Si hay más de un elemento, probablemente son variantes
-                variants_found = True
-                for variant in variants:
-                    variant_name = "Variante estándar"
-                    variant_price = price
-                    
-                    # Intentar extraer nombre de variante
-                    name_elem = variant.select_one('.name, .title, td:first-child')
-                    if name_elem:
-                        variant_name = name_elem.text.strip()
-                    
-                    # Intentar extraer precio de variante
-                    price_elem = variant.select_one('.price, td:nth-child(2)')
-                    if price_elem and re.search(r'\d', price_elem.text):
-                        variant_price = price_elem.text.strip()
-                        # Limpiar el precio
-                        variant_price = re.sub(r'[^\d,.]', '', variant_price) + '€'
-                    
-                    product_details.append({
-                        'Category': product['Category'],
-                        'Ref': ref,
-                        'Product': product_name,  # Usar el nombre actualizado
-                        'Type': product_type,
-                        'Product Variant': variant_name,
-                        'Variant': "Variantes",
-                        'Price': variant_price,
-                        'Availability': availability,
-                        'Description': description,
-                        'Link': product['Link']
-                    })
-                break  # Si encontramos variantes con este selector, no seguimos buscando
+        # NUEVO: Usar el nombre real del producto desde el título de la página
+        # (se mantiene el nombre original si no se encuentra el título)
+        product_name = fields['title'] or product['Product']
+        
+        price = fields['price']
+        availability = fields['availability']
+        description = fields['description']
+        
+        # Si encontramos variantes, añadimos una fila por cada una
+        variants_found = fields['variants'] is not None
+        if variants_found:
+            for variant_name, variant_price in fields['variants']:
+                product_details.append({
+                    'Category': product['Category'],
+                    'Ref': ref,
+                    'Product': product_name,  # Usar el nombre actualizado
+                    'Type': fields['type'],
+                    'Product Variant': variant_name,
+                    'Variant': "Variantes",
+                    'Price': variant_price or price,
+                    'Availability': availability,
+                    'Description': description,
+                    'Link': product['Link']
+                })
         
         # Si no encontramos variantes, agregamos el producto como único
         if not variants_found:
@@ -454,8 +524,13 @@ def extract_product_details(product_list, max_products=None, status_text=None, p
         if progress_bar:
             progress_bar.progress(int(((i + 1) / total_products) * 100))
         
+        # Entregar las filas nuevas en cuanto se procesa cada producto
+        if on_rows:
+            on_rows(product_details[rows_before:], i + 1, total_products)
+        
         # Pausa para no sobrecargar el servidor
-        time.sleep(0.5)
+        with crawl_metrics.timed('throttle'):
+            time.sleep(0.5)
     
     if status_text:
         status_text.text(f"Se procesaron {len(product_details)} detalles de productos")
@@ -464,30 +539,269 @@ def extract_product_details(product_list, max_products=None, status_text=None, p
 
 # Función para obtener la descripción del producto
 def get_product_description(soup):
-    description = ""
-    
-    # Intentar diferentes selectores para la descripción
-    desc_selectors = [
-        '.product-description', 
-        '.description', 
-        '.details', 
-        '.product-details',
-        '[itemprop="description"]',
-        '.info',
-        'p'  # A veces la descripción está en párrafos simples
-    ]
-    
-    for selector in desc_selectors:
-        desc_elements = soup.select(selector)
-        if desc_elements:
-            # Concatenar todos los elementos de descripción
-            description = ' '.join([elem.text.strip() for elem in desc_elements])
-            # Limpiar espacios en blanco múltiples
-            description = re.sub(r'\s+', ' ', description).strip()
-            if description:  # Si encontramos algo, terminamos
-                break
-    
-    return description
+    return extract_product_fields(soup)['description']
+
+# Intervalo (segundos) con el que la interfaz consulta el progreso del scraping en curso
+UI_REFRESH_INTERVAL = 0.5
+# Filas recientes que se muestran en la tabla en vivo
+LIVE_TABLE_ROWS = 50
+
+# Etapas de un scraping, con el título que se muestra para cada una
+CRAWL_STAGES = {
+    'login': "Iniciando sesión",
+    'categories': "Extrayendo categorías",
+    'products': "Extrayendo lista de productos",
+    'details': "Extrayendo detalles de productos",
+}
+
+# Gestor de los scrapings en segundo plano, común a todos los usuarios de la app
+@st.cache_resource
+def get_job_manager():
+    return JobManager()
+
+# Scraping completo en segundo plano. Se ejecuta con la sesión HTTP del usuario
+# que lo lanzó y deja el progreso y los resultados (también parciales) en el trabajo.
+def run_crawl(job, options):
+    global crawl_deadline, crawl_metrics
+    crawl_deadline = Deadline(options['max_minutes'] * 60 if options['max_minutes'] else None, EXPORT_RESERVE)
+    job.deadline = crawl_deadline
+    crawl_metrics = CrawlMetrics()
+    job.metrics = crawl_metrics
+    stages = job.stages
+    monitor = MemoryMonitor(trace=options['low_memory'])
+    job.results['memory'] = monitor.stages
+    
+    if options['use_login']:
+        if not login(options['username'], options['password'], stages['login'], stages['login']):
+            raise RuntimeError("No se pudo iniciar sesión. Por favor, verifica las credenciales.")
+    else:
+        stages['login'].text("Sin autenticación")
+        stages['login'].progress(100)
+    
+    with monitor.stage("categorías"):
+        categories = extract_categories(stages['categories'], stages['categories'])
+    job.results['categories'] = categories
+    if job.cancelled:
+        return
+    if not categories:
+        raise RuntimeError("No se pudieron extraer categorías. Verifica la conexión o la estructura del sitio.")
+    
+    with monitor.stage("lista de productos"):
+        product_list = extract_product_list(
+            categories,
+            options['categories'] or None,
+            stages['products'],
+            stages['products'],
+            options['max_products'],
+            options['sample_evenly'],
+            options['listing_only']
+        )
+    job.results['product_list'] = product_list
+    if job.cancelled:
+        return
+    if not product_list:
+        raise RuntimeError("No se pudieron extraer productos. Verifica la conexión o la estructura del sitio.")
+    
+    # En modo solo listado solo se descargan las fichas de los productos sin precio en el listado
+    listing_details, to_fetch = [], product_list
+    if options['listing_only']:
+        listing_details, to_fetch = split_listing_details(product_list)
+        job.add_rows(listing_details, 0, len(to_fetch))
+    
+    with monitor.stage("detalles"):
+        product_details = listing_details + extract_product_details(
+            to_fetch,
+            options['max_products'],
+            stages['details'],
+            stages['details'],
+            job.add_rows
+        )
+    if options['listing_only']:
+        stages['details'].text(f"Precios tomados del listado: {len(listing_details)}; "
+                               f"fichas descargadas: {len(to_fetch)}")
+    job.results['details'] = product_details
+    job.results['partial'] = crawl_deadline.expired
+    
+    # La ejecución se añade al histórico una sola vez, aunque la vean varios usuarios
+    if product_details:
+        store_results(categories, product_list, product_details, source="streamlit")
+        write_snapshot(product_details)
+
+# Nombre de cada tipo de tiempo en el panel de operación
+TIME_LABELS = {'network': "red", 'parse': "análisis del HTML", 'throttle': "pausas"}
+
+def _format_seconds(value):
+    return "n/d" if value is None else f"{value * 1000:.0f} ms"
+
+# Panel de operación: rendimiento del rastreo a partir de sus contadores
+def render_metrics(stats, placeholder):
+    with placeholder.container():
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Peticiones/s", f"{stats['requests_per_second']:.2f}")
+        col2.metric("KB/s", f"{stats['bytes_per_second'] / 1024:.1f}")
+        col3.metric("Latencia p50", _format_seconds(stats['latency_p50']))
+        col4.metric("Latencia p90 / p99", f"{_format_seconds(stats['latency_p90'])} / {_format_seconds(stats['latency_p99'])}")
+        
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Errores (conexión / servidor)", f"{stats['errors']} / {stats['server_errors']}")
+        col2.metric("Omitidas por caché negativa", f"{stats['negative_hits']} ({stats['negative_hit_ratio']:.0%})")
+        col3.metric("Fichas sin cambios (no analizadas)", f"{stats['memo_hits']} ({stats['memo_hit_ratio']:.0%})")
+        col4.metric("Pausas del circuito", stats['pauses'])
+        if stats.get('breaker_open'):
+            col5.metric("Circuito", f"Abierto ({stats['breaker_cooldown']:.0f} s)")
+        else:
+            col5.metric("Circuito", "Cerrado")
+        
+        # Reparto del tiempo: indica si el rastreo está limitado por la red, el análisis o las pausas
+        total_time = sum(stats['times'].values())
+        if total_time:
+            shares = ", ".join(
+                f"{TIME_LABELS[kind]} {seconds / total_time:.0%}" for kind, seconds in stats['times'].items()
+            )
+            st.caption(f"Tiempo: {shares} · limitado por {TIME_LABELS[stats['bound_by']]}")
+        
+        if stats['categories']:
+            st.dataframe(pd.DataFrame([
+                {'Categoría': category, 'Procesados': done, 'Total': total, '% completado': round(100 * done / total)}
+                for category, (done, total) in stats['categories'].items()
+            ]))
+
+# Muestra el progreso de un trabajo en los elementos ya creados en la página
+def render_job_progress(job, stage_widgets, live_stats, live_table, metrics_panel=None):
+    for name, (progress_bar, status_text) in stage_widgets.items():
+        stage = job.stages[name]
+        progress_bar.progress(min(max(int(stage.value), 0), 100))
+        if stage.message:
+            status_text.text(stage.message)
+    
+    rows, total_rows = job.latest_rows(LIVE_TABLE_ROWS)
+    if job.rows_started_at is not None:
+        elapsed = max(time.time() - job.rows_started_at, 1e-6)
+        rate = job.done / elapsed
+        remaining = (job.total - job.done) / rate if rate else 0
+        minutes, seconds = divmod(int(remaining), 60)
+        live_stats.markdown(
+            f"**{job.done}/{job.total}** productos · {total_rows} filas · "
+            f"{rate:.2f} productos/s · tiempo restante estimado {minutes:02d}:{seconds:02d}"
+        )
+    if rows:
+        live_table.dataframe(pd.DataFrame(rows))
+    
+    if metrics_panel is not None and job.metrics is not None:
+        render_metrics(job.metrics.snapshot(circuit_breaker), metrics_panel)
+
+# Progreso de un trabajo: etapas, filas en directo y panel de operación
+def show_job_progress(job):
+    stage_widgets = {}
+    for name, title in CRAWL_STAGES.items():
+        st.markdown(f"### {title}")
+        stage_widgets[name] = (st.progress(0), st.empty())
+    live_stats = st.empty()
+    live_table = st.empty()
+    with st.expander("Panel de operación", expanded=True):
+        metrics_panel = st.empty()
+    render_job_progress(job, stage_widgets, live_stats, live_table, metrics_panel)
+
+# Se vuelve a ejecutar cada UI_REFRESH_INTERVAL segundos sin bloquear el resto de la
+# página; cuando el trabajo termina, se recarga la página entera para mostrar los resultados
+@st.fragment(run_every=UI_REFRESH_INTERVAL)
+def job_progress_fragment(job_id):
+    job = get_job_manager().get(job_id)
+    if job is None or not job.running:
+        st.rerun()
+    show_job_progress(job)
+
+# Tamaños de página del explorador de resultados
+PAGE_SIZES = [25, 50, 100, 250]
+# Longitud máxima de la descripción en la tabla (el texto completo se carga a petición)
+DESCRIPTION_PREVIEW_CHARS = 120
+# Columnas en las que se busca el texto del filtro
+TEXT_SEARCH_COLUMNS = ['Product', 'Product Variant', 'Description', 'Ref', 'Category']
+
+# Función para filtrar resultados en el servidor
+def filter_results(df, categories=None, price_range=None, text=None, prices=None):
+    mask = pd.Series(True, index=df.index)
+    if categories:
+        mask &= df['Category'].isin(categories)
+    if price_range is not None and prices is not None:
+        mask &= prices.between(*price_range)
+    if text:
+        text_mask = pd.Series(False, index=df.index)
+        for column in TEXT_SEARCH_COLUMNS:
+            if column in df.columns:
+                text_mask |= df[column].astype(str).str.contains(text, case=False, regex=False, na=False)
+        mask &= text_mask
+    return df[mask]
+
+# Explorador de resultados: filtra y pagina en el servidor y solo envía la página visible
+def render_results_browser(df, key):
+    if df.empty:
+        st.info("Sin resultados")
+        return
+    
+    # Los precios numéricos se calculan una vez por tabla y se reutilizan en cada recarga
+    prices = None
+    if 'Price' in df.columns:
+        cached = st.session_state.get(f"{key}_prices")
+        if cached is None or cached[0] is not df:
+            cached = (df, price_values(df['Price']))
+            st.session_state[f"{key}_prices"] = cached
+        prices = cached[1]
+    
+    filter_col1, filter_col2, filter_col3 = st.columns(3)
+    selected_categories = []
+    if 'Category' in df.columns:
+        with filter_col1:
+            selected_categories = st.multiselect(
+                "Categoría", sorted(df['Category'].dropna().astype(str).unique()), key=f"{key}_category"
+            )
+    price_range = None
+    if prices is not None:
+        valid_prices = prices.dropna()
+        if len(valid_prices) and valid_prices.min() < valid_prices.max():
+            low, high = float(valid_prices.min()), float(valid_prices.max())
+            with filter_col2:
+                chosen = st.slider("Precio (€)", low, high, (low, high), key=f"{key}_price")
+            if tuple(chosen) != (low, high):
+                price_range = chosen
+    with filter_col3:
+        text = st.text_input("Buscar texto", key=f"{key}_text")
+    
+    filtered = filter_results(df, selected_categories, price_range, text, prices)
+    
+    option_col1, option_col2, option_col3 = st.columns([3, 1, 1])
+    with option_col1:
+        columns = st.multiselect("Columnas", list(df.columns), default=list(df.columns), key=f"{key}_columns")
+    with option_col2:
+        page_size = st.selectbox("Filas por página", PAGE_SIZES, key=f"{key}_page_size")
+    total_pages = max(1, -(-len(filtered) // page_size))
+    # Si los filtros reducen el número de páginas, volver a la primera
+    if st.session_state.get(f"{key}_page", 1) > total_pages:
+        st.session_state[f"{key}_page"] = 1
+    with option_col3:
+        page = st.number_input("Página", min_value=1, max_value=total_pages, key=f"{key}_page")
+    
+    page_df = filtered.iloc[(page - 1) * page_size:page * page_size][columns or list(df.columns)]
+    if 'Description' in page_df.columns:
+        descriptions = page_df['Description'].astype(str)
+        long_text = descriptions.str.len() > DESCRIPTION_PREVIEW_CHARS
+        page_df = page_df.assign(Description=descriptions.where(
+            ~long_text, descriptions.str.slice(0, DESCRIPTION_PREVIEW_CHARS) + '…'
+        ))
+    
+    st.caption(f"{len(filtered)} de {len(df)} filas · página {page} de {total_pages}")
+    st.dataframe(page_df)
+    
+    # Descripción completa a petición
+    if 'Description' in df.columns and len(page_df):
+        with st.expander("Ver descripción completa"):
+            row = st.selectbox(
+                "Producto",
+                list(page_df.index),
+                format_func=lambda i: f"{df.at[i, 'Ref'] if 'Ref' in df.columns else i} - {df.at[i, 'Product'] if 'Product' in df.columns else ''}",
+                key=f"{key}_description_row"
+            )
+            st.write(df.at[row, 'Description'])
 
 # Interfaz de usuario con Streamlit
 st.sidebar.markdown('<h2 class="sub-header">Configuración</h2>', unsafe_allow_html=True)
@@ -511,9 +825,61 @@ max_products = st.sidebar.number_input(
     help="Limitar el número de productos para análisis detallado puede acelerar el proceso"
 )
 
+# Tiempo máximo del scraping; al agotarse se muestran los resultados parciales
+max_minutes = st.sidebar.number_input(
+    "Tiempo máximo en minutos (0 = sin límite)",
+    min_value=0,
+    value=0,
+    help="Al agotarse el tiempo se dejan de descargar páginas y se guardan los resultados obtenidos"
+)
+
+# Exportación anterior con la que comparar (por defecto, la última ejecución de esta sesión)
+previous_export = st.sidebar.file_uploader(
+    "Exportación anterior para comparar (opcional)",
+    type=["xlsx"],
+    help="Si no se indica, se compara con la última ejecución realizada en esta sesión"
+)
+
+# Opción para repartir los productos analizados entre las categorías
+sample_evenly = st.sidebar.checkbox(
+    "Repartir el máximo de productos entre categorías",
+    value=False,
+    help="Toma el mismo número de productos de cada categoría en lugar de los primeros encontrados"
+)
+
+# Modo de bajo consumo de memoria (lo consultan las funciones de extracción)
+low_memory = st.sidebar.checkbox(
+    "Modo de bajo consumo de memoria",
+    value=False,
+    help="Libera cada página descargada en cuanto se extraen sus datos y mide la memoria de cada etapa"
+)
+
+# Modo solo listado para seguir precios sin descargar cada ficha
+listing_only = st.sidebar.checkbox(
+    "Solo listado (precios de las páginas de categoría)",
+    value=False,
+    help="Toma el precio y la disponibilidad de los listados y solo descarga las fichas de los productos sin precio"
+)
+
+# Categorías a extraer; se eligen entre las encontradas en la ejecución anterior
+known_categories = []
+if 'results' in st.session_state and 'Category' in st.session_state['results']['categories']:
+    known_categories = st.session_state['results']['categories']['Category'].tolist()
+selected_categories = st.sidebar.multiselect(
+    "Categorías a extraer (vacío = todas)",
+    known_categories,
+    help="Las categorías disponibles son las de la última ejecución"
+)
+
 # Botón para iniciar el scraping
 start_scraping = st.sidebar.button("Iniciar Scraping", type="primary")
 
+# Identificador de este usuario (sesión del navegador) en los trabajos compartidos
+if 'user_id' not in st.session_state:
+    st.session_state['user_id'] = uuid.uuid4().hex
+user_id = st.session_state['user_id']
+job_manager = get_job_manager()
+
 # Contenedor principal
 main_container = st.container()
 
@@ -534,121 +900,187 @@ with main_container:
     """)
     st.markdown('</div>', unsafe_allow_html=True)
 
-# Ejecutar el scraping cuando se presiona el botón
+# Búsqueda de texto en todos los productos del histórico (índice FTS5 de luluka_store.db).
+# Va antes del seguimiento del scraping para poder buscar mientras se ejecuta.
+with main_container:
+    search_text = st.text_input(
+        "Buscar en el catálogo",
+        key="catalog_search",
+        help="Busca en nombres, variantes y descripciones de todas las ejecuciones; admite prefijos y no distingue acentos"
+    )
+    if search_text:
+        search_started = time.time()
+        store = ResultStore()
+        try:
+            matches = store.search(search_text)
+        finally:
+            store.close()
+        st.caption(f"{len(matches)} resultados en {(time.time() - search_started) * 1000:.0f} ms")
+        if matches:
+            st.dataframe(pd.DataFrame(matches).rename(columns={
+                'ref': 'Ref', 'category': 'Category', 'product': 'Product',
+                'variant': 'Product Variant', 'snippet': 'Description', 'link': 'Link'
+            }))
+
+# Lanzar el scraping en segundo plano, o unirse al que ya tenga las mismas opciones
 if start_scraping:
+    options = {
+        'use_login': use_login,
+        'username': username if use_login else None,
+        'password': password if use_login else None,
+        'max_products': None if max_products == 0 else max_products,
+        'max_minutes': max_minutes,
+        'sample_evenly': sample_evenly,
+        'low_memory': low_memory,
+        'listing_only': listing_only,
+        'categories': sorted(selected_categories),
+    }
+    # La contraseña solo entra en la clave como hash
+    key_options = dict(options, password=hashlib.sha256((options['password'] or '').encode()).hexdigest())
+    job_key = json.dumps(key_options, sort_keys=True)
+    job = job_manager.submit(job_key, lambda job: run_crawl(job, options), list(CRAWL_STAGES), user_id)
+    previous_job_id = st.session_state.get('job_id')
+    if previous_job_id and previous_job_id != job.id:
+        job_manager.leave(previous_job_id, user_id)
+    st.session_state['job_id'] = job.id
+
+# Seguir el scraping en curso de este usuario
+job_id = st.session_state.get('job_id')
+job = job_manager.get(job_id) if job_id else None
+if job_id and job is None:
+    # El trabajo ya caducó
+    del st.session_state['job_id']
+
+if job is not None:
     with main_container:
-        # Crear contenedores para mostrar el progreso
-        progress_container = st.container()
-        results_container = st.container()
+        st.markdown('<h2 class="sub-header">Progreso del Scraping</h2>', unsafe_allow_html=True)
         
-        with progress_container:
-            st.markdown('<h2 class="sub-header">Progreso del Scraping</h2>', unsafe_allow_html=True)
+        others = len(job.subscribers - {user_id})
+        if others:
+            st.caption(f"Scraping compartido con {others} usuario(s) más")
+        
+        # Cancelar solo detiene el scraping si nadie más lo está siguiendo
+        if job.running and st.button("Cancelar scraping"):
+            job_manager.leave(job.id, user_id)
+            del st.session_state['job_id']
+            st.info("Has dejado el scraping; si nadie más lo seguía, se ha cancelado")
+            st.stop()
+        
+        # Mientras se ejecuta, solo el fragmento del progreso se actualiza periódicamente:
+        # el resto de la página (filtros, resultados, botones) sigue respondiendo
+        if job.running:
+            job_progress_fragment(job.id)
+        else:
+            show_job_progress(job)
             
-            # Iniciar sesión si es necesario
-            if use_login:
-                st.markdown("### Iniciando sesión")
-                login_progress = st.progress(0)
-                login_status = st.empty()
+            job_manager.leave(job.id, user_id)
+            del st.session_state['job_id']
+            product_details = job.results.get('details')
+            
+            if job.status == 'error':
+                st.error(job.error)
+            elif not product_details:
+                if job.status == 'cancelled':
+                    st.warning("Scraping cancelado antes de obtener detalles de productos")
+                else:
+                    st.error("No se pudieron extraer detalles de productos. Verifica la conexión o la estructura del sitio.")
+            else:
+                # Memoria usada en cada etapa
+                with st.expander("Uso de memoria por etapa"):
+                    df_memory = pd.DataFrame(job.results['memory'])
+                    for column in ['rss', 'peak_rss', 'traced', 'traced_peak']:
+                        df_memory[column] = df_memory[column] / (1024 * 1024)
+                    st.dataframe(df_memory.rename(columns={
+                        'stage': 'Etapa', 'seconds': 'Segundos', 'rss': 'RSS (MB)', 'peak_rss': 'Pico RSS (MB)',
+                        'traced': 'Python (MB)', 'traced_peak': 'Pico Python (MB)'
+                    }).round(1))
                 
-                login_success = login(username, password, login_progress, login_status)
+                # Guardar resultados en la sesión para poder explorarlos entre recargas
+                categories = job.results['categories']
+                product_list = job.results['product_list']
+                df_details = pd.DataFrame(product_details)
                 
-                if not login_success:
-                    st.error("No se pudo iniciar sesión. Por favor, verifica las credenciales.")
-                    st.stop()
+                # Comparar con la ejecución anterior de este usuario
+                if previous_export is not None:
+                    previous_details = pd.read_excel(previous_export, sheet_name='Products', dtype=str, keep_default_na=False)
                 else:
-                    st.success("Inicio de sesión exitoso")
-            
-            # Extraer categorías
-            st.markdown("### Extrayendo categorías")
-            categories_progress = st.progress(0)
-            categories_status = st.empty()
-            
-            categories = extract_categories(categories_status, categories_progress)
-            
-            if not categories:
-                st.error("No se pudieron extraer categorías. Verifica la conexión o la estructura del sitio.")
-                st.stop()
-            
-            # Mostrar categorías y permitir selección
-            st.markdown("### Categorías encontradas")
-            df_categories = pd.DataFrame(categories)
-            st.dataframe(df_categories)
-            
-            # Permitir seleccionar categorías específicas
-            category_names = df_categories['Category'].tolist()
-            selected_categories = st.multiselect(
-                "Selecciona categorías para extraer (deja vacío para todas)",
-                category_names
-            )
-            
-            # Extraer lista de productos
-            st.markdown("### Extrayendo lista de productos")
-            products_progress = st.progress(0)
-            products_status = st.empty()
-            
-            product_list = extract_product_list(
-                categories, 
-                selected_categories if selected_categories else None,
-                products_status,
-                products_progress
-            )
-            
-            if not product_list:
-                st.error("No se pudieron extraer productos. Verifica la conexión o la estructura del sitio.")
-                st.stop()
-            
-            # Mostrar lista de productos
-            st.markdown("### Productos encontrados")
-            df_product_list = pd.DataFrame(product_list)
-            st.dataframe(df_product_list)
-            
-            # Extraer detalles de productos
-            st.markdown("### Extrayendo detalles de productos")
-            details_progress = st.progress(0)
-            details_status = st.empty()
-            
-            max_products_to_analyze = None if max_products == 0 else max_products
-            product_details = extract_product_details(
-                product_list,
-                max_products_to_analyze,
-                details_status,
-                details_progress
-            )
-            
-            if not product_details:
-                st.error("No se pudieron extraer detalles de productos. Verifica la conexión o la estructura del sitio.")
-                st.stop()
+                    previous_details = st.session_state.get('previous_details')
+                # Los productos sin ficha descargada en esta ejecución conservan sus filas anteriores
+                # (con límite de productos los listados se cortan: ninguna categoría se lista entera)
+                changes = None
+                df_export = df_details
+                if previous_details is not None:
+                    df_export = carry_forward(previous_details, df_details, product_list,
+                                              listed_categories=() if max_products else None)
+                    changes = compare_runs(previous_details, df_export)
+                st.session_state['previous_details'] = df_export
+                
+                # El Excel se genera una sola vez, no en cada recarga de la página
+                st.session_state['results'] = {
+                    'categories': pd.DataFrame(categories),
+                    'product_list': pd.DataFrame(product_list),
+                    'details': df_details,
+                    'changes': changes,
+                    'excel_link': get_excel_download_link(
+                        pd.DataFrame(categories),
+                        pd.DataFrame(product_list),
+                        df_export,
+                        "Luluka_Scraping_Result.xlsx",
+                        changes
+                    ),
+                }
+                
+                # Mostrar mensaje de éxito
+                if job.status == 'cancelled':
+                    st.warning("Scraping cancelado: se muestran los resultados obtenidos hasta entonces")
+                elif job.results.get('partial'):
+                    st.warning("Se agotó el tiempo máximo: los resultados son parciales")
+                else:
+                    st.success("¡Scraping completado con éxito!")
+
+# Mostrar los resultados de la última ejecución (se conservan al usar los filtros)
+if 'results' in st.session_state:
+    results = st.session_state['results']
+    with main_container:
+        st.markdown('<h2 class="sub-header">Resultados del Scraping</h2>', unsafe_allow_html=True)
         
-        # Mostrar resultados
-        with results_container:
-            st.markdown('<h2 class="sub-header">Resultados del Scraping</h2>', unsafe_allow_html=True)
-            
-            # Convertir a DataFrame
-            df_details = pd.DataFrame(product_details)
-            
-            # Mostrar estadísticas
+        # Mostrar estadísticas
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Categorías", len(results['categories']))
+        with col2:
+            st.metric("Productos", len(results['product_list']))
+        with col3:
+            st.metric("Detalles de productos", len(results['details']))
+        
+        # Explorar resultados con filtros y paginación en el servidor
+        tab_details, tab_products, tab_categories = st.tabs(["Detalles de productos", "Productos", "Categorías"])
+        with tab_details:
+            render_results_browser(results['details'], "details")
+        with tab_products:
+            render_results_browser(results['product_list'], "products")
+        with tab_categories:
+            render_results_browser(results['categories'], "categories")
+        
+        # Resumen de cambios respecto a la ejecución anterior
+        changes = results['changes']
+        if changes is not None:
+            st.markdown("### Cambios respecto a la ejecución anterior")
+            summary = summarize_changes(changes)
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Categorías", len(categories))
+                st.metric("Añadidos", summary['added'])
             with col2:
-                st.metric("Productos", len(product_list))
+                st.metric("Eliminados", summary['removed'])
             with col3:
-                st.metric("Detalles de productos", len(product_details))
-            
-            # Mostrar detalles de productos
-            st.markdown("### Detalles de productos")
-            st.dataframe(df_details)
-            
-            # Generar enlace de descarga
-            st.markdown("### Exportar resultados")
-            st.markdown('<div class="success-text">', unsafe_allow_html=True)
-            st.markdown(get_excel_download_link(
-                pd.DataFrame(categories),
-                pd.DataFrame(product_list),
-                df_details,
-                "Luluka_Scraping_Result.xlsx"
-            ), unsafe_allow_html=True)
-            st.markdown('</div>', unsafe_allow_html=True)
-            
-            # Mostrar mensaje de éxito
-            st.success("¡Scraping completado con éxito!")
\ No newline at end of file
+                st.metric("Modificados", summary['changed'])
+            for kind, label in (('changed', "Modificados"), ('added', "Añadidos"), ('removed', "Eliminados")):
+                if summary[kind]:
+                    with st.expander(f"{label} ({summary[kind]})"):
+                        render_results_browser(changes[kind], f"changes_{kind}")
+        
+        # Enlace de descarga
+        st.markdown("### Exportar resultados")
+        st.markdown('<div class="success-text">', unsafe_allow_html=True)
+        st.markdown(results['excel_link'], unsafe_allow_html=True)
+        st.markdown('</div>', unsafe_allow_html=True)
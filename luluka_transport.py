@@ -0,0 +1,261 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from luluka_extractor import SITEMAP_PRODUCT_RE
+from luluka_frontier import canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+# Base de datos de las URLs que el sitio da por inexistentes
+NEGATIVE_CACHE_DB = "luluka_negative.db"
+
+# Tiempo (segundos) durante el que no se vuelve a pedir una URL que dio 404/410
+NEGATIVE_TTL = 7 * 24 * 3600
+
+# Códigos que indican que la página ya no existe
+GONE_STATUSES = (404, 410)
+
+# Timeouts por petición (segundos): conexión y lectura
+REQUEST_TIMEOUT = (5, 20)
+
+# Fallos seguidos que abren el circuito y pausa inicial y máxima (segundos)
+FAILURE_THRESHOLD = 5
+COOLDOWN = 30
+MAX_COOLDOWN = 600
+
+# Tiempo (segundos) tras el que una petición de prueba sin resultado deja paso a otra
+PROBE_TIMEOUT = 60
+
+
+def _is_server_failure(status):
+    """Respuestas que indican un problema del servidor y no de la página pedida"""
+    return status == 429 or status >= 500
+
+
+class DeadlineExceeded(Exception):
+    """Se agotó el tiempo total del rastreo"""
+
+
+class Deadline:
+    """Tiempo límite de un rastreo.
+
+    `reserve` segundos del total se guardan para exportar los resultados, de
+    modo que el rastreo se da por terminado antes. Sin `seconds` no hay límite.
+    """
+
+    def __init__(self, seconds=None, reserve=0):
+        self.seconds = seconds
+        self.expires_at = None if seconds is None else time.time() + max(0, seconds - reserve)
+        self.cancelled = False
+
+    def cancel(self):
+        """Da el tiempo por agotado ya (cancelación): el rastreo termina con lo obtenido"""
+        self.cancelled = True
+        self.expires_at = time.time()
+
+    def remaining(self):
+        """Segundos restantes (None si no hay límite)"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    def timeout(self, timeout=REQUEST_TIMEOUT):
+        """Timeout de una petición, recortado para no pasarse del límite"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("Se agotó el tiempo del rastreo")
+        connect, read = timeout
+        return min(connect, remaining), min(read, remaining)
+
+
+class CircuitBreaker:
+    """Corta las peticiones cuando el sitio falla de forma continuada.
+
+    Tras `failure_threshold` fallos seguidos (errores de conexión, timeouts,
+    5xx o 429) el circuito se abre y la siguiente petición espera `cooldown`
+    segundos en lugar de gastar un timeout tras otro. Pasada la pausa se deja
+    pasar una sola petición de prueba (`half_open`) mientras las demás siguen
+    esperando: si falla, la pausa se duplica (hasta `max_cooldown`); si
+    funciona, el circuito se cierra. Una prueba que no registra resultado en
+    `probe_timeout` segundos deja paso a otra.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, max_cooldown=MAX_COOLDOWN,
+                 probe_timeout=PROBE_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = None
+        self.half_open = False
+        self.probe_started = None
+        self._lock = threading.Lock()
+        # Avisa a las peticiones en espera cuando la prueba registra su resultado
+        self._probe_done = threading.Condition(self._lock)
+
+    @property
+    def is_open(self):
+        return self.open_until is not None
+
+    def before_request(self, on_pause=logger.warning, deadline=None):
+        """Espera a que termine la pausa si el circuito está abierto; devuelve los segundos esperados"""
+        start = time.time()
+        waited = False
+        with self._lock:
+            while self.open_until is not None:
+                now = time.time()
+                if self.half_open and now - self.probe_started >= self.probe_timeout:
+                    self.half_open = False
+                if deadline is not None and deadline.expired:
+                    raise DeadlineExceeded("Se agotó el tiempo del rastreo")
+                if not self.half_open:
+                    wait = self.open_until - now
+                    if wait <= 0:
+                        # Esta petición es la prueba: las demás esperan su resultado
+                        self.half_open = True
+                        self.probe_started = now
+                        break
+                    if deadline is not None and deadline.remaining() is not None and deadline.remaining() < wait:
+                        raise DeadlineExceeded("El sitio sigue fallando y no queda tiempo para esperar")
+                    message = f"Demasiados fallos seguidos: pausa de {wait:.0f} s antes de reintentar"
+                else:
+                    wait = self.probe_started + self.probe_timeout - now
+                    if deadline is not None and deadline.remaining() is not None:
+                        wait = min(wait, deadline.remaining())
+                    message = "Demasiados fallos seguidos: esperando el resultado de la petición de prueba"
+                if on_pause and not waited:
+                    on_pause(message)
+                waited = True
+                self._probe_done.wait(wait)
+        return time.time() - start if waited else 0
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_until = None
+            self.half_open = False
+            self.cooldown = self.base_cooldown
+            self._probe_done.notify_all()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.open_until is not None:
+                # Falló la petición de prueba: pausa más larga
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.open_until = time.time() + self.cooldown
+                self.half_open = False
+                self._probe_done.notify_all()
+            elif self.failures >= self.failure_threshold:
+                self.open_until = time.time() + self.cooldown
+
+
+class NegativeCache:
+    """URLs que respondieron 404/410, guardadas en SQLite con caducidad.
+
+    Mientras no caduca la entrada, la URL se da por inexistente sin hacer la
+    petición. La conexión se abre en el primer uso y se reabre en procesos
+    hijos, que no pueden compartir la del padre.
+    """
+
+    def __init__(self, path=NEGATIVE_CACHE_DB, ttl=NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS dead_urls (key TEXT PRIMARY KEY, status INTEGER, checked_at REAL)'
+            )
+            # Las entradas caducadas ya no sirven: se eliminan al abrir
+            self._conn.execute('DELETE FROM dead_urls WHERE checked_at < ?', (time.time() - self.ttl,))
+            self._conn.commit()
+            self._pid = os.getpid()
+        return self._conn
+
+    def is_dead(self, url):
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT checked_at FROM dead_urls WHERE key = ?', (canonicalize_url(url),)
+            ).fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def mark_dead(self, url, status):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO dead_urls (key, status, checked_at) VALUES (?, ?, ?)',
+                (canonicalize_url(url), status, time.time())
+            )
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+def is_product_url(url):
+    """Indica si la URL es la ficha de un producto (fitxaProducte.aspx?idproducte=...)"""
+    return SITEMAP_PRODUCT_RE.search(url) is not None
+
+
+def guarded_get(http, url, headers, breaker=None, negative_cache=None, on_pause=logger.warning,
+                deadline=None, timeout=REQUEST_TIMEOUT, metrics=None):
+    """GET protegido por el circuito, la caché negativa y el tiempo límite.
+
+    Devuelve la respuesta, o None si la URL está (o acaba de quedar) marcada
+    como inexistente. La caché negativa solo se aplica a las fichas de
+    producto: un 404 pasajero en la portada o en un listado se propaga como
+    error. Si se agotó el tiempo lanza DeadlineExceeded; los demás errores se
+    propagan como con requests. Con `metrics` (CrawlMetrics) se registran la
+    petición, su latencia y tamaño y las pausas del circuito.
+    """
+    if negative_cache is not None and not is_product_url(url):
+        negative_cache = None
+    if negative_cache is not None and negative_cache.is_dead(url):
+        if metrics is not None:
+            metrics.record_negative_hit()
+        return None
+    if breaker is not None:
+        paused = breaker.before_request(on_pause, deadline)
+        if paused and metrics is not None:
+            metrics.record_pause(paused)
+    if deadline is not None:
+        timeout = deadline.timeout(timeout)
+    start = time.time()
+    try:
+        response = http.get(url, headers=headers, timeout=timeout)
+    except Exception:
+        if breaker is not None:
+            breaker.record_failure()
+        if metrics is not None:
+            metrics.record_request(time.time() - start, error=True)
+        raise
+    if metrics is not None:
+        metrics.record_request(time.time() - start, len(response.content), response.status_code)
+    if breaker is not None:
+        if _is_server_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    if response.status_code in GONE_STATUSES and negative_cache is not None:
+        negative_cache.mark_dead(url, response.status_code)
+        return None
+    response.raise_for_status()
+    return response
@@ -0,0 +1,322 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+from luluka_frontier import canonicalize_url
+from luluka_logging import LOG_LEVEL, setup_logging, shutdown_logging
+
+# Cola de trabajo compartida por el coordinador y los procesos trabajadores
+QUEUE_DB = "luluka_queue.db"
+
+# Segundos que un trabajador tiene reservada una tarea; si muere, otro la recoge al caducar
+LEASE_SECONDS = 120
+
+# Intentos de una tarea antes de darla por fallida
+MAX_ATTEMPTS = 3
+
+# Intervalo mínimo (segundos) entre dos peticiones de cualquier trabajador
+MIN_REQUEST_INTERVAL = 0.25
+
+# Espera de un trabajador sin tareas disponibles mientras otros siguen trabajando
+POLL_INTERVAL = 0.5
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, kind, id);
+CREATE TABLE IF NOT EXISTS rate_limit (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    next_slot REAL NOT NULL
+);
+INSERT OR IGNORE INTO rate_limit (id, next_slot) VALUES (1, 0);
+'''
+
+
+class WorkQueue:
+    """Cola de tareas duradera en SQLite con reservas (leases) por trabajador.
+
+    Cada tarea es una categoría o una ficha de producto identificada por su URL
+    canónica, de modo que no se encola dos veces. Un trabajador reserva una
+    tarea durante `lease_seconds`; si muere sin completarla, la reserva caduca
+    y la tarea vuelve a estar disponible para los demás.
+    """
+
+    def __init__(self, path=QUEUE_DB, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # Autocommit: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def reset(self):
+        """Vacía la cola para empezar un rastreo nuevo"""
+        self.conn.execute('DELETE FROM tasks')
+        self.conn.execute('UPDATE rate_limit SET next_slot = 0')
+
+    def add(self, kind, items):
+        """Encola categorías o productos (los ya encolados se ignoran); devuelve cuántos son nuevos"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            added = 0
+            for item in items:
+                cursor = self.conn.execute(
+                    'INSERT OR IGNORE INTO tasks (kind, key, payload) VALUES (?, ?, ?)',
+                    (kind, canonicalize_url(item['Link']), json.dumps(item, ensure_ascii=False))
+                )
+                added += cursor.rowcount
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def claim(self, worker_id, now=None):
+        """Reserva la siguiente tarea disponible: (id, kind, item) o None.
+
+        Las categorías van antes que los productos para que la cola se llene
+        cuanto antes; las reservas caducadas se tratan como pendientes.
+        """
+        now = now or time.time()
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.conn.execute(
+                "SELECT id, kind, payload FROM tasks "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?) "
+                "ORDER BY kind = 'product', id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE tasks SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (worker_id, now + self.lease_seconds, row[0])
+                )
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def complete(self, task_id, worker_id, result):
+        """Guarda el resultado; se descarta si la reserva ya pasó a otro trabajador"""
+        cursor = self.conn.execute(
+            "UPDATE tasks SET status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL "
+            "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+            (json.dumps(result, ensure_ascii=False), task_id, worker_id)
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id, worker_id, error):
+        """Devuelve la tarea a la cola o la marca como fallida si agotó sus intentos"""
+        self.conn.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_owner = NULL, lease_expires = NULL "
+            "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+            (self.max_attempts, str(error), task_id, worker_id)
+        )
+
+    def counts(self):
+        """Número de tareas por estado"""
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status'))
+
+    def unfinished(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased')"
+        ).fetchone()[0]
+
+    def results(self, kind):
+        """(elemento, resultado) de las tareas completadas de un tipo, en orden de llegada"""
+        rows = self.conn.execute(
+            "SELECT payload, result FROM tasks WHERE kind = ? AND status = 'done' ORDER BY id", (kind,)
+        )
+        return [(json.loads(payload), json.loads(result)) for payload, result in rows]
+
+    def items(self, kind):
+        rows = self.conn.execute('SELECT payload FROM tasks WHERE kind = ? ORDER BY id', (kind,))
+        return [json.loads(payload) for (payload,) in rows]
+
+    def wait_for_slot(self, min_interval=MIN_REQUEST_INTERVAL):
+        """Reserva un turno en el límite de peticiones común a todos los procesos y espera a que llegue"""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            slot = max(self.conn.execute('SELECT next_slot FROM rate_limit WHERE id = 1').fetchone()[0], now)
+            self.conn.execute('UPDATE rate_limit SET next_slot = ? WHERE id = 1', (slot + min_interval,))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def load_scraper(use_login):
+    return importlib.import_module('luluka_scraper_login' if use_login else 'luluka_scraper')
+
+
+def worker_main(queue_path, worker_id, use_login=False, lease_seconds=LEASE_SECONDS,
+                min_interval=MIN_REQUEST_INTERVAL, log_level=LOG_LEVEL):
+    """Bucle de un proceso trabajador: reserva tareas, las extrae y guarda el resultado"""
+    # El hilo de escritura de eventos no pasa a los procesos hijos: cada uno lanza el suyo
+    setup_logging(log_level)
+    scraper = load_scraper(use_login)
+    if use_login and not scraper.login():
+        print(f"[{worker_id}] No se pudo iniciar sesión. Se continúa sin autenticación.")
+    work_queue = WorkQueue(queue_path, lease_seconds)
+
+    # Todas las descargas del trabajador pasan por el límite de peticiones común,
+    # que sustituye a la pausa fija de los scripts tras cada página
+    scraper.REQUEST_PAUSE = 0
+    fetch = scraper.fetch_html
+
+    def rate_limited_fetch_html(url):
+        work_queue.wait_for_slot(min_interval)
+        return fetch(url)
+
+    scraper.fetch_html = rate_limited_fetch_html
+
+    try:
+        while True:
+            task = work_queue.claim(worker_id)
+            if task is None:
+                # Otros trabajadores aún pueden encolar productos desde sus categorías
+                if work_queue.unfinished() == 0:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            task_id, kind, item = task
+            try:
+                if kind == 'category':
+                    products = scraper.extract_product_list([item])
+                    work_queue.add('product', products)
+                    result = len(products)
+                else:
+                    result = scraper.extract_product_details([item])
+                    # Una ficha que ya no existe (404/410) no es un fallo: se completa sin filas.
+                    # Si no se pudo descargar por otro motivo, se reintenta más tarde
+                    if not result and not scraper.dead_urls.is_dead(item['Link']):
+                        raise RuntimeError("Sin datos de la ficha")
+            except Exception as e:
+                print(f"[{worker_id}] Error en {item['Link']}: {e}")
+                work_queue.fail(task_id, worker_id, e)
+                continue
+            work_queue.complete(task_id, worker_id, result)
+    finally:
+        work_queue.close()
+        # Los procesos hijos no ejecutan atexit: se vacía la cola de eventos aquí
+        shutdown_logging()
+
+
+def _start_worker(queue_path, worker_id, use_login, lease_seconds, min_interval, log_level=LOG_LEVEL):
+    process = multiprocessing.Process(
+        target=worker_main,
+        args=(queue_path, worker_id, use_login, lease_seconds, min_interval, log_level),
+        name=worker_id,
+        daemon=True
+    )
+    process.start()
+    return process
+
+
+def run_sharded(workers=4, use_login=False, queue_path=QUEUE_DB, resume=False,
+                lease_seconds=LEASE_SECONDS, min_interval=MIN_REQUEST_INTERVAL, max_restarts=None,
+                log_level=LOG_LEVEL):
+    """Rastrea el sitio con `workers` procesos y devuelve (categorías, productos, detalles).
+
+    El coordinador extrae las categorías, las encola y lanza los trabajadores.
+    Si un trabajador muere, sus tareas vuelven a la cola al caducar la reserva
+    y se lanza otro en su lugar. Con `resume` se continúa una cola anterior.
+    """
+    work_queue = WorkQueue(queue_path, lease_seconds)
+    try:
+        if not resume:
+            work_queue.reset()
+        if work_queue.unfinished() == 0 and not work_queue.items('category'):
+            scraper = load_scraper(use_login)
+            if use_login and not scraper.login():
+                print("No se pudo iniciar sesión. Se continúa sin autenticación.")
+            categories = scraper.extract_categories()
+            work_queue.add('category', categories)
+            print(f"Se encolaron {len(categories)} categorías")
+
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        max_restarts = workers * MAX_ATTEMPTS if max_restarts is None else max_restarts
+        processes = [_start_worker(queue_path, f"{prefix}-w{i}", use_login, lease_seconds, min_interval, log_level)
+                     for i in range(workers)]
+        restarts = 0
+        last_report = 0
+        while any(process.is_alive() for process in processes):
+            time.sleep(POLL_INTERVAL)
+            for i, process in enumerate(processes):
+                # Reemplazar trabajadores caídos mientras quede trabajo
+                if not process.is_alive() and process.exitcode != 0 and restarts < max_restarts \
+                        and work_queue.unfinished():
+                    restarts += 1
+                    print(f"El trabajador {process.name} terminó con código {process.exitcode}; se lanza otro")
+                    processes[i] = _start_worker(queue_path, f"{prefix}-w{i}r{restarts}", use_login,
+                                                 lease_seconds, min_interval, log_level)
+            if time.time() - last_report >= 5:
+                last_report = time.time()
+                print(f"Estado de la cola: {work_queue.counts()}")
+        for process in processes:
+            process.join()
+
+        counts = work_queue.counts()
+        print(f"Estado final de la cola: {counts}")
+        if work_queue.unfinished():
+            print("Quedan tareas sin terminar; se pueden completar con --resume")
+
+        categories = work_queue.items('category')
+        product_list = work_queue.items('product')
+        product_details = [row for _, rows in work_queue.results('product') for row in rows]
+    finally:
+        work_queue.close()
+    return categories, product_list, product_details
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rastreo de Lulukabaraka.com con varios procesos")
+    parser.add_argument('--workers', type=int, default=4, help="Número de procesos trabajadores")
+    parser.add_argument('--login', action='store_true', help="Usar la versión con inicio de sesión")
+    parser.add_argument('--queue', default=QUEUE_DB, help="Fichero SQLite de la cola de trabajo")
+    parser.add_argument('--resume', action='store_true', help="Continuar la cola de una ejecución anterior")
+    parser.add_argument('--lease', type=int, default=LEASE_SECONDS, help="Segundos de reserva de cada tarea")
+    parser.add_argument('--interval', type=float, default=MIN_REQUEST_INTERVAL,
+                        help="Segundos mínimos entre peticiones (entre todos los procesos)")
+    parser.add_argument('--log-level', default=LOG_LEVEL,
+                        help="Nivel de los eventos JSON (DEBUG muestra todos los eventos por página)")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    categories, product_list, product_details = run_sharded(
+        args.workers, args.login, args.queue, args.resume, args.lease, args.interval, log_level=args.log_level
+    )
+    print(f"Se procesaron {len(product_details)} detalles de {len(product_list)} productos")
+    if product_details:
+        load_scraper(args.login).export_results(categories, product_list, product_details)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import unittest
+from luluka_diff import carry_forward, compare_runs, summarize_changes
+from luluka_extractor import LISTING_VARIANT
+
+LINK = "https://www.lulukabaraka.com/fitxaProducte.aspx?idproducte={}"
+
+
+def detail(ref, category="Inst. Agua", price="10,00€"):
+    return {
+        'Category': category,
+        'Ref': str(ref),
+        'Product': f"Producto {ref}",
+        'Type': "",
+        'Product Variant': f"Producto {ref}",
+        'Variant': "",
+        'Price': price,
+        'Availability': "En stock",
+        'Description': "",
+        'Link': LINK.format(ref),
+    }
+
+
+def listed(ref, category="Inst. Agua"):
+    return {'Category': category, 'Product': f"Producto {ref}", 'Link': LINK.format(ref)}
+
+
+class PartialRunTest(unittest.TestCase):
+    """Una ejecución que no descarga todas las fichas no debe inventar altas ni bajas"""
+
+    def setUp(self):
+        self.full_run = [detail(ref) for ref in range(14)]
+        self.product_list = [listed(ref) for ref in range(14)]
+
+    def test_unfetched_products_are_not_removed(self):
+        # Presupuesto de 5 fichas: el resto de productos sigue en el listado
+        partial = [detail(ref) for ref in range(5)]
+        exported = carry_forward(self.full_run, partial, self.product_list)
+        summary = summarize_changes(compare_runs(self.full_run, exported))
+        self.assertEqual(summary, {'added': 0, 'removed': 0, 'changed': 0})
+        self.assertEqual(len(exported), 14)
+
+    def test_next_run_does_not_report_additions(self):
+        partial = [detail(ref) for ref in range(5)]
+        exported = carry_forward(self.full_run, partial, self.product_list)
+        next_run = [detail(ref) for ref in range(5, 14)]
+        next_exported = carry_forward(exported, next_run, self.product_list)
+        summary = summarize_changes(compare_runs(exported, next_exported))
+        self.assertEqual(summary, {'added': 0, 'removed': 0, 'changed': 0})
+
+    def test_changes_in_fetched_products_are_reported(self):
+        partial = [detail(0, price="12,00€")] + [detail(ref) for ref in range(1, 5)]
+        exported = carry_forward(self.full_run, partial, self.product_list)
+        changes = compare_runs(self.full_run, exported)
+        self.assertEqual(list(changes['changed']['Ref']), ['0'])
+        self.assertEqual(changes['changed']['Price Change'].iloc[0], 2.0)
+
+    def test_product_missing_from_listed_category_is_removed(self):
+        product_list = [listed(ref) for ref in range(13)]
+        partial = [detail(ref) for ref in range(5)]
+        exported = carry_forward(self.full_run, partial, product_list)
+        changes = compare_runs(self.full_run, exported)
+        self.assertEqual(list(changes['removed']['Ref']), ['13'])
+
+    def test_unlisted_categories_are_kept(self):
+        previous = self.full_run + [detail(20, category="Calefacción")]
+        partial = [detail(ref) for ref in range(14)]
+        exported = carry_forward(previous, partial, self.product_list)
+        summary = summarize_changes(compare_runs(previous, exported))
+        self.assertEqual(summary['removed'], 0)
+
+    def test_truncated_listings_remove_nothing(self):
+        partial = [detail(ref) for ref in range(3)]
+        exported = carry_forward(self.full_run, partial, self.product_list[:3], listed_categories=())
+        summary = summarize_changes(compare_runs(self.full_run, exported))
+        self.assertEqual(summary['removed'], 0)
+
+
+class ListingModeTest(unittest.TestCase):
+    """Cambiar entre el modo solo listado y el rastreo completo no debe generar altas ni bajas"""
+
+    def test_single_row_products_are_compared(self):
+        full = [detail(1), detail(2)]
+        listing = [dict(detail(1, price="11,00€"), **{'Product Variant': LISTING_VARIANT}),
+                   dict(detail(2), **{'Product Variant': LISTING_VARIANT})]
+        changes = compare_runs(full, listing)
+        self.assertEqual(summarize_changes(changes), {'added': 0, 'removed': 0, 'changed': 1})
+        self.assertEqual(list(changes['changed']['Ref']), ['1'])
+
+    def test_products_with_variants_are_skipped(self):
+        full = [dict(detail(1), **{'Product Variant': "Rojo"}), dict(detail(1), **{'Product Variant': "Azul"})]
+        listing = [dict(detail(1), **{'Product Variant': LISTING_VARIANT})]
+        self.assertEqual(summarize_changes(compare_runs(full, listing)), {'added': 0, 'removed': 0, 'changed': 0})
+        self.assertEqual(summarize_changes(compare_runs(listing, full)), {'added': 0, 'removed': 0, 'changed': 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+from bs4 import BeautifulSoup
+from luluka_extractor import (LISTING_VARIANT, SinglePassExtractor, compile_selector, extract_category_links,
+                              extract_listing_links, extract_listing_rows, extract_product_fields, product_ref,
+                              split_listing_details)
+
+LINK = "https://www.lulukabaraka.com/fitxaProducte.aspx?idproducte={}"
+
+MENU_HTML = '''
+<ul class="nav">
+  <li><a href="LlistatDeProductes.aspx?idcategoria=1"> Inst. Agua </a></li>
+  <li><a href="Contacte.aspx">Contacto</a></li>
+  <li><a href="LlistatDeProductes.aspx?idcategoria=2">Calefacción</a></li>
+</ul>
+'''
+
+LISTING_HTML = '''
+<table>
+  <tr><td><a href="fitxaProducte.aspx?idproducte=10">Válvula de bola</a></td><td>Precio: 12,50 €</td></tr>
+  <tr><td><a href="fitxaProducte.aspx?idproducte=11"><img src="x.png"></a><h4>Codo de cobre</h4></td>
+      <td><span class="price">3,20€</span><span class="stock">En stock</span></td></tr>
+  <tr><td><a href="fitxaProducte.aspx?idproducte=12"></a></td><td>Consultar</td></tr>
+  <tr><td><a href="Contacte.aspx">Contacto</a></td></tr>
+</table>
+'''
+
+PRODUCT_HTML = '''
+<h1 class="title"> Válvula de bola </h1>
+<div class="product-type">Latón</div>
+<div class="info"><span class="price">Desde</span></div>
+<span class="precio">1.234,56 €</span>
+<span class="stock">En stock</span>
+<div class="description">Cuerpo de latón
+    cromado</div>
+<div class="variants">
+  <div class="item"><span class="name">1/2"</span><span class="price">10,00 €</span></div>
+  <div class="item"><span class="name">3/4"</span></div>
+</div>
+'''
+
+BARE_PRODUCT_HTML = '''
+<h1 class="title"></h1>
+<p>Primera línea</p>
+<p>Segunda   línea</p>
+'''
+
+
+def soup_of(html):
+    return BeautifulSoup(html, 'html.parser')
+
+
+class SelectorTest(unittest.TestCase):
+
+    def run_selector(self, selector, html):
+        matches, _ = SinglePassExtractor(fields={'found': [selector]}).run(soup_of(html))
+        return [tag.get('id') for tag in matches['found'][0]]
+
+    def test_descendant_attributes_and_nth_child(self):
+        html = '''
+        <div class="menu"><ul><li id="a"></li><li id="b"></li></ul></div>
+        <ul><li id="c"></li></ul>
+        <input id="r" type="RADIO" name="variant">
+        '''
+        self.assertEqual(self.run_selector('.menu li', html), ['a', 'b'])
+        self.assertEqual(self.run_selector('.menu li:nth-child(2)', html), ['b'])
+        self.assertEqual(self.run_selector('li:first-child', html), ['a', 'c'])
+        self.assertEqual(self.run_selector('input[type="radio"][name="variant"]', html), ['r'])
+
+    def test_unsupported_selector(self):
+        with self.assertRaises(ValueError):
+            compile_selector('div > p')
+
+
+class ListingTest(unittest.TestCase):
+
+    def test_category_links_only_keep_listings(self):
+        self.assertEqual(extract_category_links(soup_of(MENU_HTML)), [
+            ("Inst. Agua", "LlistatDeProductes.aspx?idcategoria=1"),
+            ("Calefacción", "LlistatDeProductes.aspx?idcategoria=2"),
+        ])
+
+    def test_listing_links_with_name_fallbacks(self):
+        selector, found, links = extract_listing_links(soup_of(LISTING_HTML))
+        self.assertEqual(selector, 'table tr td a[href*="fitxaProducte.aspx"]')
+        self.assertEqual(found, 3)
+        self.assertEqual([name for name, _ in links], ["Válvula de bola", "Codo de cobre", "Producto 12"])
+
+    def test_listing_without_products(self):
+        self.assertEqual(extract_listing_links(soup_of(MENU_HTML)), (None, 0, []))
+
+    def test_listing_rows_take_price_from_element_or_text(self):
+        rows = extract_listing_rows(soup_of(LISTING_HTML))
+        self.assertEqual([(row['name'], row['price'], row['availability']) for row in rows], [
+            ("Válvula de bola", "12,50€", None),
+            ("Codo de cobre", "3,20€", "En stock"),
+            ("Producto 12", None, None),
+        ])
+
+
+class ProductTest(unittest.TestCase):
+
+    def test_product_fields(self):
+        fields = extract_product_fields(soup_of(PRODUCT_HTML))
+        self.assertEqual(fields['title'], "Válvula de bola")
+        self.assertEqual(fields['type'], "Latón")
+        # Se salta la primera coincidencia sin dígitos y se usa el siguiente selector
+        self.assertEqual(fields['price'], "1.234,56€")
+        self.assertEqual(fields['availability'], "En stock")
+        self.assertEqual(fields['description'], "Cuerpo de latón cromado")
+        self.assertEqual(fields['variants'], [('1/2"', "10,00€"), ('3/4"', None)])
+
+    def test_product_without_data(self):
+        fields = extract_product_fields(soup_of(BARE_PRODUCT_HTML))
+        self.assertIsNone(fields['title'])
+        self.assertEqual(fields['type'], "Variantes")
+        self.assertEqual(fields['price'], "Consultar")
+        self.assertEqual(fields['description'], "Primera línea Segunda línea")
+        self.assertIsNone(fields['variants'])
+
+
+class RefTest(unittest.TestCase):
+
+    def test_product_ref(self):
+        self.assertEqual(product_ref(LINK.format(14)), "14")
+        self.assertEqual(product_ref("fitxaProducte.aspx?IdProducte=14&sessio=9#top"), "14")
+        self.assertIsNone(product_ref("LlistatDeProductes.aspx?idcategoria=1"))
+
+    def test_split_listing_details(self):
+        with_price = {'Category': "Inst. Agua", 'Product': "Codo", 'Link': LINK.format(1),
+                      'Price': "3,20€", 'Availability': None}
+        without_price = {'Category': "Inst. Agua", 'Product': "Válvula", 'Link': LINK.format(2)}
+        details, to_fetch = split_listing_details([with_price, without_price])
+        self.assertEqual(to_fetch, [without_price])
+        self.assertEqual(len(details), 1)
+        self.assertEqual(details[0]['Ref'], "1")
+        self.assertEqual(details[0]['Product Variant'], LISTING_VARIANT)
+        self.assertEqual(details[0]['Availability'], "")
+        self.assertEqual(details[0]['Description'], "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import gc
+import os
+import unittest
+from luluka_frontier import BloomFilter, DiskSet, Frontier, SeenSet, canonicalize_url
+
+PRODUCT = "https://www.lulukabaraka.com/fitxaProducte.aspx?idproducte={}"
+
+
+class CanonicalizeUrlTest(unittest.TestCase):
+
+    def test_product_pages_keep_only_their_id(self):
+        self.assertEqual(
+            canonicalize_url("HTTPS://www.LulukaBaraka.com:443/FitxaProducte.aspx?utm_source=x&IdProducte=14&sessio=9#top"),
+            canonicalize_url(PRODUCT.format(14))
+        )
+
+    def test_listing_pages_keep_category_and_page(self):
+        url = "https://www.lulukabaraka.com/LlistatDeProductes.aspx?pagina=2&idcategoria=5&ordre=preu"
+        self.assertEqual(canonicalize_url(url),
+                         "https://www.lulukabaraka.com/llistatdeproductes.aspx?idcategoria=5&pagina=2")
+
+    def test_other_pages_only_lose_tracking_parameters(self):
+        self.assertEqual(canonicalize_url("https://www.lulukabaraka.com/Noticies.aspx?b=2&a=1&utm_medium=mail"),
+                         "https://www.lulukabaraka.com/noticies.aspx?a=1&b=2")
+
+    def test_different_products_stay_different(self):
+        self.assertNotEqual(canonicalize_url(PRODUCT.format(1)), canonicalize_url(PRODUCT.format(2)))
+
+
+class SeenSetTest(unittest.TestCase):
+
+    def test_exact_below_the_limit(self):
+        seen = SeenSet(exact_limit=10)
+        self.assertTrue(seen.add("a"))
+        self.assertFalse(seen.add("a"))
+        self.assertEqual(len(seen), 1)
+        self.assertIsNone(seen._large)
+
+    def test_spills_to_disk_by_default_and_stays_exact(self):
+        seen = SeenSet(exact_limit=5)
+        keys = [PRODUCT.format(ref) for ref in range(50)]
+        self.assertTrue(all(seen.add(key) for key in keys))
+        self.assertIsInstance(seen._large, DiskSet)
+        # Las claves anteriores al desbordamiento siguen contando como vistas
+        self.assertFalse(any(seen.add(key) for key in keys))
+        self.assertTrue(seen.add(PRODUCT.format(1000)))
+        self.assertEqual(len(seen), 51)
+        path = seen._large._temporary
+        seen.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_temporary_file_is_removed_without_close(self):
+        seen = SeenSet(exact_limit=1)
+        seen.add("a")
+        seen.add("b")
+        path = seen._large._temporary
+        del seen
+        gc.collect()
+        self.assertFalse(os.path.exists(path))
+
+    def test_bloom_is_opt_in(self):
+        seen = SeenSet(exact_limit=5, overflow='bloom', capacity=1000)
+        for ref in range(20):
+            seen.add(PRODUCT.format(ref))
+        self.assertIsInstance(seen._large, BloomFilter)
+        self.assertFalse(seen.add(PRODUCT.format(3)))
+
+    def test_invalid_overflow(self):
+        with self.assertRaises(ValueError):
+            SeenSet(overflow='memoria')
+
+
+class FrontierTest(unittest.TestCase):
+
+    def test_priority_order_and_dedupe(self):
+        frontier = Frontier()
+        self.assertTrue(frontier.add(PRODUCT.format(1), 'uno', priority=2))
+        self.assertTrue(frontier.add(PRODUCT.format(2), 'dos', priority=1))
+        self.assertTrue(frontier.add(PRODUCT.format(3), 'tres', priority=1))
+        self.assertFalse(frontier.add(PRODUCT.format(1) + "&utm_source=x", 'repetido'))
+        self.assertEqual([item for _, item in frontier], ['dos', 'tres', 'uno'])
+        frontier.close()
+
+    def test_pending_entries_spill_to_disk_in_order(self):
+        frontier = Frontier(max_pending=3)
+        priorities = [5, 1, 4, 2, 3, 0, 6]
+        for ref, priority in enumerate(priorities):
+            frontier.add(PRODUCT.format(ref), {'ref': ref}, priority=priority)
+        self.assertEqual(len(frontier), len(priorities))
+        order = [item['ref'] for _, item in frontier]
+        self.assertEqual(order, sorted(range(len(priorities)), key=lambda ref: priorities[ref]))
+        frontier.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import luluka_memo
+from luluka_memo import ExtractionMemo, content_hash
+
+PAGE = '''<html><body>
+<form><input type="hidden" name="__VIEWSTATE" value="{viewstate}">
+<input type="hidden" name="__EVENTVALIDATION" value="{validation}"></form>
+<script src="/js/app.js?v={version}"></script>
+<h1 class="title">Válvula de bola</h1>
+<span class="price">12,50 €</span>
+<span class="availability">{availability}</span>
+</body></html>'''
+
+
+def page(availability="Disponible el 15/11/2026", viewstate="abc", validation="xyz", version=1):
+    return PAGE.format(availability=availability, viewstate=viewstate, validation=validation, version=version)
+
+
+class ContentHashTest(unittest.TestCase):
+
+    def test_hidden_fields_and_cache_busters_are_ignored(self):
+        self.assertEqual(content_hash(page()), content_hash(page(viewstate="otro", validation="otra", version=2)))
+
+    def test_changed_availability_date_changes_hash(self):
+        self.assertNotEqual(content_hash(page()), content_hash(page(availability="Disponible el 20/11/2026")))
+
+    def test_internal_spacing_changes_hash(self):
+        self.assertNotEqual(content_hash(page(availability="Talla 10  x 12")),
+                            content_hash(page(availability="Talla 10 x 12")))
+
+    def test_extractor_version_is_part_of_the_key(self):
+        before = content_hash(page())
+        with mock.patch.object(luluka_memo, 'EXTRACTOR_VERSION', 'otra-version'):
+            self.assertNotEqual(content_hash(page()), before)
+
+
+class ExtractionMemoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'memo.db')
+        self.memo = ExtractionMemo(self.path)
+        self.parsed = []
+
+    def tearDown(self):
+        self.memo.close()
+        self.tmp.cleanup()
+
+    def parse(self, html):
+        self.parsed.append(html)
+        return {'availability': html.split('class="availability">')[1].split('<')[0],
+                'variants': [("Rojo", "1,00€")]}
+
+    def test_unchanged_page_is_a_hit(self):
+        self.memo.extract(page(), self.parse)
+        fields = self.memo.extract(page(viewstate="nuevo"), self.parse)
+        self.assertEqual(len(self.parsed), 1)
+        self.assertEqual((self.memo.hits, self.memo.misses), (1, 1))
+        self.assertEqual(fields['availability'], "Disponible el 15/11/2026")
+
+    def test_changed_availability_date_is_not_a_hit(self):
+        self.memo.extract(page(), self.parse)
+        fields = self.memo.extract(page(availability="Disponible el 20/11/2026"), self.parse)
+        self.assertEqual(len(self.parsed), 2)
+        self.assertEqual(self.memo.hits, 0)
+        self.assertEqual(fields['availability'], "Disponible el 20/11/2026")
+
+    def test_entries_survive_a_new_memo_on_the_same_file(self):
+        self.memo.extract(page(), self.parse)
+        self.memo.close()
+        reopened = ExtractionMemo(self.path)
+        try:
+            fields = reopened.extract(page(), self.parse)
+        finally:
+            reopened.close()
+        self.assertEqual(len(self.parsed), 1)
+        # Las variantes vuelven como tuplas, igual que las devuelve el extractor
+        self.assertEqual(fields['variants'], [("Rojo", "1,00€")])
+
+    def test_prune_keeps_the_most_recently_used_entries(self):
+        memo = ExtractionMemo(os.path.join(self.tmp.name, 'small.db'), max_entries=3, memory_entries=1)
+        try:
+            with mock.patch.object(luluka_memo, 'PRUNE_EVERY', 1):
+                for number in range(5):
+                    memo.extract(page(availability=f"Stock {number}"), self.parse)
+            count = memo._connection().execute('SELECT COUNT(*) FROM extractions').fetchone()[0]
+        finally:
+            memo.close()
+        self.assertEqual(count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import math
+import os
+import tempfile
+import unittest
+from luluka_frontier import canonicalize_url
+from luluka_scheduler import (RevisitScheduler, details_fingerprint, estimate_change_rate, extract_with_schedule,
+                              interleave_by_category)
+
+LINK = "https://www.lulukabaraka.com/fitxaProducte.aspx?idproducte={}"
+DAY = 24 * 3600
+START = 1_000_000_000
+
+
+def product(ref, category="Inst. Agua"):
+    return {'Category': category, 'Product': f"Producto {ref}", 'Link': LINK.format(ref)}
+
+
+def rows(ref, price="10,00€"):
+    return [{'Category': "Inst. Agua", 'Ref': str(ref), 'Product Variant': "Único", 'Price': price,
+             'Availability': "En stock", 'Link': LINK.format(ref)}]
+
+
+class EstimateChangeRateTest(unittest.TestCase):
+
+    def test_without_revisits_there_is_no_estimate(self):
+        self.assertIsNone(estimate_change_rate(0, 0, 0))
+        self.assertIsNone(estimate_change_rate(3, 1, 0))
+
+    def test_never_changed_is_zero(self):
+        self.assertEqual(estimate_change_rate(4, 0, 4 * DAY), 0)
+
+    def test_poisson_estimate(self):
+        # 10 revisitas diarias con 5 cambios: λ = -log(5.5 / 10.5) por día
+        rate = estimate_change_rate(10, 5, 10 * DAY)
+        self.assertAlmostEqual(rate * DAY, -math.log(5.5 / 10.5))
+        # Con cambios en todas las revisitas la estimación sigue siendo finita y mayor
+        self.assertGreater(estimate_change_rate(10, 10, 10 * DAY), rate)
+
+
+class DetailsFingerprintTest(unittest.TestCase):
+
+    def test_row_order_does_not_matter(self):
+        first = rows(1) + rows(1, "12,00€")
+        self.assertEqual(details_fingerprint(first), details_fingerprint(list(reversed(first))))
+        self.assertNotEqual(details_fingerprint(rows(1)), details_fingerprint(rows(1, "11,00€")))
+
+
+class RevisitSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.scheduler = RevisitScheduler(os.path.join(self.tmp.name, 'history.db'), max_age=30 * DAY)
+
+    def tearDown(self):
+        self.scheduler.close()
+        self.tmp.cleanup()
+
+    def visit(self, ref, prices, start=START):
+        """Descarga diaria de un producto con los precios indicados"""
+        for day, price in enumerate(prices):
+            self.scheduler.record(rows(ref, price), now=start + day * DAY)
+
+    def test_unknown_and_old_products_are_always_due(self):
+        self.visit(1, ["10,00€"] * 3)
+        key = canonicalize_url(LINK.format(1))
+        self.assertEqual(self.scheduler.change_probability(canonicalize_url(LINK.format(2)), START), 1.0)
+        self.assertEqual(self.scheduler.change_probability(key, START + 2 * DAY), 0.0)
+        self.assertEqual(self.scheduler.change_probability(key, START + 40 * DAY), 1.0)
+
+    def test_record_counts_changes(self):
+        self.visit(1, ["10,00€", "11,00€", "11,00€", "12,00€"])
+        intervals, changes, observed = self.scheduler.conn.execute(
+            'SELECT intervals, changes, observed FROM product_history'
+        ).fetchone()
+        self.assertEqual((intervals, changes, observed), (3, 2, 3 * DAY))
+
+    def test_volatile_products_first(self):
+        self.visit(1, ["10,00€", "10,00€", "10,00€", "11,00€"])
+        self.visit(2, ["10,00€", "11,00€", "12,00€", "13,00€"])
+        now = START + 4 * DAY
+        plan = self.scheduler.plan([product(1), product(2), product(3)], now=now)
+        # El producto nuevo (probabilidad 1) va delante del más volátil
+        self.assertEqual([item['Link'] for item in plan], [LINK.format(3), LINK.format(2), LINK.format(1)])
+
+    def test_unchanged_products_fill_the_budget_oldest_first(self):
+        self.visit(1, ["10,00€"] * 3, start=START)
+        self.visit(2, ["10,00€"] * 3, start=START - 5 * DAY)
+        self.visit(3, ["10,00€", "11,00€", "12,00€"])
+        now = START + 3 * DAY
+        plan = self.scheduler.plan([product(1), product(2), product(3)], budget=2, now=now)
+        self.assertEqual([item['Link'] for item in plan], [LINK.format(3), LINK.format(2)])
+        # Sin presupuesto no se descarta ninguno
+        self.assertEqual(len(self.scheduler.plan([product(1), product(2), product(3)], now=now)), 3)
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def test_interleave_by_category(self):
+        products = [product(1, "A"), product(2, "A"), product(3, "A"), product(4, "B"), product(5, "C")]
+        order = [item['Link'] for item in interleave_by_category(products)]
+        self.assertEqual(order, [LINK.format(ref) for ref in (1, 4, 5, 2, 3)])
+        self.assertEqual(interleave_by_category([]), [])
+
+    def test_extract_with_schedule_records_history(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'history.db')
+            requested = []
+
+            def extract(products):
+                requested.append([item['Link'] for item in products])
+                return [row for item in products for row in rows(item['Link'].rsplit('=', 1)[1])]
+
+            details = extract_with_schedule(extract, [product(1), product(2), product(3)], budget=2, path=path)
+            self.assertEqual(len(requested[0]), 2)
+            self.assertEqual(len(details), 2)
+            scheduler = RevisitScheduler(path)
+            try:
+                known = scheduler.conn.execute('SELECT COUNT(*) FROM product_history').fetchone()[0]
+            finally:
+                scheduler.close()
+            self.assertEqual(known, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
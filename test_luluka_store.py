@@ -0,0 +1,108 @@
+import os
+import tempfile
+import unittest
+from luluka_extractor import SITEMAP_CATEGORY
+from luluka_store import ResultStore, parse_price
+
+LINK = "https://www.lulukabaraka.com/fitxaProducte.aspx?idproducte={}"
+
+
+def detail(ref, variant, price="10,00€", product="Válvula de bola", category="Inst. Agua", description=""):
+    return {
+        'Category': category,
+        'Ref': str(ref),
+        'Product': product,
+        'Type': "",
+        'Product Variant': variant,
+        'Variant': "",
+        'Price': price,
+        'Availability': "En stock",
+        'Description': description,
+        'Link': LINK.format(ref),
+    }
+
+
+class ParsePriceTest(unittest.TestCase):
+
+    def test_spanish_format(self):
+        self.assertEqual(parse_price("1.234,56€"), 1234.56)
+        self.assertEqual(parse_price("12,5 €"), 12.5)
+        self.assertEqual(parse_price("1.234.567€"), 1234567.0)
+
+    def test_not_a_price(self):
+        self.assertIsNone(parse_price("Consultar"))
+        self.assertIsNone(parse_price(None))
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ResultStore(os.path.join(self.tmp.name, 'store.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_latest_prices_and_history(self):
+        self.store.save_run([], [], [detail(1, "1/2\""), detail(1, "3/4\"", "12,00€")], observed_at="2026-10-01T10:00:00")
+        self.store.save_run([], [], [detail(1, "1/2\"", "11,00€")], observed_at="2026-10-02T10:00:00")
+        latest = self.store.latest_prices()
+        self.assertEqual([(row['variant'], row['price_value']) for row in latest], [("1/2\"", 11.0)])
+        history = self.store.price_history("1", days=100000, variant="1/2\"")
+        self.assertEqual([row['price_value'] for row in history], [10.0, 11.0])
+
+    def test_empty_description_keeps_previous_one(self):
+        self.store.save_run([], [], [detail(1, "A", description="Latón cromado")])
+        self.store.save_run([], [], [detail(1, "A", description="")])
+        self.assertEqual(self.store.search_products()[0]['description'], "Latón cromado")
+
+    def test_sitemap_category_does_not_overwrite_known_category(self):
+        self.store.save_run([], [], [detail(1, "A")])
+        self.store.save_run([], [], [detail(1, "A", category=SITEMAP_CATEGORY)])
+        self.assertEqual(self.store.search_products()[0]['category'], "Inst. Agua")
+
+    def test_search_after_two_runs(self):
+        self.store.save_run([], [], [
+            detail(1, "1/2\"", product="Válvula de bola", description="Cuerpo de latón"),
+            detail(2, "Único", product="Codo de cobre", category="Calefacción"),
+        ])
+        # La segunda ejecución renombra un producto y añade una variante: solo se reindexa lo visto
+        self.store.save_run([], [], [
+            detail(1, "1/2\"", product="Válvula esfera", description="Cuerpo de latón"),
+            detail(1, "3/4\"", product="Válvula esfera", description="Cuerpo de latón"),
+        ])
+
+        results = self.store.search("valvula")
+        self.assertEqual(sorted(row['variant'] for row in results), ["1/2\"", "3/4\""])
+        self.assertEqual({row['product'] for row in results}, {"Válvula esfera"})
+        self.assertEqual(self.store.search("bola"), [])
+        # Prefijos, sin acentos y con filtro de categoría
+        self.assertEqual([row['ref'] for row in self.store.search("cob")], ["2"])
+        self.assertEqual(self.store.search("cobre", category="Inst. Agua"), [])
+        self.assertEqual(len(self.store.search("laton esf")), 2)
+
+    def test_search_ignores_query_syntax(self):
+        self.store.save_run([], [], [detail(1, "A", product="Codo de cobre")])
+        self.assertEqual(len(self.store.search('codo" (cobre*')), 1)
+        self.assertEqual(self.store.search('"*'), [])
+
+    def test_existing_history_is_indexed_on_open(self):
+        path = os.path.join(self.tmp.name, 'old.db')
+        store = ResultStore(path)
+        store.save_run([], [], [detail(1, "A", product="Codo de cobre")])
+        if not store.has_search_index:
+            store.close()
+            self.skipTest("SQLite sin FTS5")
+        store.conn.execute('DELETE FROM product_search')
+        store.conn.commit()
+        store.close()
+        reopened = ResultStore(path)
+        try:
+            self.assertEqual(len(reopened.search("cobre")), 1)
+        finally:
+            reopened.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from luluka_transport import CircuitBreaker, Deadline, DeadlineExceeded
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def open_breaker(self, **kwargs):
+        breaker = CircuitBreaker(failure_threshold=2, **kwargs)
+        breaker.record_failure()
+        breaker.record_failure()
+        return breaker
+
+    def test_opens_after_threshold_and_closes_on_success(self):
+        breaker = self.open_breaker(cooldown=0.05)
+        self.assertTrue(breaker.is_open)
+        self.assertGreater(breaker.before_request(on_pause=None), 0)
+        self.assertTrue(breaker.half_open)
+        breaker.record_success()
+        self.assertFalse(breaker.is_open)
+        self.assertEqual(breaker.before_request(on_pause=None), 0)
+
+    def test_only_one_probe_after_cooldown(self):
+        breaker = self.open_breaker(cooldown=0.05)
+        probes = []
+
+        def request(name):
+            breaker.before_request(on_pause=None)
+            probes.append(name)
+
+        threads = [threading.Thread(target=request, args=(n,)) for n in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.3)
+        # Pasada la pausa solo sale una petición; el resto espera a que termine
+        self.assertEqual(len(probes), 1)
+        breaker.record_success()
+        for thread in threads:
+            thread.join(1)
+        self.assertEqual(len(probes), 5)
+
+    def test_failed_probe_doubles_the_pause(self):
+        breaker = self.open_breaker(cooldown=0.05)
+        breaker.before_request(on_pause=None)
+        breaker.record_failure()
+        self.assertFalse(breaker.half_open)
+        self.assertAlmostEqual(breaker.cooldown, 0.1)
+        self.assertTrue(breaker.is_open)
+
+    def test_lost_probe_lets_another_one_through(self):
+        breaker = self.open_breaker(cooldown=0, probe_timeout=0.05)
+        breaker.before_request(on_pause=None)
+        # La prueba nunca registra resultado: pasado probe_timeout sale otra
+        self.assertGreater(breaker.before_request(on_pause=None), 0)
+        self.assertTrue(breaker.half_open)
+
+    def test_waiting_stops_at_the_deadline(self):
+        breaker = self.open_breaker(cooldown=0)
+        breaker.before_request(on_pause=None)
+        deadline = Deadline(0.05)
+        with self.assertRaises(DeadlineExceeded):
+            breaker.before_request(on_pause=None, deadline=deadline)
+
+    def test_pause_is_announced_once(self):
+        breaker = self.open_breaker(cooldown=0.05)
+        messages = []
+        breaker.before_request(on_pause=messages.append)
+        self.assertEqual(len(messages), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import types
+import unittest
+from unittest import mock
+import luluka_workqueue
+from luluka_workqueue import WorkQueue, worker_main
+
+LINK = "https://www.lulukabaraka.com/fitxaProducte.aspx?idproducte={}"
+
+
+def product(ref):
+    return {'Category': "Inst. Agua", 'Product': f"Producto {ref}", 'Link': LINK.format(ref)}
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'queue.db')
+        self.queue = WorkQueue(self.path, lease_seconds=10, max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def test_same_url_is_queued_once(self):
+        self.assertEqual(self.queue.add('product', [product(1), product(1), product(2)]), 2)
+        # Una URL que solo difiere en la forma (un '&' final) es la misma tarea
+        self.assertEqual(self.queue.add('product', [dict(product(1), Link=LINK.format(1) + "&")]), 0)
+
+    def test_categories_are_claimed_before_products(self):
+        self.queue.add('product', [product(1)])
+        self.queue.add('category', [{'Category': "Inst. Agua", 'Link': "https://x/LlistatDeProductes.aspx?idcategoria=1"}])
+        _, kind, _ = self.queue.claim('w1')
+        self.assertEqual(kind, 'category')
+
+    def test_expired_lease_is_reclaimed_by_another_worker(self):
+        self.queue.add('product', [product(1)])
+        task_id, _, _ = self.queue.claim('w1', now=1000)
+        self.assertIsNone(self.queue.claim('w2', now=1005))
+        reclaimed = self.queue.claim('w2', now=1011)
+        self.assertEqual(reclaimed[0], task_id)
+        # El resultado tardío del primer trabajador se descarta
+        self.assertFalse(self.queue.complete(task_id, 'w1', []))
+        self.assertTrue(self.queue.complete(task_id, 'w2', [{'Ref': "1"}]))
+        self.assertEqual(self.queue.results('product'), [(product(1), [{'Ref': "1"}])])
+
+    def test_failed_task_is_retried_until_max_attempts(self):
+        self.queue.add('product', [product(1)])
+        task_id, _, _ = self.queue.claim('w1')
+        self.queue.fail(task_id, 'w1', "timeout")
+        self.assertEqual(self.queue.counts(), {'pending': 1})
+        task_id, _, _ = self.queue.claim('w1')
+        self.queue.fail(task_id, 'w1', "timeout")
+        self.assertEqual(self.queue.counts(), {'failed': 1})
+        self.assertEqual(self.queue.unfinished(), 0)
+
+
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'queue.db')
+        queue = WorkQueue(self.path)
+        queue.add('product', [product(1), product(2)])
+        queue.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_worker(self, extract, dead):
+        scraper = types.SimpleNamespace(
+            REQUEST_PAUSE=1,
+            fetch_html=lambda url: "",
+            extract_product_details=extract,
+            dead_urls=types.SimpleNamespace(is_dead=lambda url: url in dead),
+        )
+        with mock.patch.object(luluka_workqueue, 'load_scraper', return_value=scraper):
+            worker_main(self.path, 'w1', min_interval=0)
+        queue = WorkQueue(self.path)
+        try:
+            return scraper, queue.counts(), queue.results('product')
+        finally:
+            queue.close()
+
+    def test_gone_product_is_done_without_rows(self):
+        rows = {LINK.format(1): [{'Ref': "1"}]}
+        scraper, counts, results = self.run_worker(lambda items: rows.get(items[0]['Link'], []),
+                                                   dead={LINK.format(2)})
+        self.assertEqual(counts, {'done': 2})
+        self.assertEqual([result for _, result in results], [[{'Ref': "1"}], []])
+        # El límite común de peticiones sustituye a la pausa fija del script
+        self.assertEqual(scraper.REQUEST_PAUSE, 0)
+
+    def test_product_without_data_is_retried(self):
+        _, counts, _ = self.run_worker(lambda items: [], dead=set())
+        self.assertEqual(counts, {'failed': 2})
+
+
+if __name__ == "__main__":
+    unittest.main()